@@ -4,6 +4,8 @@ import json
 
 from pylib.log import log
 from pylib.request import request
+from pylib.api.feishu_dedup import FeishuDeduplicator
+from pylib.api.feishu_dispatcher import FeishuDispatcher
 
 
 class FeishuApi:
@@ -12,6 +14,11 @@ class FeishuApi:
     headers = {
         "Content-Type": "application/json; charset=utf-8"
     }
+    coalesce_window = float(os.getenv('feishu-api.coalesce.window', 10))   # send_async合并窗口（秒）
+    rate_per_minute = 100   # 自定义机器人频率限制：100次/分钟，5次/秒
+    rate_burst = 5
+    _dispatcher = None
+    dedup = None    # 消息去重，enable_dedup()后生效
 
     @staticmethod
     def _get_card_text_data(title, msg):
@@ -77,20 +84,64 @@ class FeishuApi:
 
         return data
 
+    @classmethod
+    def enable_dedup(cls, ttl: float = 300, maxsize: int = 1024) -> FeishuDeduplicator:
+        """开启消息去重：相同告警（忽略时间戳、ID等易变片段）在ttl秒内只发送一次，到期后补发被抑制条数的汇总
+        汇总经send_async的发送队列发出，不阻塞调用方"""
+        dispatcher = cls._get_dispatcher()  # 先于去重器创建：进程退出时去重器先flush，发送队列后关闭
+        cls.dedup = FeishuDeduplicator(dispatcher.submit, ttl=ttl, maxsize=maxsize)
+        return cls.dedup
+
+    @classmethod
+    def _post(cls, msg, title='', url='', msg_type='post'):
+        """发送消息（不经过去重）"""
+        data = {"msg_type": "text", "content": {"text": msg}}
+        if msg_type == 'post':
+            data = cls._get_post_text_data(title, msg)
+        elif msg_type == 'interactive':
+            data = cls._get_card_text_data(title, msg)
+        response = request.post(url, headers=cls.headers, data=json.dumps(data))
+        log.info('飞书消息通知结果', response.status_code, response.text)
+        return response.json()
+
     @classmethod
     def send(cls, msg, title='', url='', msg_type='post'):
         """向飞书发送通知
         :Params msg: 发送的文本，以Markdown格式传入
         :Params url: 详情链接
         :Params title: 消息标题
+        :Params msg_type: post、text或interactive（卡片）
+        :return: 飞书返回结果；开启去重且为重复消息时返回None
         """
         # 0. 参数准备
         url = url or cls.robot_url     # 选择发向哪个机器人
+        if cls.dedup is not None and not cls.dedup.admit(msg, title=title, url=url, msg_type=msg_type):
+            log.debug('飞书消息重复，已抑制', title)
+            return None
 
         # 1. 发送消息
-        data = {"msg_type": "text", "content": {"text": msg}}
-        if msg_type == 'post':
-            data = cls._get_post_text_data(title, msg)
-        response = request.post(url, headers=cls.headers, data=json.dumps(data))
-        log.info('飞书消息通知结果', response.status_code, response.text)
-        return response.json()
+        return cls._post(msg, title=title, url=url, msg_type=msg_type)
+
+    @classmethod
+    def _get_dispatcher(cls) -> FeishuDispatcher:
+        if cls._dispatcher is None:
+            cls._dispatcher = FeishuDispatcher(cls._post, window=cls.coalesce_window,
+                                               rate_per_minute=cls.rate_per_minute, burst=cls.rate_burst)
+        return cls._dispatcher
+
+    @classmethod
+    def send_async(cls, msg, title='', url='', msg_type='post'):
+        """异步发送飞书通知，立即返回
+            同一机器人、同一标题的第一条消息立即发送，随后coalesce_window秒内的消息合并为一条卡片发送（标题带次数，重复内容计数、过多内容折叠），
+            并按机器人频率限制排队发送；进程退出时自动flush。
+        :Params 同send
+        """
+        url = url or cls.robot_url
+        if cls.dedup is not None and not cls.dedup.admit(msg, title=title, url=url, msg_type=msg_type):
+            return
+        cls._get_dispatcher().submit(msg, title=title, url=url, msg_type=msg_type)
+
+    @classmethod
+    def flush(cls, timeout: float = None) -> bool:
+        """立即发送send_async中合并等待的消息，并等待发送完成；超时返回False"""
+        return cls._dispatcher is None or cls._dispatcher.flush(timeout)
@@ -0,0 +1,125 @@
+import re
+import time
+import atexit
+import threading
+
+from collections import OrderedDict
+
+from pylib.log import log
+
+
+class FeishuDeduplicator:
+    """飞书消息去重：相同告警在ttl秒内只发送一次
+        key为(url, msg_type, 归一化后的msg)，归一化会去掉时间戳、sha（含数字的7位以上十六进制串）、uuid、6位以上的长数字等易变片段，
+        因此“同一条件反复触发”产生的告警会被识别为重复；HTTP状态码、端口号等短数字保留。
+        ttl到期后，若期间有被抑制的重复消息，由后台线程补发一条“已抑制N条重复”的汇总（之后没有新消息也会补发）。
+        记录按首次出现的顺序保存（即到期顺序），超过maxsize时淘汰最早到期的记录（同样补发汇总）；进程退出时flush。
+    使用方法：
+        FeishuApi.enable_dedup(ttl=300)
+        FeishuApi.send(msg, title)     # 重复消息返回None
+    """
+    # 归一化规则：(正则, 替换文本)，按顺序执行
+    normalize_patterns = [
+        (re.compile(r'\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}(:\d{2}(\.\d+)?)?(Z|[+-]\d{2}:?\d{2})?'), '<time>'),
+        (re.compile(r'\b\d{1,2}:\d{2}:\d{2}(\.\d+)?\b'), '<time>'),
+        (re.compile(r'\b[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\b'), '<uuid>'),
+        (re.compile(r'\b(?=[a-f]*\d)(?=\d*[a-f])[0-9a-f]{7,64}\b'), '<sha>'),  # 同时含数字和字母，不误伤deadbeef等单词
+        (re.compile(r'\d{6,}'), '<n>'),
+    ]
+
+    def __init__(self, send_func, ttl: float = 300, maxsize: int = 1024):
+        """
+        :params send_func: 发送汇总消息的函数，send_func(msg, title=, url=, msg_type=)，应当不阻塞（如FeishuDispatcher.submit）
+        :params ttl: 去重时间窗口（秒）
+        :params maxsize: 最多记录的消息数
+        """
+        self._send_func = send_func
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._cond = threading.Condition()
+        self._entries = OrderedDict()   # key -> {'expires', 'suppressed', 'url', 'title', 'msg'}
+        self._stats = {'sent': 0, 'suppressed': 0, 'summaries': 0}
+        self._thread = None     # 到期补发汇总的后台线程，首次抑制时启动
+        atexit.register(self.flush)
+
+    @classmethod
+    def normalize(cls, msg: str) -> str:
+        for pattern, repl in cls.normalize_patterns:
+            msg = pattern.sub(repl, msg)
+        return msg
+
+    def admit(self, msg, title='', url='', msg_type='post') -> bool:
+        """判断消息是否应发送：首次出现返回True，ttl内重复返回False"""
+        key = (url, msg_type, self.normalize(msg))
+        now = time.time()
+        with self._cond:
+            expired = self._expire(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                if not entry['suppressed']:     # 该记录到期时需要补发汇总
+                    self._start()
+                    self._cond.notify_all()
+                entry['suppressed'] += 1
+                entry['msg'] = msg  # 汇总中展示最近一次的内容；不调整顺序，保持按到期时间排列
+                self._stats['suppressed'] += 1
+            else:
+                self._entries[key] = {'expires': now + self.ttl, 'suppressed': 0, 'url': url, 'title': title, 'msg': msg}
+                self._stats['sent'] += 1
+                while len(self._entries) > self.maxsize:
+                    expired.append(self._entries.popitem(last=False)[1])
+        self._summarize(expired)
+        return entry is None
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='feishu_dedup', daemon=True)
+            self._thread.start()
+
+    def _loop(self):
+        """到期记录的汇总不依赖下一次admit：等到最早一条记录到期时移除，有抑制的补发汇总"""
+        while True:
+            with self._cond:
+                now = time.time()
+                expired = self._expire(now)
+                if not expired:
+                    next_expires = self._entries and next(iter(self._entries.values()))['expires']
+                    self._cond.wait(next_expires - now if next_expires else None)
+                    continue
+            self._summarize(expired)
+
+    def _expire(self, now) -> list:
+        """移除到期的记录，返回其中有被抑制消息的记录；记录按到期时间排列，从头部弹出到第一条未到期的为止"""
+        expired = []
+        while self._entries:
+            entry = next(iter(self._entries.values()))
+            if entry['expires'] > now:
+                break
+            self._entries.popitem(last=False)
+            if entry['suppressed']:
+                expired.append(entry)
+        return expired
+
+    def _summarize(self, entries):
+        """为到期记录补发“已抑制N条重复”的汇总"""
+        for entry in entries:
+            if not entry['suppressed']:
+                continue
+            with self._cond:
+                self._stats['summaries'] += 1
+            try:
+                self._send_func(f"{entry['msg']}\n\n（过去{self.ttl:g}秒内重复出现{entry['suppressed']}次，已抑制）",
+                                title=f"{entry['title']} (已抑制 {entry['suppressed']} 条重复)",
+                                url=entry['url'], msg_type='post')
+            except Exception as e:
+                log.exception('飞书去重汇总发送失败', entry['title'], e=e)
+
+    def flush(self):
+        """立即为所有记录补发汇总并清空（如进程退出前）"""
+        with self._cond:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        self._summarize(entries)
+
+    def metrics(self) -> dict:
+        with self._cond:
+            return {**self._stats, 'entries': len(self._entries)}
@@ -0,0 +1,169 @@
+import time
+import atexit
+import threading
+
+from collections import OrderedDict
+
+from pylib.log import log
+
+
+class TokenBucket:
+    """令牌桶限流：每分钟rate_per_minute个令牌，最多累积burst个"""
+
+    def __init__(self, rate_per_minute: float, burst: int = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = burst or rate_per_minute
+        self.tokens = float(self.capacity)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def try_acquire(self) -> float:
+        """不阻塞地获取一个令牌：成功返回0，否则返回需等待的秒数"""
+        with self._lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+
+class FeishuDispatcher:
+    """飞书消息后台发送队列
+        1. 同一(url, title)距上次发送超过window秒的消息立即发送；window秒内随后的消息合并为一条卡片，在窗口结束时发送：
+           标题带次数，正文按内容去重计数，超出max_lines的折叠。
+        2. 每个机器人url一个令牌桶，遵守飞书自定义机器人的频率限制（100次/分钟，5次/秒）；
+           超出频率的消息留在队列中继续合并，到可发送时再发，不阻塞其他机器人。
+        3. 后台守护线程发送，调用方不阻塞；进程退出时flush。
+    """
+
+    def __init__(self, send_func, window: float = 10, rate_per_minute: float = 100, burst: int = 5,
+                 max_lines: int = 10, exit_timeout: float = 10):
+        """
+        :params send_func: 实际发送函数，send_func(msg, title=, url=, msg_type=)
+        :params window: 合并窗口（秒），0表示不合并
+        :params rate_per_minute: 每个机器人每分钟最多发送的条数
+        :params burst: 每个机器人瞬时最多发送的条数
+        :params max_lines: 合并消息正文最多展示的不同消息条数
+        :params exit_timeout: 进程退出时flush的最长等待时间（秒）
+        """
+        self._send_func = send_func
+        self.window = window
+        self.rate_per_minute = rate_per_minute
+        self.burst = burst
+        self.max_lines = max_lines
+        self.exit_timeout = exit_timeout
+        self._buckets = OrderedDict()   # (url, title) -> {'msg_type', 'messages': {msg: count}, 'count', 'deadline'}
+        self._limiters = {}     # url -> TokenBucket
+        self._window_ends = {}  # (url, title) -> 合并窗口结束时间：此前到达的消息合并，此后到达的立即发送
+        self._sending = 0   # 正在发送的条数
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._loop, name='feishu_dispatcher', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, msg, title='', url='', msg_type='post'):
+        """提交消息，立即返回；关闭后提交的消息在调用方线程中直接发送（不再合并、限流）"""
+        with self._cond:
+            if not self._closed:
+                bucket = self._buckets.get((url, title))
+                if bucket is None:
+                    now = time.time()
+                    window_end = self._window_ends.get((url, title), 0)
+                    bucket = self._buckets[(url, title)] = {
+                        'msg_type': msg_type, 'messages': OrderedDict(), 'count': 0, 'deadline': max(window_end, now)}
+                if msg in bucket['messages'] or len(bucket['messages']) < self.max_lines:
+                    bucket['messages'][msg] = bucket['messages'].get(msg, 0) + 1
+                bucket['count'] += 1
+                self._cond.notify_all()
+                return
+        log.warning('飞书消息发送队列已关闭，直接发送', title)
+        self._send_func(msg, title=title, url=url, msg_type=msg_type)
+
+    def _merge(self, title, bucket):
+        """合并为一条消息：返回(msg, title, msg_type)"""
+        if bucket['count'] == 1:
+            return next(iter(bucket['messages'])), title, bucket['msg_type']
+        lines = [f"{msg} **(x{cnt})**" if cnt > 1 else msg for msg, cnt in bucket['messages'].items()]
+        folded = bucket['count'] - sum(bucket['messages'].values())
+        if folded:
+            lines.append(f"...另有 {folded} 条消息已折叠")
+        return '\n'.join(lines), f"{title} (x{bucket['count']})", 'interactive'
+
+    def _pop_due(self, force=False):
+        """取出到期且未超出频率限制的合并消息；超出频率的推迟到可发送时（期间继续合并）"""
+        now = time.time()
+        output = []
+        for key, bucket in list(self._buckets.items()):
+            if not force and bucket['deadline'] > now:
+                continue
+            limiter = self._limiters.get(key[0])
+            if limiter is None:
+                limiter = self._limiters[key[0]] = TokenBucket(self.rate_per_minute, self.burst)
+            wait = limiter.try_acquire()
+            if wait:
+                bucket['deadline'] = now + wait
+                continue
+            output.append((key, self._buckets.pop(key)))
+            self._window_ends[key] = now + self.window  # 窗口内随后的消息合并
+        for key in [key for key, window_end in self._window_ends.items() if window_end <= now]:
+            del self._window_ends[key]
+        return output
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while True:
+                    due = self._pop_due(force=self._closed)
+                    if due or (self._closed and not self._buckets):
+                        break
+                    # 关闭时仍遵守频率限制：等待最早可发送的时间
+                    deadline = min((b['deadline'] for b in self._buckets.values()), default=None)
+                    self._cond.wait(None if deadline is None else max(deadline - time.time(), 0))
+                if not due and self._closed:
+                    return
+                self._sending += len(due)
+            for (url, title), bucket in due:
+                msg, title, msg_type = self._merge(title, bucket)
+                try:
+                    self._send_func(msg, title=title, url=url, msg_type=msg_type)
+                except Exception as e:
+                    log.exception('飞书消息发送失败', title, e=e)
+                finally:
+                    with self._cond:
+                        self._sending -= 1
+                        self._cond.notify_all()
+
+    @property
+    def pending(self) -> int:
+        """待发送（含合并中）的消息条数"""
+        with self._cond:
+            return sum(b['count'] for b in self._buckets.values()) + self._sending
+
+    def flush(self, timeout: float = None) -> bool:
+        """立即发送所有合并中的消息，并等待发送完成；超时返回False"""
+        deadline = timeout is not None and time.time() + timeout
+        with self._cond:
+            for bucket in self._buckets.values():
+                bucket['deadline'] = 0
+            self._cond.notify_all()
+            while self._buckets or self._sending:
+                wait = deadline and deadline - time.time()
+                if deadline and wait <= 0:
+                    return False
+                self._cond.wait(wait or None)
+        return True
+
+    def close(self):
+        """停止接收并发送剩余消息（进程退出时自动调用）"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(self.exit_timeout)
@@ -1,13 +1,22 @@
 import os
+import re
 import json
+import time
+import codecs
+import tarfile
 import aiohttp
 import requests
 import urllib.parse
 
 from enum import IntEnum, unique
+from collections import OrderedDict
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 from pylib.log import log
-from pylib.request import request
+from pylib.request import request, record_type
+from pylib.api.gitlab_cache import GitlabImmutableCache
+from pylib.api.gitlab_index import GitlabIndex
 
 
 @unique
@@ -27,6 +36,23 @@ class GitlabAccessLevel(IntEnum):
         return int(self.value)
 
 
+class _TraceCursor:
+    """作业日志的增量读取位置"""
+    __slots__ = ('offset', 'decoder', 'pending')
+
+    def __init__(self):
+        self.offset = 0     # 已读取的字节数
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')  # 处理被切分在两次读取之间的多字节字符
+        self.pending = ''   # 尚未遇到换行符的半行
+
+
+class GitlabFiles(dict):
+    """仓库文件：路径 -> 文件内容（bytes），按需解码为文本"""
+
+    def text(self, path, encoding='utf-8', errors='strict') -> str:
+        return self[path].decode(encoding, errors)
+
+
 class GitlabApi:
     url = os.getenv("gitlab-api.url")
     _headers = {
@@ -38,9 +64,62 @@ class GitlabApi:
     params = {
         "per_page": 100
     }
+    page_workers = 8    # 并发翻页的线程数上限
+    page_retries = 2    # 单页失败（5xx、429、连接异常）时的重试次数
+    page_retry_interval = 1     # 重试间隔（秒），按次数递增
+    # 未返回X-Total-Pages时（如超过1万条），回退到keyset分页的接口及其要求的排序参数
+    keyset_params = [
+        (r'/projects$', {"order_by": "id", "sort": "asc"}),
+        (r'/groups$', {"order_by": "name", "sort": "asc"}),
+        (r'/users$', {"order_by": "id", "sort": "asc"}),
+        (r'/projects/[^/]+/jobs$', {"order_by": "id", "sort": "desc"}),
+    ]
+    _trace_cursors = OrderedDict()  # (project_id, job_id) -> _TraceCursor，tail_trace的读取位置（LRU）
+    trace_cursor_limit = 1024   # 最多记录的作业数，超出时淘汰最久未读的
+    # slim模式默认保留的字段
+    slim_project_fields = ['id', 'path_with_namespace', 'default_branch']
+    slim_group_fields = ['id', 'full_path', 'name']
+    archive_threshold = 3   # 批量获取文件时，文件数不超过该值则逐个获取，否则下载归档
+    runner_workers = 8  # Runner快照并发查询的线程数上限
+    member_workers = 8  # 批量成员操作的并发线程数上限
+    index = None    # 本地名称索引（GitlabIndex），调用enable_index后启用
+    cache = None    # 不可变对象缓存（GitlabImmutableCache），调用enable_cache后启用
+    commit_mutable_fields = ['last_pipeline', 'status']     # 提交详情中会变化的字段，不写入缓存
+
+    @classmethod
+    def enable_index(cls, path: str = None, **kwargs) -> GitlabIndex:
+        """启用本地名称索引：项目/群组的名称解析改为字典查找
+        :params path: 索引持久化文件路径
+        :params kwargs: 见GitlabIndex"""
+        cls.index = GitlabIndex(cls, path=path, **kwargs)
+        return cls.index
+
+    @classmethod
+    def enable_cache(cls, path: str = None, **kwargs) -> GitlabImmutableCache:
+        """启用不可变对象缓存：完整sha的提交、已解析为sha的比较结果不再重复请求
+        :params path: sqlite文件路径
+        :params kwargs: 见GitlabImmutableCache"""
+        cls.cache = GitlabImmutableCache(path=path, **kwargs)
+        return cls.cache
+
+    @staticmethod
+    def _slim_fields(fields, slim, default):
+        """slim模式下将字段列表转为紧凑记录类型（namedtuple），解析时即完成投影"""
+        return record_type(*(fields or default)) if slim else fields
+
+    @staticmethod
+    def _cached_response(url, content: bytes) -> requests.Response:
+        """由缓存内容构造响应，保持与网络请求相同的返回类型"""
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response.encoding = 'utf-8'
+        response.headers['Content-Type'] = 'application/json'
+        response._content = content
+        return response
 
     def heartbeat(self):
-        return requests.get(f"{self.url}/projects", timeout=5).status_code == 200
+        return request.get(f"{self.url}/projects", timeout=5).status_code == 200
 
     def _search(self, search, scope='projects'):
         """ The scope to search in. Values include
@@ -48,7 +127,7 @@ class GitlabApi:
             blobs, commits, notes, wiki_blobs
         """
         params = {"scope": scope, "search": search}
-        response = requests.get(f"{self.url}/search", params=params, headers=self._headers)
+        response = request.get(f"{self.url}/search", params=params, headers=self._headers)
         return json.loads(response.text)
 
     """项目组操作"""
@@ -57,7 +136,14 @@ class GitlabApi:
             1. 根据项目组名调用模糊匹配API。（没有完全匹配）
             2. 过滤出项目组名相等的项目，并返回。
             3. 无匹配则返回{}
+            启用索引时，直接从索引解析群组id
         """
+        if self.index is not None:
+            group_id = self.index.get_group_id(group_name)
+            if group_id is None:
+                return {}
+            return request.get(f"{self.url}/groups/{group_id}", params={"with_projects": "false"},
+                               headers=self._headers).json()
         for group in self._groups(group_name):
             if group['name'] == group_name:
                 return group
@@ -65,25 +151,31 @@ class GitlabApi:
 
     def _groups(self, group_name):
         params = {"search": group_name}
-        response = requests.get(f"{self.url}/groups", params=params, headers=self._headers)
+        response = request.get(f"{self.url}/groups", params=params, headers=self._headers)
         return json.loads(response.text)
 
     def _create_group(self, group_name):
         data = {"name": group_name, "path": group_name, "visibility": "private"}
-        response = requests.post(f"{self.url}/groups", headers=self._headers, data=data, timeout=5)
+        response = request.post(f"{self.url}/groups", headers=self._headers, data=data, timeout=5)
+        if self.index is not None and response.status_code == 201:
+            self.index.add_group(response.json())
         return json.loads(response.text)
 
     """项目操作"""
     @classmethod
     def get_project(cls, project_id):
-        return requests.get(f"{cls.url}/projects/{project_id}", params=cls.params, headers=cls._headers)
+        return request.get(f"{cls.url}/projects/{project_id}", params=cls.params, headers=cls._headers)
 
     def get_project_from_name(self, project_name, group_name: str = ''):
         """ 获取项目
             1. 根据项目名调用模糊匹配API。（没有完全匹配）
             2. 过滤出项目名相等的项目，并返回。
             3. 无匹配则返回{}
+            启用索引时，直接从索引解析项目id
         """
+        if self.index is not None:
+            project_id = self.index.get_project_id_from_name(project_name, group_name)
+            return self.get_project(project_id).json() if project_id is not None else {}
         if group_name == '':
             projects = self._search(project_name)
         else:
@@ -92,29 +184,42 @@ class GitlabApi:
         return (projects and projects[0]) or {}
 
     def _projects(self, group, project):
-        response = requests.get(f"{self.url}/groups/", params={"search": group}, headers=self._headers)
-        return requests.get(f"{self.url}/groups/{response.json()[0]['id']}/projects",
-                            params={"search": project}, headers=self._headers).json()
+        response = request.get(f"{self.url}/groups/", params={"search": group}, headers=self._headers)
+        return request.get(f"{self.url}/groups/{response.json()[0]['id']}/projects",
+                           params={"search": project}, headers=self._headers).json()
 
     @classmethod
     def projects(cls, params):
-        return requests.get(f"{cls.url}/projects/", params=params, headers=cls._headers).json()
+        return request.get(f"{cls.url}/projects/", params=params, headers=cls._headers).json()
 
     @classmethod
-    def get_projects_with_namespace(cls, search, search_namespaces=True):
-        """ 获取项目：根据命名空间path_with_namespace匹配
+    def iter_projects_with_namespace(cls, search, search_namespaces=True):
+        """ 逐个获取项目：根据命名空间path_with_namespace匹配；调用方提前退出时不再请求后续页
         """
         params = {
             "search": search,
             "search_namespaces": search_namespaces,
             'per_page': 100
         }
-        return list(filter(lambda p: search == p['path_with_namespace'], cls.projects(params)))
+        return (p for p in cls.iter_all(f"{cls.url}/projects/", params) if search == p['path_with_namespace'])
+
+    @classmethod
+    def get_projects_with_namespace(cls, search, search_namespaces=True):
+        """ 获取项目：根据命名空间path_with_namespace匹配
+        """
+        return list(cls.iter_projects_with_namespace(search, search_namespaces))
 
     @classmethod
     def get_project_id(cls, path_with_namespace):
-        """获取项目id"""
-        return cls.get_projects_with_namespace(path_with_namespace)[0]['id']
+        """获取项目id：启用索引时为字典查找；否则取到第一个匹配项即返回"""
+        if cls.index is not None:
+            project_id = cls.index.get_project_id(path_with_namespace)
+            if project_id is None:
+                raise IndexError(f"project not found: {path_with_namespace}")
+            return project_id
+        for project in cls.iter_projects_with_namespace(path_with_namespace):
+            return project['id']
+        raise IndexError(f"project not found: {path_with_namespace}")
 
     def create_project(self, group_name: str, project_name):
         """ 创建项目
@@ -125,20 +230,24 @@ class GitlabApi:
         group_name = group_name.lower()
         self._create_group(group_name)
         data = {"name": project_name, "namespace_id": self._get_group(group_name)['id']}
-        requests.post(f"{self.url}/projects", headers=self._headers, data=data, timeout=5)
+        response = request.post(f"{self.url}/projects", headers=self._headers, data=data, timeout=5)
+        if self.index is not None and response.status_code == 201:
+            self.index.add_project(response.json())
         return self.get_project_from_name(project_name, group_name)
 
     @classmethod
     def edit_project(cls, project_id, data):
         """更新项目"""
-        return requests.put(f"{cls.url}/projects/{project_id}", headers=cls._headers, data=data)
+        return request.put(f"{cls.url}/projects/{project_id}", headers=cls._headers, data=data)
 
     def _delete_project(self, group_name, project_name):
         """ 删除项目：Warning！！！切勿胡乱调用！！！
             group_name为空则会查询所有项目组下的
         """
         project_id = self.get_project_from_name(project_name, group_name)['id']
-        response = requests.delete(f"{self.url}/projects/{project_id}", headers=self._headers)
+        response = request.delete(f"{self.url}/projects/{project_id}", headers=self._headers)
+        if self.index is not None:
+            self.index.remove_project(project_id)
         return json.loads(response.text)
 
     @classmethod
@@ -158,68 +267,71 @@ class GitlabApi:
           "access_level": 30,
           "user_id": user_id,   # 639,686
         }
-        return requests.post(f"{cls.url}/projects/{project_id}/invitations", headers=cls._headers, data=data)
+        return request.post(f"{cls.url}/projects/{project_id}/invitations", headers=cls._headers, data=data)
 
     """分支操作"""
     @classmethod
     def get_branch(cls, project_id, branch):
         """获取分支详情"""
-        return requests.get(f"{cls.url}/projects/{project_id}/repository/branches/{urllib.parse.quote_plus(branch)}",
+        return request.get(f"{cls.url}/projects/{project_id}/repository/branches/{urllib.parse.quote_plus(branch)}",
                            headers=cls._headers, timeout=10)
 
     @classmethod
     def branches(cls, project_id, params):
-        return requests.get(f"{cls.url}/projects/{project_id}/repository/branches/",
+        return request.get(f"{cls.url}/projects/{project_id}/repository/branches/",
                            params=params, headers=cls._headers).json()
 
     @classmethod
     def create_branch(cls, project_id, ref, branch):
         """创建代码库分支"""
         data = {"ref": ref, "branch": branch}
-        return requests.post(f"{cls.url}/projects/{project_id}/repository/branches",
+        return request.post(f"{cls.url}/projects/{project_id}/repository/branches",
                            headers=cls._headers, data=data, timeout=10)
 
     @classmethod
     def delete_branch(cls, project_id, branch):
         """删除代码库分支"""
         return request.delete(f"{cls.url}/projects/{project_id}/repository/branches/{urllib.parse.quote_plus(branch)}",
-                               headers=cls._headers, timeout=10)
+                              headers=cls._headers, timeout=10)
 
     @classmethod
     def get_protected_branch(cls, project_id, branch):
         """获取保护仓库分支"""
-        return requests.get(f"{cls.url}/projects/{project_id}/protected_branches/{urllib.parse.quote_plus(branch)}",
-                            headers=cls._headers, timeout=10)
+        return request.get(f"{cls.url}/projects/{project_id}/protected_branches/{urllib.parse.quote_plus(branch)}",
+                           headers=cls._headers, timeout=10)
 
     @classmethod
     def protect_branch(cls, project_id, branch, **kwargs):
         """保护仓库分支"""
         data = {"name": branch, **kwargs}
-        return requests.post(f"{cls.url}/projects/{project_id}/protected_branches",
+        return request.post(f"{cls.url}/projects/{project_id}/protected_branches",
                                headers=cls._headers, data=data, timeout=10)
 
     @classmethod
     def unprotect_branch(cls, project_id, branch):
         """取消保护仓库分支"""
-        return requests.delete(f"{cls.url}/projects/{project_id}/protected_branches/{urllib.parse.quote_plus(branch)}",
-                               headers=cls._headers, timeout=10)
+        return request.delete(f"{cls.url}/projects/{project_id}/protected_branches/{urllib.parse.quote_plus(branch)}",
+                              headers=cls._headers, timeout=10)
 
     @classmethod
-    def all_branches(cls, project_id, params: dict, iterations=20):
-        """获取指定仓的所有分支
+    def iter_branches(cls, project_id, params: dict = None, iterations=20, fields: list = None):
+        """逐个获取指定仓的分支，预取下一页
         :params project_id: 仓库ID
         :params params: 请求参数，一般{"per_page": 100}
-        :params iterations: 获取总"""
-        branches = []
-        params.update({"per_page": 100})
+        :params iterations: 获取总页数上限
+        :params fields: 只保留的字段列表，None表示保留全部字段"""
+        params = {**(params or {}), "per_page": 100}
         url = f"{cls.url}/projects/{project_id}/repository/branches/"
-        for _ in range(iterations):
-            response = requests.get(url, params=params, headers=cls._headers)
-            branches.extend(response.json())
-            url = response.links.get('next', {}).get('url')
-            if not url:
-                break
-        return branches
+        return cls.iter_all(url, params, fields=fields, iterations=iterations)
+
+    @classmethod
+    def all_branches(cls, project_id, params: dict, iterations=20, fields: list = None):
+        """获取指定仓的所有分支
+        :params project_id: 仓库ID
+        :params params: 请求参数，一般{"per_page": 100}
+        :params iterations: 获取总页数上限
+        :params fields: 只保留的字段列表，None表示保留全部字段"""
+        return list(cls.iter_branches(project_id, params, iterations=iterations, fields=fields))
 
     """流水线操作"""
     @classmethod
@@ -256,11 +368,11 @@ class GitlabApi:
     @classmethod
     def pipeline_cancel(cls, project_id: int, pipeline_id: int):
         return request.post(f"{cls.url}/projects/{project_id}/pipelines/{pipeline_id}/cancel",
-                             headers=cls._headers, timeout=10)
+                            headers=cls._headers, timeout=10)
 
     @classmethod
     def delete_pipeline(cls, project_id: int, pipeline_id: int):
-        return requests.delete(f"{cls.url}/projects/{project_id}/pipelines/{pipeline_id}",
+        return request.delete(f"{cls.url}/projects/{project_id}/pipelines/{pipeline_id}",
                              headers=cls._headers, timeout=10)
 
     @classmethod
@@ -274,34 +386,133 @@ class GitlabApi:
                            headers=cls._headers, params=cls.params, timeout=10)
 
     @classmethod
-    def all_jobs(cls, project_id: int, pipeline_id: int, params: dict = None, iterations=20):
-        """获取指定仓的指定流水线的所有作业
+    def iter_jobs(cls, project_id: int, pipeline_id: int, params: dict = None, iterations=20, fields: list = None):
+        """逐个获取指定仓的指定流水线的作业，预取下一页
         :params project_id: 仓库ID
         :params params: 请求参数，一般{"per_page": 100}
-        :params iterations: 获取总"""
-        jobs = []
-        params = params or {}
-        params.update({"per_page": 100})
+        :params iterations: 获取总页数上限
+        :params fields: 只保留的字段列表，None表示保留全部字段"""
+        params = {**(params or {}), "per_page": 100}
         url = f"{cls.url}/projects/{project_id}/pipelines/{pipeline_id}/jobs/"
-        for _ in range(iterations):
-            response = request.get(url, params=params, headers=cls._headers)
-            jobs.extend(response.json())
-            url = response.links.get('next', {}).get('url')
-            if not url:
-                break
-        return jobs
+        return cls.iter_all(url, params, fields=fields, iterations=iterations)
+
+    @classmethod
+    def all_jobs(cls, project_id: int, pipeline_id: int, params: dict = None, iterations=20, fields: list = None):
+        """获取指定仓的指定流水线的所有作业
+        :params project_id: 仓库ID
+        :params params: 请求参数，一般{"per_page": 100}
+        :params iterations: 获取总页数上限
+        :params fields: 只保留的字段列表，None表示保留全部字段"""
+        return list(cls.iter_jobs(project_id, pipeline_id, params, iterations=iterations, fields=fields))
 
     def trace(self, project_id: int, job_id: int):
         response = request.get(f"{self.url}/projects/{project_id}/jobs/{job_id}/trace",
                                headers=self._headers, timeout=10)
         return response.content.decode('utf-8')
 
+    def tail_trace(self, project_id: int, job_id: int, pattern=None, chunk_size: int = 64 * 1024):
+        """增量读取作业日志：逐行返回自上次调用以来新增的完整行（生成器，不含换行符）
+            1. 按作业记录已读字节数，用HTTP Range只请求新增部分。
+            2. 服务端忽略Range（返回200）时，跳过已读部分，仍只解码新增部分。
+            3. 边下载边解码，不拼接完整日志；未以换行结束的半行留到下次返回。
+            4. 416时若日志比已读部分短（作业被重试或日志被清除）或长度未知，从头读取。
+        :params pattern: 行级正则过滤（字符串或已编译的正则），None表示不过滤
+        :params chunk_size: 每次从网络读取的字节数"""
+        key = (project_id, job_id)
+        cursor = self._trace_cursors.get(key)
+        if cursor is None:
+            cursor = self._trace_cursors[key] = _TraceCursor()
+            while len(self._trace_cursors) > self.trace_cursor_limit:
+                self._trace_cursors.popitem(last=False)
+        else:
+            self._trace_cursors.move_to_end(key)
+        headers = {**self._headers, 'Range': f'bytes={cursor.offset}-', 'Accept-Encoding': 'identity'}
+        response = request.get(f"{self.url}/projects/{project_id}/jobs/{job_id}/trace",
+                               headers=headers, timeout=10, stream=True)
+        regex = re.compile(pattern) if isinstance(pattern, str) else pattern
+        try:
+            if response.status_code == 416:
+                length = response.headers.get('Content-Range', '').rpartition('/')[2]
+                if length.isdigit() and int(length) >= cursor.offset:   # 没有新增内容
+                    return
+                if cursor.offset:   # 日志变短或长度未知：从头读取
+                    response.close()
+                    self._trace_cursors[key] = _TraceCursor()
+                    yield from self.tail_trace(project_id, job_id, pattern=regex, chunk_size=chunk_size)
+                return
+            if response.status_code not in [200, 206]:
+                log.error(f'tail_trace {project_id}/{job_id}, status_code={response.status_code}, text={response.text}')
+                return
+            skip = cursor.offset if response.status_code == 200 else 0
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                if skip:
+                    if len(chunk) <= skip:
+                        skip -= len(chunk)
+                        continue
+                    chunk, skip = chunk[skip:], 0
+                cursor.offset += len(chunk)
+                lines = (cursor.pending + cursor.decoder.decode(chunk)).split('\n')
+                cursor.pending = lines.pop()
+                for line in lines:
+                    if regex is None or regex.search(line):
+                        yield line
+            if skip:    # 日志比已读部分还短（作业被重试或日志被清除），下次从头读取
+                self._trace_cursors[key] = _TraceCursor()
+        finally:
+            response.close()
+
+    def follow_trace(self, project_id: int, job_id: int, pattern=None, interval: float = 3, timeout: float = None):
+        """持续跟随作业日志，直到作业结束或超时（生成器，逐行返回）
+        :params pattern: 行级正则过滤（字符串或已编译的正则），None表示不过滤
+        :params interval: 轮询间隔（秒）
+        :params timeout: 超时（秒），None表示不超时"""
+        regex = re.compile(pattern) if isinstance(pattern, str) else pattern
+        deadline = timeout and time.time() + timeout
+        try:
+            while True:
+                finished = self.get_job(project_id, job_id).get('status') in self.stop_status
+                yield from self.tail_trace(project_id, job_id, pattern=regex)
+                if finished or (deadline and time.time() > deadline):
+                    break
+                time.sleep(interval)
+            cursor = self._trace_cursors.get((project_id, job_id))
+            last_line = cursor and cursor.pending + cursor.decoder.decode(b'', final=True)
+            if last_line and (regex is None or regex.search(last_line)):   # 作业结束时末尾没有换行的最后一行
+                yield last_line
+        finally:
+            self._trace_cursors.pop((project_id, job_id), None)
+
     """提交操作"""
     @classmethod
     def get_commit(cls, project_id, sha):
-        """获取项目提交"""
-        return requests.get(f"{cls.url}/projects/{project_id}/repository/commits/{sha}",
-                           headers=cls._headers)
+        """获取项目提交；启用缓存且sha为完整sha时，读写不可变对象缓存"""
+        url = f"{cls.url}/projects/{project_id}/repository/commits/{sha}"
+        if cls.cache is None or not cls.cache.is_sha(sha):
+            return request.get(url, headers=cls._headers)
+
+        responses = []
+
+        def fetch():
+            """未命中时请求；只缓存不可变部分（去掉last_pipeline、status）"""
+            response = request.get(url, headers=cls._headers)
+            responses.append(response)
+            if response.status_code != 200:
+                return None
+            commit = response.json()
+            for field in cls.commit_mutable_fields:
+                commit.pop(field, None)
+            return json.dumps(commit, ensure_ascii=False).encode()
+
+        content = cls.cache.get_or_fetch(f"commit:{project_id}:{sha}", fetch)
+        return responses[0] if responses else cls._cached_response(url, content)
+
+    @classmethod
+    def resolve_sha(cls, project_id, ref):
+        """将分支/标签/短sha解析为完整sha，失败返回None"""
+        if GitlabImmutableCache.is_sha(ref):
+            return ref
+        response = cls.get_commit(project_id, urllib.parse.quote_plus(ref))
+        return response.json().get('id') if response.status_code == 200 else None
 
     """标签操作"""
     @classmethod
@@ -319,7 +530,7 @@ class GitlabApi:
     @classmethod
     def get_tag(cls, project_id, tag_name):
         """获取项目标签"""
-        return requests.get(f"{cls.url}/projects/{project_id}/repository/tags/{urllib.parse.quote_plus(tag_name)}",
+        return request.get(f"{cls.url}/projects/{project_id}/repository/tags/{urllib.parse.quote_plus(tag_name)}",
                            headers=cls._headers, timeout=10)
 
     @classmethod
@@ -330,17 +541,17 @@ class GitlabApi:
             "ref": ref,
             "message": "标签由OPS平台自动创建"
         }
-        return requests.post(f"{cls.url}/projects/{project_id}/repository/tags", headers=cls._headers, data=data)
+        return request.post(f"{cls.url}/projects/{project_id}/repository/tags", headers=cls._headers, data=data)
 
     @classmethod
     def delete_tag(cls, project_id, tag_name):
         """删除标签"""
-        return requests.delete(f"{cls.url}/projects/{project_id}/repository/tags/{urllib.parse.quote_plus(tag_name)}", headers=cls._headers)
+        return request.delete(f"{cls.url}/projects/{project_id}/repository/tags/{urllib.parse.quote_plus(tag_name)}", headers=cls._headers)
 
     @classmethod
     def protected_tags(cls, project_id):
         """查看已经保护起来的标签"""
-        return requests.get(f"{cls.url}/projects/{project_id}/protected_tags", headers=cls._headers)
+        return request.get(f"{cls.url}/projects/{project_id}/protected_tags", headers=cls._headers)
 
     @classmethod
     def protect_tag(cls, project_id, tag_name):
@@ -353,12 +564,12 @@ class GitlabApi:
             "name": tag_name,
             "create_access_level": "0"
         }
-        return requests.post(f"{cls.url}/projects/{project_id}/protected_tags", headers=cls._headers, data=data)
+        return request.post(f"{cls.url}/projects/{project_id}/protected_tags", headers=cls._headers, data=data)
 
     @classmethod
     def unprotect_tag(cls, project_id, tag_name):
         """取消保护仓库标签"""
-        return requests.delete(f"{cls.url}/projects/{project_id}/protected_tags/{urllib.parse.quote_plus(tag_name)}", headers=cls._headers)
+        return request.delete(f"{cls.url}/projects/{project_id}/protected_tags/{urllib.parse.quote_plus(tag_name)}", headers=cls._headers)
 
     """合并请求操作"""
     @classmethod
@@ -369,12 +580,12 @@ class GitlabApi:
             "source_branch": source_branch,
             "target_branch": target_branch,
         }
-        return requests.get(f"{cls.url}/projects/{project_id}/merge_requests", headers=cls._headers, params=params)
+        return request.get(f"{cls.url}/projects/{project_id}/merge_requests", headers=cls._headers, params=params)
 
     @classmethod
     def get_merge_request(cls, project_id, merge_request_iid):
         """获取合并请求详情"""
-        return requests.get(f"{cls.url}/projects/{project_id}/merge_requests/{merge_request_iid}", headers=cls._headers)
+        return request.get(f"{cls.url}/projects/{project_id}/merge_requests/{merge_request_iid}", headers=cls._headers)
 
     @classmethod
     def create_merge_request(cls, project_id, source_branch, target_branch, title: str = None):
@@ -386,22 +597,22 @@ class GitlabApi:
             "target_branch": target_branch,
             "skip_ci": True
         }
-        return requests.post(f"{cls.url}/projects/{project_id}/merge_requests", headers=cls._headers, data=data)
+        return request.post(f"{cls.url}/projects/{project_id}/merge_requests", headers=cls._headers, data=data)
 
     @classmethod
     def delete_merge_request(cls, project_id, merge_request_iid):
         """删除合并请求"""
-        return requests.delete(f"{cls.url}/projects/{project_id}/merge_requests/{merge_request_iid}", headers=cls._headers)
+        return request.delete(f"{cls.url}/projects/{project_id}/merge_requests/{merge_request_iid}", headers=cls._headers)
 
     @classmethod
     def get_merge_request_pipelines(cls, project_id, merge_request_iid):
         """列出合并请求流水线"""
-        return requests.get(f"{cls.url}/projects/{project_id}/merge_requests/{merge_request_iid}/pipelines", headers=cls._headers)
+        return request.get(f"{cls.url}/projects/{project_id}/merge_requests/{merge_request_iid}/pipelines", headers=cls._headers)
 
     @classmethod
     def diffs_merge_request(cls, project_id, merge_request_iid):
         """列出合并请求差异"""
-        return requests.get(f"{cls.url}/projects/{project_id}/merge_requests/{merge_request_iid}/diffs", headers=cls._headers)
+        return request.get(f"{cls.url}/projects/{project_id}/merge_requests/{merge_request_iid}/diffs", headers=cls._headers)
 
     @classmethod
     def merge_merge_request(cls,
@@ -414,12 +625,12 @@ class GitlabApi:
             "should_remove_source_branch": should_remove_source_branch,   # 如果为 true，则删除源分支。
             "merge_commit_message": merge_commit_message,
         }
-        return requests.put(f"{cls.url}/projects/{project_id}/merge_requests/{merge_request_iid}/merge", headers=cls._headers, data=data)
+        return request.put(f"{cls.url}/projects/{project_id}/merge_requests/{merge_request_iid}/merge", headers=cls._headers, data=data)
 
     @classmethod
     def update_merge_request(cls, project_id, merge_request_iid, data):
         """更新合并请求"""
-        return requests.put(f"{cls.url}/projects/{project_id}/merge_requests/{merge_request_iid}", headers=cls._headers, data=data)
+        return request.put(f"{cls.url}/projects/{project_id}/merge_requests/{merge_request_iid}", headers=cls._headers, data=data)
 
     @classmethod
     def close_merge_request(cls, project_id, merge_request_iid):
@@ -448,14 +659,140 @@ class GitlabApi:
     @classmethod
     def get_runner_jobs(cls, runner_id, **kwargs):
         """获取Runner信息"""
-        return requests.get(f"{cls.url}/runners/{runner_id}/jobs", params={**cls.params, **kwargs}, headers=cls._headers)
+        return request.get(f"{cls.url}/runners/{runner_id}/jobs", params={**cls.params, **kwargs}, headers=cls._headers)
+
+    @staticmethod
+    def _seconds_between(start, end):
+        """两个ISO 8601时间字符串之间的秒数，任一为空返回None"""
+        if not start or not end:
+            return None
+        start, end = (datetime.fromisoformat(t.replace('Z', '+00:00')) for t in (start, end))
+        return (end - start).total_seconds()
+
+    @classmethod
+    def get_runner_fleet(cls, group_id=None, project_id=None, previous: dict = None, max_workers: int = None,
+                         **kwargs) -> dict:
+        """Runner集群快照
+            1. 并发翻页获取Runner列表。
+            2. 并发查询每个Runner的详情与正在运行的作业。
+            3. 汇总：各状态数量、忙/闲数量、每个Runner的作业数、排队时长（作业created_at到started_at）。
+        Runner列表获取失败时抛出requests.RequestException；单个Runner查询失败时该Runner标记error，不计入忙/闲、作业数与排队时长
+        :params previous: 上一次的快照；传入时只重新查询新增或状态发生变化的Runner的详情（增量刷新），运行中的作业每次都重新查询
+        :params max_workers: 并发线程数上限，默认runner_workers
+        :params kwargs: Runner列表的过滤参数，如type、status、tag_list
+        :return: {'runners': {runner_id: {'runner': 详情, 'jobs': 运行中的作业, 'error': 失败原因（仅失败时）}}, 'total',
+                  'status', 'busy', 'idle', 'failed', 'jobs_per_runner', 'queue_seconds_max', 'queue_seconds_avg',
+                  'refreshed', 'elapsed'}"""
+        start_time = time.time()
+        path_inner = group_id and '/groups/{}'.format(group_id) or ''
+        path_inner = path_inner or (project_id and '/projects/{}'.format(project_id) or '')
+        runners = cls.get_all(f"{cls.url}{path_inner}/runners", {**cls.params, **kwargs}, raise_error=True)
+
+        def is_changed(runner):
+            entry = previous_runners.get(runner['id'])
+            return entry is None or 'error' in entry or \
+                any(entry['runner'].get(k) != runner.get(k) for k in ['status', 'paused', 'active'])
+
+        def get_detail(runner):
+            try:
+                if runner['id'] in changed:
+                    response = cls.get_runner(runner['id'])
+                    if response.status_code != 200:
+                        raise requests.HTTPError(f"get_runner {runner['id']}, status_code={response.status_code}, "
+                                                 f"text={response.text}", response=response)
+                    detail = response.json()
+                else:
+                    detail = previous_runners[runner['id']]['runner']
+                jobs = cls.get_all(f"{cls.url}/runners/{runner['id']}/jobs", {**cls.params, "status": "running"},
+                                   raise_error=True)
+            except requests.RequestException as e:
+                log.warning('Runner查询失败', runner['id'], e)
+                return runner['id'], {'runner': runner, 'jobs': [], 'error': str(e)}
+            return runner['id'], {'runner': detail, 'jobs': jobs}
+
+        previous_runners = (previous or {}).get('runners', {})
+        changed = {runner['id'] for runner in runners if is_changed(runner)}
+        entries = {}
+        if runners:
+            with ThreadPoolExecutor(max_workers=min(max_workers or cls.runner_workers, len(runners)),
+                                    thread_name_prefix='gitlab_runner_fleet') as executor:
+                entries = dict(executor.map(get_detail, runners))
+
+        statuses, queue_seconds = {}, []
+        for entry in entries.values():
+            status = entry['runner'].get('status')
+            statuses[status] = statuses.get(status, 0) + 1
+            for job in entry['jobs']:
+                seconds = cls._seconds_between(job.get('created_at'), job.get('started_at'))
+                if seconds is not None:
+                    queue_seconds.append(seconds)
+        succeeded = {runner_id: entry for runner_id, entry in entries.items() if 'error' not in entry}
+        busy = sum(1 for entry in succeeded.values() if entry['jobs'])
+        snapshot = {
+            'runners': entries,
+            'total': len(entries),
+            'status': statuses,
+            'busy': busy,
+            'idle': sum(1 for e in succeeded.values() if not e['jobs'] and e['runner'].get('status') == 'online'),
+            'failed': len(entries) - len(succeeded),
+            'jobs_per_runner': {runner_id: len(entry['jobs']) for runner_id, entry in succeeded.items()},
+            'queue_seconds_max': max(queue_seconds, default=0),
+            'queue_seconds_avg': sum(queue_seconds) / (len(queue_seconds) or 1),
+            'refreshed': len(changed),
+            'elapsed': time.time() - start_time,
+        }
+        log.info('Runner集群快照', f"total: {snapshot['total']}", f"busy: {busy}", f"idle: {snapshot['idle']}",
+                 f"failed: {snapshot['failed']}", f"refreshed: {len(changed)}", f"{round(snapshot['elapsed'], 3)}s")
+        return snapshot
 
     @classmethod
     def get_project_files(cls, project_id, ref, path):
         """获取仓库文件列表"""
         encoded_path = urllib.parse.quote(path, safe='')
-        return requests.get(f"{cls.url}/projects/{project_id}/repository/files/{encoded_path}?ref={ref}",
-                            headers=cls._headers)
+        return request.get(f"{cls.url}/projects/{project_id}/repository/files/{encoded_path}?ref={ref}",
+                           headers=cls._headers)
+
+    @classmethod
+    def get_project_files_bulk(cls, project_id, ref, path: str = None, files: list = None) -> GitlabFiles:
+        """批量获取仓库文件内容
+            1. 指定的文件数不超过archive_threshold时，逐个请求raw文件。
+            2. 否则下载ref（及path子目录）的tar.gz归档，边下载边在内存中解压（不落临时文件），只保留需要的文件。
+        :params path: 只下载该子目录
+        :params files: 只保留这些文件（仓库内的相对路径），None表示保留全部
+        :return: GitlabFiles，路径 -> bytes；不存在的文件不在其中"""
+        output = GitlabFiles()
+        if files is not None and len(files) <= cls.archive_threshold:
+            for file in files:
+                response = request.get(f"{cls.url}/projects/{project_id}/repository/files/"
+                                       f"{urllib.parse.quote(file, safe='')}/raw",
+                                       params={"ref": ref}, headers=cls._headers)
+                if response.status_code == 200:
+                    output[file] = response.content
+            return output
+
+        params = {"sha": ref}
+        if path:
+            params["path"] = path
+        response = request.get(f"{cls.url}/projects/{project_id}/repository/archive.tar.gz",
+                               headers=cls._headers, params=params, stream=True)
+        if response.status_code != 200:
+            log.error(f'get_project_files_bulk {project_id}, params={params}, status_code={response.status_code}')
+            response.close()
+            return output
+
+        wanted = set(files) if files is not None else None
+        response.raw.decode_content = True
+        try:
+            with tarfile.open(fileobj=response.raw, mode='r|gz') as tar:
+                for member in tar:
+                    if not member.isfile():
+                        continue
+                    name = member.name.split('/', 1)[-1]    # 去掉归档的顶层目录：<project>-<ref>-<sha>/
+                    if wanted is None or name in wanted:
+                        output[name] = tar.extractfile(member).read()
+        finally:
+            response.close()
+        return output
 
     @classmethod
     def add_group_member(cls, group_id, user_id, access_level=30):
@@ -476,12 +813,12 @@ class GitlabApi:
             "user_id": user_id,
             "access_level": access_level
         }
-        return requests.post(f"{cls.url}/groups/{group_id}/members", headers=cls._headers, data=data)
+        return request.post(f"{cls.url}/groups/{group_id}/members", headers=cls._headers, data=data)
 
     @classmethod
     def remove_group_member(cls, group_id, user_id):
         """从群组中移除用户"""
-        return requests.delete(f"{cls.url}/groups/{group_id}/members/{user_id}", headers=cls._headers)
+        return request.delete(f"{cls.url}/groups/{group_id}/members/{user_id}", headers=cls._headers)
 
     @classmethod
     def delete_group_member(cls, group_id, user_id):
@@ -491,7 +828,7 @@ class GitlabApi:
     def get_user_by_username(cls, username):
         """根据用户名获取GitLab用户信息"""
         params = {"username": username}
-        response = requests.get(f"{cls.url}/users", params=params, headers=cls._headers)
+        response = request.get(f"{cls.url}/users", params=params, headers=cls._headers)
         users = response.json()
         # 返回匹配的第一个用户
         for user in users:
@@ -506,59 +843,167 @@ class GitlabApi:
             "user_id": user_id,
             "access_level": int(access_level)
         }
-        return requests.post(f"{cls.url}/projects/{project_id}/members", headers=cls._headers, data=data)
+        return request.post(f"{cls.url}/projects/{project_id}/members", headers=cls._headers, data=data)
 
     @classmethod
     def remove_project_member(cls, project_id, user_id):
         """从项目移除用户"""
-        return requests.delete(f"{cls.url}/projects/{project_id}/members/{user_id}", headers=cls._headers)
+        return request.delete(f"{cls.url}/projects/{project_id}/members/{user_id}", headers=cls._headers)
 
     @classmethod
     def delete_project_member(cls, project_id, user_id):
         return cls.remove_project_member(project_id, user_id)
 
     @classmethod
-    def get_accessible_projects(cls, group_id):
-        """获取群组中可访问的项目"""
-        all_projects = []
-        page = 1
-        while True:
-            params = {
-                "per_page": 50,
-                "page": page,
-                "include_subgroups": "true"
-            }
-            response = requests.get(f"{cls.url}/groups/{group_id}/projects", params=params, headers=cls._headers)
-            if response.status_code != 200:
-                log.error('Failed to fetch projects: status_code=%s, response=%s', response.status_code, response.text)
-                break
-
-            projects = response.json()
-            if not projects:
-                break
-
-            all_projects.extend(projects)
-            page += 1
+    def iter_accessible_projects(cls, group_id, fields: list = None, slim: bool = False):
+        """逐个获取群组中可访问的项目，预取下一页
+        :params fields: 只保留的字段列表，None表示保留全部字段
+        :params slim: 请求simple=true，且每个项目转为只含fields（默认slim_project_fields）的紧凑记录"""
+        params = {
+            "per_page": 50,
+            "include_subgroups": "true"
+        }
+        if slim:
+            params["simple"] = "true"
+        return cls.iter_all(f"{cls.url}/groups/{group_id}/projects", params,
+                            fields=cls._slim_fields(fields, slim, cls.slim_project_fields))
 
-            # 检查是否有下一页
-            link_header = response.headers.get('Link', '')
-            if 'rel="next"' not in link_header:
-                break
+    @classmethod
+    def get_accessible_projects(cls, group_id, fields: list = None, slim: bool = False):
+        """获取群组中可访问的项目
+        :params fields: 只保留的字段列表，None表示保留全部字段
+        :params slim: 请求simple=true，且每个项目转为只含fields（默认slim_project_fields）的紧凑记录"""
+        all_projects = list(cls.iter_accessible_projects(group_id, fields=fields, slim=slim))
         log.info('Fetched %d projects', len(all_projects))
         return all_projects
 
     @classmethod
-    def get_all(cls, url, params):
-        output = []
-        while url:
-            resp = requests.get(url, params=params, headers=cls._headers)
-            if resp.status_code != 200:
-                log.error(f'get_all {url}, params={params}, status_code={resp.status_code}, text={resp.text}')
+    def stream_all(cls, url, params, fields: list = None, iterations: int = None):
+        """逐条获取分页列表：按Link: rel="next"翻页，每页响应体流式解析，峰值内存与单条数据成正比
+        :params fields: 只保留的字段列表，None表示保留全部字段
+        :params iterations: 获取总页数上限，None表示不限"""
+        page = 0
+        while url and (iterations is None or page < iterations):
+            stream = request.get_stream(url, params=params, headers=cls._headers, fields=fields)
+            response = stream.response
+            if response.status_code != 200:
+                log.error(f'stream_all {url}, params={params}, status_code={response.status_code}, text={response.text}')
+                stream.close()
                 break
 
-            output.extend(resp.json())
-            url = resp.links.get('next', {}).get('url')
+            yield from stream
+            url = stream.links.get('next', {}).get('url')
+            page += 1
+
+    @classmethod
+    def _fetch_page(cls, url, params, fields: list = None):
+        """获取一页数据，返回(数据列表, 下一页url)；失败返回([], None)"""
+        stream = request.get_stream(url, params=params, headers=cls._headers, fields=fields)
+        response = stream.response
+        if response.status_code != 200:
+            log.error(f'fetch_page {url}, params={params}, status_code={response.status_code}, text={response.text}')
+            stream.close()
+            return [], None
+        return list(stream), stream.links.get('next', {}).get('url')
+
+    @classmethod
+    def iter_all(cls, url, params, fields: list = None, iterations: int = None, prefetch: bool = True):
+        """逐条获取分页列表（惰性）：消费当前页时后台预取下一页；调用方提前退出时不再请求后续页
+        需要完整列表时用get_all（并发翻页更快）
+        :params fields: 只保留的字段列表，None表示保留全部字段
+        :params iterations: 获取总页数上限，None表示不限
+        :params prefetch: False时不预取，改为边下载边解析（峰值内存与单条数据成正比）"""
+        if not prefetch:
+            yield from cls.stream_all(url, params, fields=fields, iterations=iterations)
+            return
+
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='gitlab_iter_all')
+        future, page = executor.submit(cls._fetch_page, url, params, fields), 0
+        try:
+            while future is not None:
+                items, url = future.result()
+                page += 1
+                has_next = url and (iterations is None or page < iterations)
+                future = executor.submit(cls._fetch_page, url, params, fields) if has_next else None
+                yield from items
+        finally:
+            if future is not None:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    @classmethod
+    def _get_page(cls, url, params, fields: list = None):
+        """获取一页数据，返回(数据列表, 响应)；5xx、429或连接异常时重试page_retries次，仍失败则抛出requests.RequestException"""
+        for attempt in range(cls.page_retries + 1):
+            retry = attempt < cls.page_retries
+            try:
+                stream = request.get_stream(url, params=params, headers=cls._headers, fields=fields)
+            except requests.RequestException as e:
+                if not retry:
+                    raise
+                log.warning(f'get_page {url}, params={params}, retry {attempt + 1}: {e}')
+            else:
+                response = stream.response
+                if response.status_code == 200:
+                    return list(stream), response
+                stream.close()
+                if not retry or (response.status_code < 500 and response.status_code != 429):
+                    raise requests.HTTPError(f'get_page {url}, params={params}, status_code={response.status_code}, '
+                                             f'text={response.text}', response=response)
+                log.warning(f'get_page {url}, params={params}, status_code={response.status_code}, retry {attempt + 1}')
+            time.sleep(cls.page_retry_interval * (attempt + 1))
+
+    @classmethod
+    def _get_keyset_params(cls, url, params):
+        """获取keyset分页参数；接口不支持或排序参数冲突时返回None"""
+        path = urllib.parse.urlsplit(url).path.rstrip('/')
+        for pattern, keyset_params in cls.keyset_params:
+            if re.search(pattern, path) and all(params.get(k, v) == v for k, v in keyset_params.items()):
+                return {**params, **keyset_params, "pagination": "keyset"}
+        return None
 
+    @classmethod
+    def get_all(cls, url, params, fields: list = None, max_workers: int = None, raise_error: bool = False):
+        """获取分页列表的全部数据
+            1. 获取第1页，读取X-Total-Pages。
+            2. 有总页数时，并发获取剩余页，并按页码顺序拼接。
+            3. 无总页数时（GitLab在超过1万条时省略），接口支持则改用keyset分页，否则按Link: rel="next"逐页获取。
+        任一页重试后仍失败时，整体视为失败（不返回缺页的部分结果）
+        :params fields: 只保留的字段列表，None表示保留全部字段
+        :params max_workers: 并发线程数上限，默认page_workers
+        :params raise_error: 失败时抛出requests.RequestException（用于区分“请求失败”与“结果为空”），默认记录日志并返回[]"""
+        params = params or {}
+        try:
+            return cls._get_all(url, params, fields, max_workers)
+        except requests.RequestException as e:
+            log.error(f'get_all {url}, params={params}, {e}')
+            if raise_error:
+                raise
+            return []
+
+    @classmethod
+    def _get_all(cls, url, params, fields, max_workers):
+        output, response = cls._get_page(url, {**params, "page": 1}, fields)
+        total_pages = response.headers.get('X-Total-Pages', '')
+        if total_pages.isdigit():
+            pages = range(2, int(total_pages) + 1)
+            if pages:
+                with ThreadPoolExecutor(max_workers=min(max_workers or cls.page_workers, len(pages)),
+                                        thread_name_prefix='gitlab_get_all') as executor:
+                    for items, _ in executor.map(lambda page: cls._get_page(url, {**params, "page": page}, fields), pages):
+                        output.extend(items)
+            return output
+
+        next_url = response.links.get('next', {}).get('url')
+        if not next_url:
+            return output
+        keyset_params = cls._get_keyset_params(url, params)
+        if keyset_params is not None:
+            output, next_url, params = [], url, keyset_params
+        while next_url:
+            items, response = cls._get_page(next_url, params, fields)
+            output.extend(items)
+            next_url = response.links.get('next', {}).get('url')
         return output
 
     @classmethod
@@ -592,10 +1037,15 @@ class GitlabApi:
         return cls.get_all(url=url, params=params)
 
     @classmethod
-    def get_all_projects(cls):
+    def get_all_projects(cls, fields: list = None, slim: bool = False):
+        """获取所有项目
+        :params fields: 只保留的字段列表，None表示保留全部字段
+        :params slim: 请求simple=true，且每个项目转为只含fields（默认slim_project_fields）的紧凑记录"""
         url = f"{cls.url}/projects"
         params = {"per_page": 100}
-        return cls.get_all(url=url, params=params)
+        if slim:
+            params["simple"] = "true"
+        return cls.get_all(url=url, params=params, fields=cls._slim_fields(fields, slim, cls.slim_project_fields))
 
     @classmethod
     def search_projects(cls, name):
@@ -604,7 +1054,7 @@ class GitlabApi:
             "per_page": 100,
             "search": name,
         }
-        return requests.get(url, headers=cls._headers, params=params).json()
+        return request.get(url, headers=cls._headers, params=params).json()
 
     @classmethod
     def search_project_branches(cls, project_id, search):
@@ -613,31 +1063,37 @@ class GitlabApi:
             "per_page": 100,
             "search": search,
         }
-        return requests.get(url, headers=cls._headers, params=params).json()
+        return request.get(url, headers=cls._headers, params=params).json()
 
     @classmethod
     def add_merge_note(cls, project_id, merge_request_iid, body):
         url = f"{cls.url}/projects/{project_id}/merge_requests/{merge_request_iid}/notes"
-        return requests.post(url, json={"body": body}, headers=cls._headers).json()
+        return request.post(url, json={"body": body}, headers=cls._headers).json()
 
     @classmethod
     def get_single_mr(cls, project_id, merge_request_iid):
         url = f"{cls.url}/projects/{project_id}/merge_requests/{merge_request_iid}/"
-        return requests.get(url, headers=cls._headers).json()
+        return request.get(url, headers=cls._headers).json()
 
     @classmethod
     def search_users(cls, search):
         url = f"{cls.url}/users"
-        return requests.get(url, headers=cls._headers, params={"search": search}).json()
+        return request.get(url, headers=cls._headers, params={"search": search}).json()
 
     @classmethod
-    async def aget_group_projects(cls, group_id):
+    async def aget_group_projects(cls, group_id, fields: list = None, slim: bool = False):
+        """获取群组（含子群组）中的项目
+        :params fields: 只保留的字段列表，None表示保留全部字段
+        :params slim: 请求simple=true，且每个项目转为只含fields（默认slim_project_fields）的紧凑记录"""
         output = []
         url = f"{cls.url}/groups/{group_id}/projects"
         params = {
             "per_page": 100,
             "include_subgroups": "true"
         }
+        if slim:
+            params["simple"] = "true"
+        fields = cls._slim_fields(fields, slim, cls.slim_project_fields)
 
         async with aiohttp.ClientSession() as session:
             while url:
@@ -650,7 +1106,12 @@ class GitlabApi:
                     if not body:
                         break
 
-                    output.extend(body)
+                    if fields is None:
+                        output.extend(body)
+                    elif isinstance(fields, type):
+                        output.extend(fields._make(item.get(k) for k in fields._fields) for item in body)
+                    else:
+                        output.extend({k: item[k] for k in fields if k in item} for item in body)
                     url = response.links.get('next', {}).get('url')
 
         return output
@@ -685,44 +1146,137 @@ class GitlabApi:
     @classmethod
     def run_job(cls, project_id, job_ids):
         url = f"{cls.url}/projects/{project_id}/jobs/{job_ids}/play"
-        return requests.post(url, headers=cls._headers)
+        return request.post(url, headers=cls._headers)
 
     @classmethod
     def get_job(cls, project_id, job_ids):
         url = f"{cls.url}/projects/{project_id}/jobs/{job_ids}"
-        return requests.get(url, headers=cls._headers).json()
+        return request.get(url, headers=cls._headers).json()
 
     @classmethod
-    def repository_compare(cls, project_id, from_, to):
+    def repository_compare(cls, project_id, from_, to, resolve: bool = False):
+        """比较两个引用
+        启用缓存时：from_与to均为完整sha（或resolve=True时先解析为sha）的比较结果读写不可变对象缓存
+        :params resolve: 先将分支/标签解析为sha；解析本身是两次轻量的提交查询，省下的是昂贵的比较请求"""
         url = f"{cls.url}/projects/{urllib.parse.quote_plus(str(project_id))}/repository/compare"
-        return request.get(url, headers=cls._headers, params={"from": from_, "to": to}).json()
+        if cls.cache is not None and resolve:
+            from_, to = cls.resolve_sha(project_id, from_) or from_, cls.resolve_sha(project_id, to) or to
+        if cls.cache is None or not (cls.cache.is_sha(from_) and cls.cache.is_sha(to)):
+            return request.get(url, headers=cls._headers, params={"from": from_, "to": to}).json()
+
+        responses = []
+
+        def fetch():
+            response = request.get(url, headers=cls._headers, params={"from": from_, "to": to})
+            responses.append(response)
+            return response.content if response.status_code == 200 else None
+
+        content = cls.cache.get_or_fetch(f"compare:{project_id}:{from_}:{to}", fetch)
+        return json.loads(content) if content is not None else responses[0].json()
 
     @classmethod
     def get_branches_diff(cls, project_id, source_branch, target_branch):
-        return cls.repository_compare(project_id, from_=target_branch, to=source_branch)
+        return cls.repository_compare(project_id, from_=target_branch, to=source_branch, resolve=True)
 
     @classmethod
-    def get_all_groups(cls):
+    def get_all_groups(cls, fields: list = None, slim: bool = False):
+        """获取所有群组（群组接口不支持simple=true，仅做字段投影）
+        :params fields: 只保留的字段列表，None表示保留全部字段
+        :params slim: 每个群组转为只含fields（默认slim_group_fields）的紧凑记录"""
         url = f"{cls.url}/groups"
         params = {"per_page": 100}
-        return cls.get_all(url=url, params=params)
+        return cls.get_all(url=url, params=params, fields=cls._slim_fields(fields, slim, cls.slim_group_fields))
 
     @classmethod
     def update_group_member_access_level(cls, group_id, user_id, access_level):
         url = f"{cls.url}/groups/{group_id}/members/{user_id}"
-        return requests.put(url, headers=cls._headers, json={"access_level": access_level})
+        return request.put(url, headers=cls._headers, json={"access_level": access_level})
 
     @classmethod
     def update_project_member_access_level(cls, project_id, user_id, access_level):
         url = f"{cls.url}/projects/{project_id}/members/{user_id}"
-        return requests.put(url, headers=cls._headers, json={"access_level": access_level})
+        return request.put(url, headers=cls._headers, json={"access_level": access_level})
 
     @classmethod
     def group_member(cls, group_id, gitlab_userid):
         url = f"{cls.url}/groups/{group_id}/members/{gitlab_userid}"
-        return requests.get(url, headers=cls._headers)
+        return request.get(url, headers=cls._headers)
 
     @classmethod
     def project_member(cls, project_id, gitlab_userid):
         url = f"{cls.url}/projects/{project_id}/members/{gitlab_userid}"
-        return requests.get(url, headers=cls._headers)
+        return request.get(url, headers=cls._headers)
+
+    """批量成员操作"""
+    @classmethod
+    def _upsert_member(cls, kind, target_id, user_id, access_level=GitlabAccessLevel.DEVELOPER):
+        """添加成员；已是成员（409）时改为更新访问级别，使重复执行幂等"""
+        add, update = {
+            'project': (cls.add_project_member, cls.update_project_member_access_level),
+            'group': (cls.add_group_member, cls.update_group_member_access_level),
+        }[kind]
+        response = add(target_id, user_id, int(access_level))
+        if response.status_code == 409:
+            return 'updated', update(target_id, user_id, int(access_level))
+        return 'added', response
+
+    @classmethod
+    def _remove_member(cls, kind, target_id, user_id, *args):
+        """移除成员；本就不是成员（404）时视为成功，使重复执行幂等"""
+        remove = {'project': cls.remove_project_member, 'group': cls.remove_group_member}[kind]
+        response = remove(target_id, user_id)
+        return ('absent' if response.status_code == 404 else 'removed'), response
+
+    @classmethod
+    def _bulk_members(cls, func, kind, items, max_workers=None) -> dict:
+        """并发执行成员操作，返回逐项结果表与汇总耗时"""
+        def run(item):
+            start_time = time.time()
+            result = {'target_id': item[0], 'user_id': item[1], 'access_level': item[2] if len(item) > 2 else None}
+            try:
+                action, response = func(kind, *item)
+                ok = action == 'absent' or response.status_code < 300
+                result.update(action=action, ok=ok, status_code=response.status_code,
+                              message='' if ok else response.text)
+            except Exception as e:
+                result.update(action='error', ok=False, status_code=None, message=str(e))
+            result['elapsed'] = time.time() - start_time
+            return result
+
+        start_time, items = time.time(), [tuple(item) for item in items]
+        if not items:
+            return {'results': [], 'total': 0, 'succeeded': 0, 'failed': 0, 'elapsed': 0.0, 'busy': 0.0}
+        with ThreadPoolExecutor(max_workers=min(max_workers or cls.member_workers, len(items)),
+                                thread_name_prefix='gitlab_members') as executor:
+            results = list(executor.map(run, items))
+        summary = {
+            'results': results,
+            'total': len(results),
+            'succeeded': sum(r['ok'] for r in results),
+            'failed': sum(not r['ok'] for r in results),
+            'elapsed': time.time() - start_time,    # 总墙钟耗时
+            'busy': sum(r['elapsed'] for r in results),  # 各项耗时之和，与elapsed之比即并发收益
+        }
+        log.log(summary['failed'] == 0, f"批量成员操作 {func.__name__} {kind}",
+                f"{summary['succeeded']}/{summary['total']}", f"{round(summary['elapsed'], 3)}s")
+        return summary
+
+    @classmethod
+    def bulk_add_members(cls, items, kind='project', max_workers=None) -> dict:
+        """批量添加成员（已是成员则更新访问级别）
+        :params items: [(project_id/group_id, user_id, access_level), ...]
+        :params kind: 'project' 或 'group'
+        :params max_workers: 并发线程数上限，默认member_workers
+        :return: {'results': [{'target_id', 'user_id', 'access_level', 'action', 'ok', 'status_code', 'message', 'elapsed'}],
+                  'total', 'succeeded', 'failed', 'elapsed', 'busy'}
+            action: added / updated / error"""
+        return cls._bulk_members(cls._upsert_member, kind, items, max_workers=max_workers)
+
+    @classmethod
+    def bulk_remove_members(cls, items, kind='project', max_workers=None) -> dict:
+        """批量移除成员（本就不是成员视为成功）
+        :params items: [(project_id/group_id, user_id), ...]
+        :params kind: 'project' 或 'group'
+        :params max_workers: 并发线程数上限，默认member_workers
+        :return: 同bulk_add_members；action: removed / absent / error"""
+        return cls._bulk_members(cls._remove_member, kind, items, max_workers=max_workers)
@@ -0,0 +1,136 @@
+import os
+import re
+import time
+import sqlite3
+import threading
+
+from collections import OrderedDict
+
+from pylib.log import log
+
+
+class GitlabImmutableCache:
+    """不可变GitLab对象的永久缓存：内存LRU在前，磁盘KV（sqlite）在后
+        只缓存永远不会变化的数据，key由内容地址组成（如完整commit sha），因此无需过期，只按容量淘汰：
+            内存：总字节数超过memory_bytes时按LRU淘汰
+            磁盘：总字节数超过max_bytes时，按最近访问时间淘汰至90%
+    使用方法：
+        GitlabApi.enable_cache()
+        GitlabApi.get_commit(project_id, sha)    # sha为完整sha时命中缓存
+    """
+    _sha_re = re.compile(r'[0-9a-f]{40}|[0-9a-f]{64}')
+
+    def __init__(self, path: str = None, max_bytes: int = 256 * 1024 * 1024, memory_bytes: int = 32 * 1024 * 1024):
+        """
+        :params path: sqlite文件路径
+        :params max_bytes: 磁盘缓存字节数上限
+        :params memory_bytes: 内存LRU字节数上限；超过该值的单条数据只存磁盘
+        """
+        self.path = path or os.getenv('gitlab-api.cache.path') or os.path.expanduser('~/.cache/pylib/gitlab_cache.sqlite3')
+        self.max_bytes = max_bytes
+        self.memory_bytes = memory_bytes
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()    # key -> bytes
+        self._memory_size = 0   # 内存LRU的总字节数
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute('CREATE TABLE IF NOT EXISTS kv '
+                         '(key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, atime REAL NOT NULL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS kv_atime ON kv (atime)')
+        self._size = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM kv').fetchone()[0]
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0}
+
+    @classmethod
+    def is_sha(cls, value) -> bool:
+        """是否为完整的commit sha（sha1或sha256）"""
+        return isinstance(value, str) and cls._sha_re.fullmatch(value) is not None
+
+    def _remember(self, key: str, value: bytes):
+        """写入内存LRU，按字节数淘汰"""
+        self._forget(key)
+        if len(value) > self.memory_bytes:
+            return
+        self._memory[key] = value
+        self._memory_size += len(value)
+        while self._memory_size > self.memory_bytes:
+            self._memory_size -= len(self._memory.popitem(last=False)[1])
+
+    def _forget(self, key: str):
+        """从内存LRU移除"""
+        value = self._memory.pop(key, None)
+        if value is not None:
+            self._memory_size -= len(value)
+
+    def get(self, key: str):
+        """读取缓存，未命中返回None"""
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self._stats['memory_hits'] += 1
+                return value
+            row = self._db.execute('SELECT value FROM kv WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self._stats['misses'] += 1
+                return None
+            self._db.execute('UPDATE kv SET atime = ? WHERE key = ?', (time.time(), key))
+            self._remember(key, row[0])
+            self._stats['disk_hits'] += 1
+            return row[0]
+
+    def set(self, key: str, value: bytes):
+        """写入缓存"""
+        with self._lock:
+            self._remember(key, value)
+            old = self._db.execute('SELECT size FROM kv WHERE key = ?', (key,)).fetchone()
+            self._db.execute('INSERT OR REPLACE INTO kv (key, value, size, atime) VALUES (?, ?, ?, ?)',
+                             (key, value, len(value), time.time()))
+            self._size += len(value) - (old[0] if old else 0)
+            if self._size > self.max_bytes:
+                self._evict(int(self.max_bytes * 0.9))
+
+    def _evict(self, target_bytes: int):
+        """按最近访问时间淘汰磁盘缓存，直到总字节数不超过target_bytes"""
+        evicted = 0
+        for key, size in self._db.execute('SELECT key, size FROM kv ORDER BY atime').fetchall():
+            if self._size <= target_bytes:
+                break
+            self._db.execute('DELETE FROM kv WHERE key = ?', (key,))
+            self._forget(key)
+            self._size -= size
+            evicted += 1
+        self._stats['evictions'] += evicted
+        log.debug('GitlabImmutableCache淘汰', evicted, f"{self._size}/{self.max_bytes} bytes")
+
+    def get_or_fetch(self, key: str, fetch):
+        """读取缓存，未命中时调用fetch()获取并写入；fetch返回None表示不可缓存"""
+        value = self.get(key)
+        if value is None:
+            value = fetch()
+            if value is not None:
+                self.set(key, value)
+        return value
+
+    def metrics(self) -> dict:
+        """命中率等指标"""
+        with self._lock:
+            stats = dict(self._stats)
+            disk_items = self._db.execute('SELECT COUNT(*) FROM kv').fetchone()[0]
+            memory_items, memory_bytes, disk_bytes = len(self._memory), self._memory_size, self._size
+        hits = stats['memory_hits'] + stats['disk_hits']
+        return {
+            **stats,
+            'hits': hits,
+            'hit_rate': hits / ((hits + stats['misses']) or 1),
+            'memory_items': memory_items,
+            'memory_bytes': memory_bytes,
+            'disk_items': disk_items,
+            'disk_bytes': disk_bytes,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_size = 0
+            self._db.execute('DELETE FROM kv')
+            self._size = 0
@@ -0,0 +1,139 @@
+import os
+import re
+import json
+import requests
+import urllib.parse
+
+from pylib.log import log
+from pylib.request import request
+from pylib.api.gitlab_api import GitlabApi
+
+
+class GitlabGraphql:
+    """GitLab GraphQL批量读取：将多个项目的查询打包进一个带别名的查询文档
+        REST需要 项目数 x 3 次请求（get_branch、search_merge_request、get_pipelines），
+        这里每chunk_size个项目只需1次请求；结果转换为与REST接口相同的字典结构。
+    使用方法：
+        graphql = GitlabGraphql()   # 默认由GitlabApi.url推导出 /api/graphql，也可指向本地替身服务
+        results = graphql.lookup([('group/project', 'dev', 'main'), ...])
+        results[0] -> {'branch': {...} or None, 'merge_requests': [...], 'pipeline': {...} or None}
+    """
+    chunk_size = 20     # 每个查询文档包含的项目数，避免超出GitLab的查询复杂度限制
+
+    def __init__(self, url: str = None, headers: dict = None, chunk_size: int = None):
+        """
+        :params url: GraphQL接口地址，默认由GitlabApi.url推导
+        :params headers: 请求头，默认使用GitlabApi的令牌
+        :params chunk_size: 每个查询文档包含的项目数
+        """
+        self.url = url or os.getenv('gitlab-api.graphql.url') or re.sub(r'/api/v4/?$', '/api/graphql', GitlabApi.url or '')
+        self.headers = {**GitlabApi._headers, **(headers or {}), 'Content-Type': 'application/json'}
+        self.chunk_size = chunk_size or self.chunk_size
+        self.requests = 0   # 已发出的请求数
+
+    def query(self, document: str, variables: dict = None) -> dict:
+        """执行GraphQL查询，返回data；部分字段出错时记录日志并返回其余数据；HTTP状态码非200时抛出requests.HTTPError"""
+        response = request.post(self.url, headers=self.headers,
+                                data=json.dumps({"query": document, "variables": variables or {}}))
+        self.requests += 1
+        if response.status_code != 200:
+            log.error('GitlabGraphql请求失败', response.status_code, response.text)
+            raise requests.HTTPError(f"GitlabGraphql status_code={response.status_code}", response=response)
+        body = response.json()
+        if body.get('errors'):
+            log.error('GitlabGraphql查询出错', response.status_code, body['errors'])
+        return body.get('data') or {}
+
+    @staticmethod
+    def _gid_to_id(gid):
+        """gid://gitlab/MergeRequest/123 -> 123"""
+        return int(gid.rsplit('/', 1)[-1]) if gid else None
+
+    def _web_url(self, path):
+        """由GraphQL返回的相对路径拼出web_url"""
+        if not path:
+            return None
+        url = urllib.parse.urlsplit(self.url)
+        return f"{url.scheme}://{url.netloc}{path}"
+
+    @staticmethod
+    def _build(index, branch, merge_requests, pipeline):
+        """生成单个项目的别名查询片段及其变量定义；未查询任何字段时不声明$s（GitLab拒绝声明但未使用的变量）"""
+        definitions = [f"$p{index}: ID!"]
+        if branch or merge_requests or pipeline:
+            definitions.append(f"$s{index}: String!")
+        fields = []
+        if branch:
+            fields.append(f"branch: repository {{ branchNames(searchPattern: $s{index}, offset: 0, limit: 1) "
+                          f"tree(ref: $s{index}) {{ lastCommit {{ sha title }} }} }}")
+        if merge_requests:
+            definitions.append(f"$t{index}: [String!]")
+            fields.append(f"mergeRequests(sourceBranches: [$s{index}], targetBranches: $t{index}, state: opened) "
+                          f"{{ nodes {{ id iid title state sourceBranch targetBranch sha webUrl draft }} }}")
+        if pipeline:
+            fields.append(f"pipelines(ref: $s{index}, first: 1) "
+                          f"{{ nodes {{ id iid status sha ref createdAt updatedAt path }} }}")
+        return definitions, f"p{index}: project(fullPath: $p{index}) {{ id {' '.join(fields)} }}"
+
+    def _convert(self, project: dict, source_branch, branch, merge_requests, pipeline) -> dict:
+        """将GraphQL结果转换为REST接口的字典结构"""
+        output = {}
+        if branch:
+            repository = project.get('branch') or {}
+            last_commit = (repository.get('tree') or {}).get('lastCommit') or {}
+            exists = source_branch in (repository.get('branchNames') or [])
+            output['branch'] = {'name': source_branch, 'commit': {'id': last_commit.get('sha'),
+                                                                   'title': last_commit.get('title')}} if exists else None
+        if merge_requests:
+            output['merge_requests'] = [{
+                'id': self._gid_to_id(mr['id']),
+                'iid': int(mr['iid']),
+                'title': mr['title'],
+                'state': mr['state'],
+                'source_branch': mr['sourceBranch'],
+                'target_branch': mr['targetBranch'],
+                'sha': mr['sha'],
+                'web_url': mr['webUrl'],
+                'draft': mr['draft'],
+            } for mr in (project.get('mergeRequests') or {}).get('nodes', [])]
+        if pipeline:
+            nodes = (project.get('pipelines') or {}).get('nodes', [])
+            output['pipeline'] = nodes and {
+                'id': self._gid_to_id(nodes[0]['id']),
+                'iid': int(nodes[0]['iid']),
+                'status': nodes[0]['status'].lower(),
+                'sha': nodes[0]['sha'],
+                'ref': nodes[0]['ref'],
+                'created_at': nodes[0]['createdAt'],
+                'updated_at': nodes[0]['updatedAt'],
+                'web_url': self._web_url(nodes[0]['path']),
+            } or None
+        return output
+
+    def lookup(self, items, branch=True, merge_requests=True, pipeline=True) -> list:
+        """批量查询多个项目的分支、打开的合并请求、最新流水线
+        :params items: [(path_with_namespace, source_branch, target_branch), ...]；target_branch可为None
+        :params branch: 是否查询分支是否存在（对应get_branch）
+        :params merge_requests: 是否查询source_branch -> target_branch的打开的合并请求（对应search_merge_request）
+        :params pipeline: 是否查询source_branch上最新的流水线（对应get_pipelines(ref=...)[0]）
+        :return: 与items一一对应的[{'branch': dict or None, 'merge_requests': list, 'pipeline': dict or None}]
+            项目不存在或无权限时对应项为None"""
+        items = [tuple(item) + (None,) * (3 - len(item)) for item in items]
+        output = []
+        for start in range(0, len(items), self.chunk_size):
+            chunk = items[start:start + self.chunk_size]
+            definitions, fragments, variables = [], [], {}
+            for index, (project_path, source_branch, target_branch) in enumerate(chunk):
+                defs, fragment = self._build(index, branch, merge_requests, pipeline)
+                definitions.extend(defs)
+                fragments.append(fragment)
+                variables[f"p{index}"] = project_path
+                if branch or merge_requests or pipeline:
+                    variables[f"s{index}"] = source_branch
+                if merge_requests:
+                    variables[f"t{index}"] = [target_branch] if target_branch else None
+            data = self.query(f"query({', '.join(definitions)}) {{ {' '.join(fragments)} }}", variables)
+            for index, (project_path, source_branch, target_branch) in enumerate(chunk):
+                project = data.get(f"p{index}")
+                output.append(project and self._convert(project, source_branch, branch, merge_requests, pipeline))
+        return output
@@ -0,0 +1,221 @@
+import os
+import json
+import time
+import threading
+import requests
+
+from datetime import datetime, timedelta, timezone
+
+from pylib.log import log
+
+
+class GitlabIndex:
+    """GitLab本地名称索引：项目path_with_namespace/名称、群组full_path/名称 -> id
+        1. 首次使用时全量拉取项目与群组（simple=true，只保留索引字段），并持久化到本地文件，重启后直接加载。
+        2. 未命中时按last_activity_after增量刷新项目、全量刷新群组（群组接口不支持增量），刷新有最小间隔，避免刷新风暴。
+           拉取在锁外进行，全部成功后才替换索引；拉取失败时保留原索引，也不写入文件。
+        3. 刷新后仍未命中的key记为负缓存，TTL内直接返回None，不再请求。
+        4. 每隔full_refresh_interval秒做一次全量刷新，以清理已删除/已改名的项目。
+    使用方法：
+        GitlabApi.enable_index()
+        GitlabApi.get_project_id('group/project')     # 字典查找
+    """
+    version = 1
+    project_fields = ['id', 'name', 'path_with_namespace', 'namespace']
+    group_fields = ['id', 'name', 'full_path']
+
+    def __init__(self, api, path: str = None, negative_ttl: float = 300, min_refresh_interval: float = 30,
+                 full_refresh_interval: float = 24 * 3600):
+        """
+        :params api: GitlabApi类，用于拉取数据
+        :params path: 索引持久化文件路径
+        :params negative_ttl: 未命中key的负缓存时长（秒）
+        :params min_refresh_interval: 两次刷新的最小间隔（秒）
+        :params full_refresh_interval: 全量刷新间隔（秒）
+        """
+        self.api = api
+        self.path = path or os.getenv('gitlab-api.index.path') or os.path.expanduser('~/.cache/pylib/gitlab_index.json')
+        self.negative_ttl = negative_ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.full_refresh_interval = full_refresh_interval
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.Lock()   # 串行化刷新（拉取期间不持有self._lock）
+        self._projects = {}     # path_with_namespace -> (id, name, path_with_namespace, namespace_full_path, namespace_name)
+        self._project_paths = {}    # id -> path_with_namespace，用于处理改名
+        self._project_names = {}    # name -> {path_with_namespace}
+        self._groups = {}   # full_path -> (id, name, full_path)
+        self._group_names = {}  # name -> full_path
+        self._negative = {}     # (kind, key) -> 过期时间
+        self._synced_at = None  # 上次项目同步的起始时间（ISO 8601），用于增量刷新
+        self._full_synced_at = 0    # 上次全量刷新的时间戳
+        self._refreshed_at = 0  # 上次刷新的时间戳
+        self._load()
+
+    """持久化"""
+    def _load(self):
+        if not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            log.warning('GitlabIndex加载失败，将全量刷新', self.path, e)
+            return
+        if data.get('version') != self.version or data.get('url') != self.api.url:
+            return
+        with self._lock:
+            for record in data.get('projects', []):
+                self._put_project(tuple(record))
+            for record in data.get('groups', []):
+                self._put_group(tuple(record))
+            self._synced_at = data.get('synced_at')
+            self._full_synced_at = data.get('full_synced_at', 0)
+
+    def save(self):
+        """原子写入索引文件"""
+        with self._lock:
+            data = {
+                'version': self.version,
+                'url': self.api.url,
+                'synced_at': self._synced_at,
+                'full_synced_at': self._full_synced_at,
+                'projects': list(self._projects.values()),
+                'groups': list(self._groups.values()),
+            }
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+
+    """写入"""
+    def _put_project(self, record: tuple, maps: tuple = None):
+        """:params maps: (projects, project_paths, project_names)，默认为当前索引"""
+        projects, paths, names = maps or (self._projects, self._project_paths, self._project_names)
+        self._pop_project(record[0], maps)  # 改名时移除旧路径
+        projects[record[2]] = record
+        paths[record[0]] = record[2]
+        names.setdefault(record[1], set()).add(record[2])
+
+    def _pop_project(self, project_id, maps: tuple = None):
+        projects, paths, names = maps or (self._projects, self._project_paths, self._project_names)
+        record = projects.pop(paths.pop(project_id, None), None)
+        if record is not None:
+            names.get(record[1], set()).discard(record[2])
+
+    def _put_group(self, record: tuple, maps: tuple = None):
+        """:params maps: (groups, group_names)，默认为当前索引"""
+        groups, names = maps or (self._groups, self._group_names)
+        groups[record[2]] = record
+        names.setdefault(record[1], record[2])
+
+    @staticmethod
+    def _project_record(project: dict) -> tuple:
+        namespace = project.get('namespace') or {}
+        return (project['id'], project['name'], project['path_with_namespace'],
+                namespace.get('full_path', ''), namespace.get('name', ''))
+
+    def add_project(self, project: dict):
+        """将接口返回的项目加入索引"""
+        with self._lock:
+            self._put_project(self._project_record(project))
+            self._negative.pop(('project', project['path_with_namespace']), None)
+
+    def add_group(self, group: dict):
+        """将接口返回的群组加入索引"""
+        with self._lock:
+            self._put_group((group['id'], group['name'], group['full_path']))
+            self._negative.pop(('group', group['name']), None)
+            self._negative.pop(('group', group['full_path']), None)
+
+    def remove_project(self, project_id):
+        with self._lock:
+            self._pop_project(project_id)
+
+    """刷新"""
+    def refresh(self, full: bool = False) -> bool:
+        """刷新索引：项目按last_activity_after增量，群组全量；返回是否成功
+        :params full: True时项目也全量刷新"""
+        with self._refresh_lock:
+            return self._refresh(full)
+
+    def _refresh(self, full: bool) -> bool:
+        """拉取（不持有self._lock），全部成功后再替换索引并保存"""
+        with self._lock:
+            full = full or self._synced_at is None or time.time() - self._full_synced_at > self.full_refresh_interval
+            synced_at = self._synced_at
+        started_at = datetime.now(timezone.utc) - timedelta(minutes=1)    # 留出时钟偏差余量
+        params = {"per_page": 100, "simple": "true"}
+        if not full:
+            params["last_activity_after"] = synced_at
+        try:
+            projects = self.api.get_all(f"{self.api.url}/projects", params, fields=self.project_fields,
+                                        raise_error=True)
+            groups = self.api.get_all(f"{self.api.url}/groups", {"per_page": 100}, fields=self.group_fields,
+                                      raise_error=True)
+        except requests.RequestException as e:
+            log.warning('GitlabIndex刷新失败，保留原索引', e)
+            with self._lock:
+                self._refreshed_at = time.time()    # 失败也计入最小刷新间隔，避免重试风暴
+            return False
+
+        project_maps = ({}, {}, {}) if full else None
+        for project in projects if full else ():
+            self._put_project(self._project_record(project), project_maps)
+        group_maps = ({}, {})
+        for group in groups:
+            self._put_group((group['id'], group['name'], group['full_path']), group_maps)
+
+        with self._lock:
+            if full:
+                self._projects, self._project_paths, self._project_names = project_maps
+                self._full_synced_at = time.time()
+            else:
+                for project in projects:
+                    self._put_project(self._project_record(project))
+            self._groups, self._group_names = group_maps
+            self._synced_at = started_at.strftime('%Y-%m-%dT%H:%M:%SZ')
+            self._refreshed_at = time.time()
+            log.info('GitlabIndex刷新', 'full' if full else 'incremental',
+                     f"projects: {len(projects)}/{len(self._projects)}", f"groups: {len(self._groups)}")
+        self.save()
+        return True
+
+    def _resolve(self, kind: str, key, find):
+        """查找；未命中时刷新后再查找一次，仍未命中则记入负缓存；只在内存操作时持有锁"""
+        with self._lock:
+            record = find()
+            if record is not None or self._negative.get((kind, key), 0) > time.time():
+                return record
+        with self._refresh_lock:    # 其他线程正在刷新时，等它完成后再判断是否需要刷新
+            if time.time() - self._refreshed_at >= self.min_refresh_interval:
+                self._refresh(full=False)
+        with self._lock:
+            record = find()
+            if record is None:
+                self._negative[(kind, key)] = time.time() + self.negative_ttl
+            return record
+
+    """查询"""
+    def get_project_id(self, path_with_namespace: str):
+        """根据path_with_namespace获取项目id，不存在返回None"""
+        record = self._resolve('project', path_with_namespace, lambda: self._projects.get(path_with_namespace))
+        return record and record[0]
+
+    def get_project_id_from_name(self, project_name: str, group_name: str = ''):
+        """根据项目名（及所属群组的名称或full_path）获取项目id，不存在返回None"""
+        def find():
+            for path in self._project_names.get(project_name, ()):
+                record = self._projects[path]
+                if not group_name or group_name in record[3:5]:
+                    return record
+            return None
+        record = self._resolve('project', (group_name, project_name), find)
+        return record and record[0]
+
+    def get_group_id(self, group_name: str):
+        """根据群组名或full_path获取群组id，不存在返回None"""
+        def find():
+            return self._groups.get(group_name) or self._groups.get(self._group_names.get(group_name))
+        record = self._resolve('group', group_name, find)
+        return record and record[0]
@@ -0,0 +1,167 @@
+import time
+import threading
+
+from datetime import datetime, timedelta
+
+from pylib.log import log
+from pylib.api.gitlab_api import GitlabApi
+
+
+class GitlabPipelineWatcher:
+    """多流水线状态监听：按项目批量轮询，而非逐条流水线轮询
+        1. 每个项目一次列表请求（order_by=updated_at，updated_after=上次看到的最新更新时间），覆盖该项目下所有被监听的流水线。
+        2. 轮询间隔按状态自适应：running快，排队中慢；项目取其被监听流水线中最短的间隔。
+        3. 仅在流水线状态进入stop_status时回调一次，随后自动取消监听。
+        请求量与项目数成正比，与流水线数无关。
+    使用方法：
+        watcher = GitlabPipelineWatcher()
+        watcher.watch(project_id, pipeline_id, callback)
+        watcher.start()     # 或在自己的循环里调用watcher.poll()
+    回调：callback(watcher, project_id=, pipeline_id=, status=, old_status=, pipeline=)
+        status in GitlabApi.failed_status 即为失败
+    """
+    # 各状态的轮询间隔（秒）
+    intervals = {
+        'running': 5,
+        'preparing': 5,
+        'pending': 30,
+        'created': 30,
+        'waiting_for_resource': 30,
+    }
+    default_interval = 10   # 未知状态（尚未拿到状态）的轮询间隔
+    overlap = 1     # updated_after回退的秒数，避免同一秒内的多次更新被漏掉
+    fields = ['id', 'iid', 'status', 'ref', 'sha', 'updated_at', 'web_url']
+
+    def __init__(self, api=GitlabApi, intervals: dict = None):
+        self.api = api
+        self.intervals = {**self.intervals, **(intervals or {})}
+        self._lock = threading.RLock()
+        self._poll_lock = threading.Lock()
+        self._watched = {}  # (project_id, pipeline_id) -> {'status': str, 'callback': callable}
+        self._projects = {}     # project_id -> {'updated_after': str, 'next_poll': float, 'pipelines': set}
+        self._stop = threading.Event()
+        self._thread = None
+        self.requests = 0   # 已发出的请求数
+
+    def watch(self, project_id, pipeline_id, callback):
+        """监听流水线，进入stop_status时回调"""
+        with self._lock:
+            self._watched[(project_id, pipeline_id)] = {'status': None, 'callback': callback}
+            project = self._projects.setdefault(project_id, {'updated_after': None, 'next_poll': 0, 'pipelines': set()})
+            project['pipelines'].add(pipeline_id)
+            project['next_poll'] = 0    # 新加入的流水线尽快拿到状态
+
+    def unwatch(self, project_id, pipeline_id):
+        with self._lock:
+            self._watched.pop((project_id, pipeline_id), None)
+            project = self._projects.get(project_id)
+            if project is not None:
+                project['pipelines'].discard(pipeline_id)
+                if not project['pipelines']:
+                    self._projects.pop(project_id)
+
+    @property
+    def watching(self) -> int:
+        return len(self._watched)
+
+    def _get_interval(self, project_id) -> float:
+        """项目的轮询间隔：取其被监听流水线中最短的间隔"""
+        statuses = [self._watched[(project_id, pid)]['status'] for pid in self._projects[project_id]['pipelines']]
+        return min((self.intervals.get(s, self.default_interval) for s in statuses), default=self.default_interval)
+
+    def _update(self, project_id, pipeline: dict):
+        """更新流水线状态，进入stop_status时回调并取消监听；回调在锁外执行"""
+        with self._lock:
+            watched = self._watched.get((project_id, pipeline['id']))  # 可能已被其他线程或回调取消监听
+            if watched is None or watched['status'] == pipeline['status']:
+                return
+            old_status, watched['status'] = watched['status'], pipeline['status']
+            if pipeline['status'] not in self.api.stop_status:
+                return
+            self.unwatch(project_id, pipeline['id'])
+        try:
+            watched['callback'](self, project_id=project_id, pipeline_id=pipeline['id'], status=pipeline['status'],
+                                old_status=old_status, pipeline=pipeline)
+        except Exception as e:
+            log.exception('GitlabPipelineWatcher回调异常', project_id, pipeline['id'], e=e)
+
+    def _poll_project(self, project_id):
+        """请求与回调都不持有self._lock，只在读写监听状态时加锁"""
+        with self._lock:
+            project = self._projects.get(project_id)
+            if project is None:
+                return
+            updated_after = project['updated_after']
+        params = {"per_page": 100, "order_by": "updated_at", "sort": "desc"}
+        if updated_after:
+            params["updated_after"] = updated_after
+        # 只取按updated_at倒序的第一页：请求量与项目数成正比
+        pipelines = list(self.api.iter_all(f"{self.api.url}/projects/{project_id}/pipelines", params,
+                                           fields=self.fields, iterations=1, prefetch=False))
+        self.requests += 1
+
+        latest = None
+        for pipeline in pipelines:
+            self._update(project_id, pipeline)
+            latest = max(latest or pipeline['updated_at'], pipeline['updated_at'])
+
+        # 逐条补查：仍没拿到状态的流水线（早于列表窗口）；第一页已满时，不在该页中的流水线也可能有更新
+        listed = {pipeline['id'] for pipeline in pipelines} if len(pipelines) >= params['per_page'] else None
+        with self._lock:
+            if latest:
+                latest = datetime.fromisoformat(latest.replace('Z', '+00:00')) - timedelta(seconds=self.overlap)
+                project['updated_after'] = latest.isoformat()
+            recheck = [pipeline_id for pipeline_id in project['pipelines']
+                       if self._watched[(project_id, pipeline_id)]['status'] is None
+                       or (listed is not None and pipeline_id not in listed)]
+        for pipeline_id in recheck:
+            pipeline = self.api.get_pipeline(project_id, pipeline_id)
+            self.requests += 1
+            if 'status' in pipeline:
+                self._update(project_id, pipeline)
+
+    def poll(self, now: float = None) -> float:
+        """轮询所有到期的项目；请求和回调期间不持有锁，watch/unwatch不会被阻塞
+        :return: 距离下一次到期的秒数"""
+        now = now or time.time()
+        with self._poll_lock:   # 串行化轮询
+            with self._lock:
+                due = [pid for pid, p in self._projects.items() if p['next_poll'] <= now]
+            for project_id in due:
+                try:
+                    self._poll_project(project_id)
+                except Exception as e:
+                    log.exception('GitlabPipelineWatcher轮询异常', project_id, e=e)
+                with self._lock:
+                    if project_id in self._projects:
+                        self._projects[project_id]['next_poll'] = now + self._get_interval(project_id)
+        with self._lock:
+            next_poll = min((p['next_poll'] for p in self._projects.values()), default=now + self.default_interval)
+        return max(next_poll - time.time(), 0)
+
+    def run(self, timeout: float = None):
+        """阻塞轮询，直到所有流水线结束、超时或stop"""
+        deadline = timeout and time.time() + timeout
+        while self._watched and not self._stop.is_set():
+            wait = self.poll()
+            if deadline:
+                wait = min(wait, deadline - time.time())
+                if wait < 0:
+                    break
+            self._stop.wait(wait)
+
+    def start(self):
+        """在后台守护线程中轮询；无流水线可监听时线程空转等待"""
+        def loop():
+            while not self._stop.is_set():
+                self._stop.wait(self.poll() if self._watched else 1)
+        self._stop.clear()
+        self._thread = threading.Thread(target=loop, name='gitlab_pipeline_watcher', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
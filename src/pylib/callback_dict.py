@@ -1,32 +1,456 @@
 # -*- coding:utf-8 -*-
-import copy
+import re
+import fnmatch
+import asyncio
+import inspect
+import weakref
+import threading
+import contextlib
+
+from collections import namedtuple, deque
+
+from pylib.log import log
+from pylib.thread_pool import ThreadPool
+
+_MISSING = object()
+_BATCH_LANE = object()
+
+# 批量修改的差异：added {key: value}，changed {key: (old_value, value)}，removed {key: old_value}
+CallbackDiff = namedtuple('CallbackDiff', ['added', 'changed', 'removed'])
+
+
+class CallbackDispatcher:
+    """回调异步分发：写字典不再阻塞在回调（如发送飞书消息）上
+        1. 每个key一条通道，通道内同时只有一个回调在执行，保证同一key的回调按顺序执行；不同key之间并发。
+        2. 同一key的回调在排队期间被合并：只投递最新的value，old_value保留为上一次投递的值。
+        3. 执行中和排队的回调数不超过max_pending，满时写字典的线程阻塞等待
+           （在事件循环线程内、或回调内再写字典时无法等待——只有回调所在通道能释放名额，会死锁——仍然入队）。
+    使用方法：
+        d = CallbackDict(callback, dispatcher=CallbackDispatcher())             # ThreadPool的公共线程池
+        d = CallbackDict(callback, dispatcher=CallbackDispatcher(ThreadPool(4)))
+        d = CallbackDict(callback, dispatcher=CallbackDispatcher(loop=loop))    # 回调可以是协程函数
+        d.drain()   # 等待所有回调执行完成
+    """
+
+    def __init__(self, executor=None, loop: asyncio.AbstractEventLoop = None, max_pending: int = 1024):
+        """
+        :params executor: ThreadPool实例或concurrent.futures的Executor，默认ThreadPool的公共线程池
+        :params loop: 事件循环，指定后回调在该循环中执行
+        :params max_pending: 执行中和排队的回调数上限
+        """
+        self.executor = executor
+        self.loop = loop
+        self.max_pending = max_pending
+        self._cond = threading.Condition()
+        self._lanes = {}    # lane -> deque([func, args, kwargs, merge])；lane存在表示该通道有回调正在执行
+        self._pending = 0
+        self._local = threading.local()     # running: 当前线程是否正在执行本分发器的回调
+
+    def _in_loop(self) -> bool:
+        """当前是否在self.loop的线程中"""
+        try:
+            return self.loop is not None and asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+    def _cannot_wait(self) -> bool:
+        """当前线程不能阻塞等待名额：在事件循环线程中，或正在执行本分发器的回调"""
+        return getattr(self._local, 'running', False) or self._in_loop()
+
+    def submit(self, lane, func, args=(), kwargs=None, merge=None):
+        """提交回调
+        :params lane: 通道，同一通道内按顺序执行
+        :params merge: merge(排队中的kwargs, 新的kwargs) -> 合并后的kwargs；None表示不合并"""
+        kwargs = kwargs or {}
+        with self._cond:
+            while True:
+                queue = self._lanes.get(lane)
+                if queue and merge is not None and queue[-1][0] is func and queue[-1][3] is merge:
+                    queue[-1][2] = merge(queue[-1][2], kwargs)
+                    return
+                if len(self._lanes) + self._pending < self.max_pending or self._cannot_wait():
+                    break
+                self._cond.wait()
+            if queue is None:
+                self._lanes[lane] = deque()
+                self._start(lane, func, args, kwargs)
+            else:
+                queue.append([func, args, kwargs, merge])
+                self._pending += 1
+
+    def _start(self, lane, func, args, kwargs):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._run, lane, func, args, kwargs)
+        elif self.executor is None:
+            ThreadPool.submit_static(self._run, lane, func, args, kwargs)
+        else:
+            getattr(self.executor, 'executor', self.executor).submit(self._run, lane, func, args, kwargs)
+
+    def _execute(self, func, args, kwargs):
+        """执行回调；协程在事件循环中调度（返回Future），无事件循环时就地运行"""
+        result = func(*args, **kwargs)
+        if inspect.isawaitable(result):
+            if self.loop is None:
+                return asyncio.run(result)
+            return asyncio.ensure_future(result, loop=self.loop)
+
+    def _run(self, lane, func, args, kwargs):
+        running, self._local.running = getattr(self._local, 'running', False), True
+        try:
+            future = self._execute(func, args, kwargs)
+        except Exception as e:
+            log.exception('CallbackDict回调异常', getattr(func, '__name__', func), e=e)
+        else:
+            if isinstance(future, asyncio.Future):
+                return future.add_done_callback(lambda f: self._done(lane, f))
+        finally:
+            self._local.running = running
+        self._done(lane)
+
+    def _done(self, lane, future=None):
+        """回调结束：启动该通道的下一个回调"""
+        if future is not None and not future.cancelled() and future.exception() is not None:
+            log.error('CallbackDict回调异常', future.exception())
+        with self._cond:
+            queue = self._lanes[lane]
+            if queue:
+                func, args, kwargs, _ = queue.popleft()
+                self._pending -= 1
+                self._start(lane, func, args, kwargs)
+            else:
+                del self._lanes[lane]
+            self._cond.notify_all()
+
+    @property
+    def pending(self) -> int:
+        """正在执行和排队的回调数"""
+        with self._cond:
+            return len(self._lanes) + self._pending
+
+    def drain(self, timeout: float = None) -> bool:
+        """等待所有回调执行完成（不要在self.loop的线程中调用）；超时返回False"""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._lanes, timeout)
+
+
+class Subscription:
+    """CallbackDict的订阅句柄：unsubscribe()取消订阅，也可用作with上下文；支持弱引用
+        weak=True时只弱引用fn（绑定方法用WeakMethod），fn被回收后订阅自动取消，不会因订阅而泄漏订阅者"""
+    __slots__ = ('pattern', 'prefix', 'regex', '_fn', '_weak', '_owner', '__weakref__')
+    _glob_chars = re.compile(r'[*?\[]')
+
+    def __init__(self, owner, pattern, fn, weak=False):
+        self.pattern = pattern
+        self.prefix = self.regex = None     # 通配订阅：字面前缀、除“前缀*”外的正则
+        if isinstance(pattern, str):
+            glob = self._glob_chars.search(pattern)
+            if glob:
+                self.prefix = pattern[:glob.start()]
+                if pattern != self.prefix + '*':
+                    self.regex = re.compile(fnmatch.translate(pattern))
+        self._owner = weakref.ref(owner)
+        self._weak = weak
+        if weak:
+            this = weakref.ref(self)
+            on_collect = lambda _: this() is not None and this().unsubscribe()  # noqa: E731
+            self._fn = weakref.WeakMethod(fn, on_collect) if inspect.ismethod(fn) else weakref.ref(fn, on_collect)
+        else:
+            self._fn = fn
+
+    @property
+    def is_pattern(self) -> bool:
+        return self.prefix is not None
+
+    @property
+    def fn(self):
+        return self._fn() if self._weak else self._fn
+
+    def matches(self, key) -> bool:
+        if not self.is_pattern:
+            return key == self.pattern
+        return isinstance(key, str) and key.startswith(self.prefix) and (self.regex is None or bool(self.regex.match(key)))
+
+    def __call__(self, d, **kwargs):
+        fn = self.fn
+        if fn is None:
+            return self.unsubscribe()
+        return fn(d, **kwargs)
+
+    def unsubscribe(self):
+        owner = self._owner()
+        if owner is not None:
+            owner.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.unsubscribe()
+
+    def __repr__(self):
+        return f"<Subscription {self.pattern!r}>"
+
+
+class _SubscriptionIndex:
+    """订阅索引：精确key走哈希表，通配订阅挂在其字面前缀的字典树节点上
+        一次写入只需查一次哈希表，再沿key的字符走一遍字典树，只检查前缀匹配的通配订阅，与订阅总数无关"""
+    _subs = None    # 字典树节点中存放订阅的键
+
+    def __init__(self):
+        self.exact = {}     # key -> {Subscription: None}
+        self.trie = {}      # 字符 -> 子节点；节点[None] = {Subscription: None}
+        self.count = 0
+
+    def add(self, sub: Subscription):
+        if sub.is_pattern:
+            node = self.trie
+            for char in sub.prefix:
+                node = node.setdefault(char, {})
+            node.setdefault(self._subs, {})[sub] = None
+        else:
+            self.exact.setdefault(sub.pattern, {})[sub] = None
+        self.count += 1
+
+    def remove(self, sub: Subscription) -> bool:
+        if not sub.is_pattern:
+            subs = self.exact.get(sub.pattern)
+            if subs is None or subs.pop(sub, _MISSING) is _MISSING:
+                return False
+            if not subs:
+                del self.exact[sub.pattern]
+        else:
+            path, node = [], self.trie
+            for char in sub.prefix:
+                path.append((node, char))
+                node = node.get(char)
+                if node is None:
+                    return False
+            subs = node.get(self._subs)
+            if subs is None or subs.pop(sub, _MISSING) is _MISSING:
+                return False
+            if not subs:
+                del node[self._subs]
+            for parent, char in reversed(path):     # 清理空节点
+                if parent[char]:
+                    break
+                del parent[char]
+        self.count -= 1
+        return True
+
+    def match(self, key) -> list:
+        """与key相关的订阅"""
+        matched = list(self.exact.get(key, ()))
+        if isinstance(key, str) and self.trie:
+            node = self.trie
+            for char in key:
+                matched.extend(sub for sub in node.get(self._subs, ()) if sub.regex is None or sub.regex.match(key))
+                node = node.get(char)
+                if node is None:
+                    break
+            else:
+                matched.extend(sub for sub in node.get(self._subs, ()) if sub.regex is None or sub.regex.match(key))
+        return matched
 
 
 class CallbackDict(dict):
-    """可回调（被监听）的字典，当字典中的值发生变化时，会调用callback函数"""
+    """可回调（被监听）的字典，当字典中的值发生变化时，会调用callback函数
+        逐个修改：每个发生变化的key调用一次 callback(self, key=, value=, old_value=)，删除时value为None
+        批量修改（with d.batch() 或 update）：全部修改完成后，
+            有batch_callback时调用一次 batch_callback(self, diff=CallbackDiff)，
+            否则对每个最终发生变化的key调用一次callback
+        指定dispatcher后回调异步执行，见CallbackDispatcher
+        subscribe(key或通配, fn)：只在相关key变化时调用fn(self, key=, value=, old_value=)，批量修改时按最终差异逐个key调用
+        指定journal后每次修改都会持久化，重启时自动恢复，见CallbackJournal
+    """
     callback = None
+    batch_callback = None
+    journal = None
 
-    def __init__(self, callback=None, default_dict=None):
+    def __init__(self, callback=None, default_dict=None, batch_callback=None, dispatcher: CallbackDispatcher = None,
+                 journal=None):
+        """
+        :params journal: CallbackJournal；已有持久化数据时以恢复的状态为准（忽略default_dict），恢复不触发回调
+        """
         super(CallbackDict, self).__init__(default_dict or {})
         self.callback = callback
+        self.batch_callback = batch_callback
+        self.dispatcher = dispatcher
+        self.journal = journal
+        if journal is not None:
+            if journal.is_new:
+                for key, value in self.items():
+                    journal.set(key, value)
+            else:
+                super(CallbackDict, self).clear()
+                super(CallbackDict, self).update(journal.recovered)
+            journal.attach(self)
+        # 有journal时：修改与追加日志在journal.lock内进行，写快照时在锁内复制状态；回调在锁外执行
+        self._write_lock = journal.lock if journal is not None else contextlib.nullcontext()
+        self._subscriptions = _SubscriptionIndex()
+        self._batch = threading.local()     # 每个线程各自的批量修改：depth嵌套层数，old: key -> 批量开始前的值
 
-    def __setitem__(self, key, value):
-        old_value = self.get(key)
-        if old_value != value:
+    def _changed(self, key, old_value):
+        """key的值发生变化：批量修改中只记录最初的值，否则立即回调（只有batch_callback时按单个key的差异回调）"""
+        batch_old = getattr(self._batch, 'old', None)
+        if batch_old is not None:
+            return batch_old.setdefault(key, old_value)
+        if self.callback is None and self.batch_callback is not None:
+            return self._notify(self._diff({key: old_value}))
+        value, old_value = self.get(key), None if old_value is _MISSING else old_value
+        if self.callback is not None:
+            self._invoke(key, self.callback, value=value, old_value=old_value)
+        self._publish(key, value, old_value)
+
+    def _journal_set(self, key, value):
+        """在_write_lock内、修改字典之前调用：key或value无法JSON序列化时抛出TypeError，字典保持不变"""
+        if self.journal is not None:
+            self.journal.set(key, value)
+
+    def _set(self, key, value):
+        """值未变化时不修改、不回调；不存在的key与None视为相同（给不存在的key赋值None不保存、不回调）"""
+        with self._write_lock:
+            old_value = super(CallbackDict, self).get(key, _MISSING)
+            if (None if old_value is _MISSING else old_value) == value:
+                return
+            self._journal_set(key, value)
             super(CallbackDict, self).__setitem__(key, value)
-            self.callback(self, key=key, value=value, old_value=old_value)
+        self._changed(key, old_value)
+
+    def _del(self, key):
+        with self._write_lock:
+            old_value = super(CallbackDict, self).pop(key)
+            if self.journal is not None:
+                self.journal.delete(key)
+        self._changed(key, old_value)
+        return old_value
+
+    def __setitem__(self, key, value):
+        self._set(key, value)
 
     def __delitem__(self, key):
-        super(CallbackDict, self).__delitem__(key)
+        self._del(key)
+
+    def pop(self, key, *default):
+        if key not in self:
+            return super(CallbackDict, self).pop(key, *default)
+        return self._del(key)
+
+    def popitem(self):
+        with self._write_lock:
+            key, value = super(CallbackDict, self).popitem()
+            if self.journal is not None:
+                self.journal.delete(key)
+        self._changed(key, value)
+        return key, value
+
+    def clear(self):
+        with self.batch():
+            for key in list(self):
+                self._del(key)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            if default is None:     # 与_set一致：None与不存在视为相同，只保存不回调
+                with self._write_lock:
+                    self._journal_set(key, None)
+                    super(CallbackDict, self).__setitem__(key, None)
+            else:
+                self._set(key, default)
+        return self[key]
 
     def update(self, *args, **kwargs):
-        """覆写父类的 update 方法，使得在调用 update 方法时，也会调用 callback 函数"""
-        for key, value in dict(*args, **kwargs).items():
-            self[key] = value  # 利用已经覆写的 __setitem__ 方法，检测值是否发生变化来调用callback
+        """覆写父类的 update 方法：全部修改完成后再统一回调"""
+        with self.batch():
+            for key, value in dict(*args, **kwargs).items():
+                self._set(key, value)
+
+    @contextlib.contextmanager
+    def batch(self):
+        """批量修改：块内的修改立即生效，退出时按最终差异统一回调（可嵌套，以最外层为准）
+        批量状态按线程区分：只合并当前线程在块内的修改，其他线程的修改照常立即回调"""
+        depth = getattr(self._batch, 'depth', 0)
+        if not depth:
+            self._batch.old = {}
+        self._batch.depth = depth + 1
+        try:
+            yield self
+        finally:
+            self._batch.depth = depth
+            if not depth:
+                old, self._batch.old = self._batch.old, None
+                self._notify(self._diff(old))
+
+    def _diff(self, old: dict) -> CallbackDiff:
+        """由批量开始前的值计算差异；改了又改回的key不算变化"""
+        diff = CallbackDiff({}, {}, {})
+        for key, old_value in old.items():
+            value = super(CallbackDict, self).get(key, _MISSING)
+            if old_value is _MISSING:
+                if value is not _MISSING:
+                    diff.added[key] = value
+            elif value is _MISSING:
+                diff.removed[key] = old_value
+            elif value != old_value:
+                diff.changed[key] = (old_value, value)
+        return diff
+
+    @staticmethod
+    def _changes(diff: CallbackDiff):
+        """差异展开为(key, value, old_value)"""
+        yield from ((key, value, None) for key, value in diff.added.items())
+        yield from ((key, value, old_value) for key, (old_value, value) in diff.changed.items())
+        yield from ((key, None, old_value) for key, old_value in diff.removed.items())
+
+    def _notify(self, diff: CallbackDiff):
+        if not any(diff):
+            return
+        if self.batch_callback is not None:
+            self._invoke(_BATCH_LANE, self.batch_callback, diff=diff)
+        elif self.callback is not None:
+            for key, value, old_value in self._changes(diff):
+                self._invoke(key, self.callback, value=value, old_value=old_value)
+        if self._subscriptions.count:
+            for key, value, old_value in self._changes(diff):
+                self._publish(key, value, old_value)
+
+    def subscribe(self, key_or_pattern, fn, weak=False) -> Subscription:
+        """订阅key的变化：fn(self, key=, value=, old_value=)
+        :params key_or_pattern: 精确的key，或含*?[的通配字符串（如'robot.*.battery'），通配只匹配str类型的key
+        :params weak: 只弱引用fn，fn被回收后自动取消订阅
+        :return: Subscription，调用unsubscribe()取消订阅"""
+        sub = Subscription(self, key_or_pattern, fn, weak=weak)
+        self._subscriptions.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> bool:
+        return self._subscriptions.remove(sub)
+
+    def _publish(self, key, value, old_value):
+        """通知订阅了key的订阅者"""
+        if self._subscriptions.count:
+            for sub in self._subscriptions.match(key):
+                self._invoke(key, sub, lane=sub, value=value, old_value=old_value)
+
+    @staticmethod
+    def _merge_change(queued: dict, new: dict) -> dict:
+        """合并同一key排队中的回调：取最新的value，保留最早的old_value"""
+        return {**new, 'old_value': queued['old_value']}
+
+    def _invoke(self, key, func, lane=None, **kwargs):
+        """调用回调：同步，或交给dispatcher（同一key、同一订阅者的通道内按顺序、合并）"""
+        if key is not _BATCH_LANE:
+            kwargs['key'] = key
+        if self.dispatcher is None:
+            return func(self, **kwargs)
+        if key is _BATCH_LANE:
+            return self.dispatcher.submit((id(self), key), func, (self,), kwargs)
+        self.dispatcher.submit((id(self), key, lane), func, (self,), kwargs, merge=self._merge_change)
+
+    def drain(self, timeout: float = None) -> bool:
+        """等待dispatcher中的回调执行完成；超时返回False"""
+        return self.dispatcher is None or self.dispatcher.drain(timeout)
 
     def setdict(self, key, value):
         """处理第二级字典的回调"""
-        self.setdefault(key, {})
-        old_value = copy.deepcopy(self[key])
-        old_value.update(value)
-        self[key] = old_value
+        old_value = self.get(key)
+        self[key] = {**(old_value or {}), **value}     # 浅拷贝即可：旧的第二级字典本身不被修改
@@ -0,0 +1,204 @@
+# -*- coding:utf-8 -*-
+import os
+import re
+import glob
+import json
+import time
+import atexit
+import threading
+
+from pylib.log import log
+
+
+class CallbackJournal:
+    """CallbackDict的持久化：NDJSON追加日志 + 定期快照，重启时由最新快照和其后的日志恢复状态
+        1. 每次修改追加一行：[key, value] 表示设置，[key] 表示删除；写入内存缓冲后立即返回，
+           后台线程批量写盘并fsync（组提交），写入速度接近纯内存；需要落盘保证时调用sync()。
+        2. 日志超过compact_bytes（或距上次快照超过compact_interval秒）时，后台切换到新日志文件并写快照，
+           快照完成后删除旧日志。回放是幂等的，切换时并发的修改重复回放也没有问题。
+        3. 进程崩溃时最多丢失最近一次组提交之后的修改；日志末尾写了一半的行会被忽略。
+        key和value需可JSON序列化；key可为str、int、float、bool、None或由它们组成的tuple（日志中为JSON数组，恢复时还原为tuple）。
+    文件：
+        {path}.snapshot             第一行 {"seq": N}，之后每行一个[key, value]
+        {path}.{seq:08d}.ndjson     日志，回放seq >= N的所有日志
+    使用方法：
+        d = CallbackDict(callback, journal=CallbackJournal('/data/state'))
+    """
+    _journal_re = re.compile(r'\.(\d{8})\.ndjson$')
+
+    def __init__(self, path: str, commit_interval: float = 0.05, compact_bytes: int = 16 * 1024 * 1024,
+                 compact_interval: float = None):
+        """
+        :params path: 文件路径前缀
+        :params commit_interval: 组提交的等待时间（秒），期间的修改合并为一次fsync
+        :params compact_bytes: 日志超过该字节数时写快照
+        :params compact_interval: 距上次快照超过该秒数（且有新日志）时写快照，None表示只按字节数
+        """
+        self.path = path
+        self.commit_interval = commit_interval
+        self.compact_bytes = compact_bytes
+        self.compact_interval = compact_interval
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._cond = threading.Condition()
+        self._io_lock = threading.Lock()    # 写日志与切换日志文件、写快照互斥
+        self.lock = threading.RLock()   # 写入锁：CallbackDict修改并追加日志时持有，写快照时在锁内复制状态
+        self._buffer = []
+        self._appended = self._committed = 0     # 已追加、已落盘的条数
+        self._sync_requested = False
+        self._closed = False
+        self._state = None
+        self._compacted_at = time.time()
+        self.recovered, self.is_new, self._seq, self._journal_bytes = self._recover()
+        self._seq += 1  # 每次启动写新的日志文件，避免接在可能写了一半的行后面
+        self._file = open(self._journal_path(self._seq), 'ab')
+        self._thread = threading.Thread(target=self._loop, name='callback_journal', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _journal_path(self, seq: int) -> str:
+        return f"{self.path}.{seq:08d}.ndjson"
+
+    @property
+    def _snapshot_path(self) -> str:
+        return f"{self.path}.snapshot"
+
+    def _journals(self) -> list:
+        """已有的日志：[(seq, path)]，按seq排序"""
+        journals = []
+        for path in glob.glob(glob.escape(self.path) + '.*.ndjson'):
+            match = self._journal_re.search(path)
+            if match:
+                journals.append((int(match.group(1)), path))
+        return sorted(journals)
+
+    @classmethod
+    def _key(cls, key):
+        """JSON数组还原为tuple（dict的key不可能是list）"""
+        return tuple(map(cls._key, key)) if isinstance(key, list) else key
+
+    def _recover(self):
+        """读取快照并回放日志，返回(状态, 是否没有任何持久化数据, 最大seq, 需回放的日志字节数)"""
+        state, seq, is_new = {}, 0, True
+        if os.path.exists(self._snapshot_path):
+            is_new = False
+            with open(self._snapshot_path, encoding='utf-8') as f:
+                seq = json.loads(f.readline())['seq']
+                for line in f:
+                    key, value = json.loads(line)
+                    state[self._key(key)] = value
+        journal_bytes = 0
+        for journal_seq, path in self._journals():
+            if journal_seq < seq:
+                continue
+            is_new = False
+            journal_bytes += os.path.getsize(path)
+            with open(path, encoding='utf-8') as f:
+                for line_no, line in enumerate(f, 1):
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        log.warning('CallbackJournal忽略不完整的日志行', path, line_no)
+                        break
+                    if len(record) == 2:
+                        state[self._key(record[0])] = record[1]
+                    else:
+                        state.pop(self._key(record[0]), None)
+            seq = max(seq, journal_seq)
+        log.debug('CallbackJournal恢复完成', self.path, len(state), f"seq={seq}")
+        return state, is_new, seq, journal_bytes
+
+    def attach(self, state: dict):
+        """绑定要持久化的字典，写快照时读取它"""
+        self._state = state
+
+    def _append(self, record: list):
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n'
+        with self._cond:
+            self._buffer.append(line)
+            self._appended += 1
+            if len(self._buffer) == 1:
+                self._cond.notify_all()
+
+    def set(self, key, value):
+        self._append([key, value])
+
+    def delete(self, key):
+        self._append([key])
+
+    def _compact_due(self) -> bool:
+        if self._state is None or not self._journal_bytes:
+            return False
+        return self._journal_bytes >= self.compact_bytes or \
+            (self.compact_interval is not None and time.time() - self._compacted_at >= self.compact_interval)
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._buffer or self._closed, self.compact_interval)
+                if self._buffer and not (self._closed or self._sync_requested):
+                    self._cond.wait(self.commit_interval)   # 等待更多修改，合并为一次fsync
+                buffer, self._buffer, target = self._buffer, [], self._appended
+                self._sync_requested = False
+                if not buffer and self._closed:
+                    return
+            if buffer:
+                self._commit(''.join(buffer).encode('utf-8'), target)
+            if self._compact_due():
+                try:
+                    self.compact()
+                except Exception as e:
+                    log.exception('CallbackJournal写快照失败', self.path, e=e)
+
+    def _commit(self, data: bytes, target: int):
+        try:
+            with self._io_lock:
+                self._file.write(data)
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._journal_bytes += len(data)
+        except Exception as e:
+            log.exception('CallbackJournal写日志失败', self.path, e=e)
+        with self._cond:
+            self._committed = target
+            self._cond.notify_all()
+
+    def compact(self):
+        """写快照并删除旧日志（默认由后台线程自动调用）"""
+        with self._io_lock:
+            with self.lock, self._cond:     # 在写入锁内复制状态，避免与其他线程的修改并发
+                self._seq += 1
+                self._file.close()
+                self._file = open(self._journal_path(self._seq), 'ab')
+                seq, state = self._seq, dict(self._state)
+            tmp_path = self._snapshot_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(json.dumps({"seq": seq}) + '\n')
+                for key, value in state.items():
+                    f.write(json.dumps([key, value], ensure_ascii=False, separators=(',', ':')) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self._snapshot_path)
+            for journal_seq, path in self._journals():
+                if journal_seq < seq:
+                    os.remove(path)
+            self._journal_bytes = 0
+            self._compacted_at = time.time()
+        log.debug('CallbackJournal快照完成', self.path, len(state), f"seq={seq}")
+
+    def sync(self, timeout: float = None) -> bool:
+        """等待此前的修改全部落盘；超时返回False"""
+        with self._cond:
+            target = self._appended
+            self._sync_requested = True
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: self._committed >= target, timeout)
+
+    def close(self):
+        """落盘剩余的修改并关闭（进程退出时自动调用）"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        self._file.close()
@@ -0,0 +1,187 @@
+# -*- coding:utf-8 -*-
+import threading
+
+from pylib.callback_dict import Subscription, CallbackDispatcher, CallbackDict
+
+_MISSING = object()
+
+
+class _Node(dict):
+    """CallbackTree的内部节点；gen为创建它的代，旧代的节点属于某个快照，只读"""
+    __slots__ = ('gen',)
+
+
+class CallbackTree:
+    """可回调（被监听）的嵌套树，如各机器人的状态树 {'robots': {'r1': {'battery': 80, ...}, ...}}
+        1. 变化以叶子为单位回调：callback(tree, path=('robots', 'r1', 'battery'), value=新值, old_value=旧值)，
+           新增时old_value为None，删除时value为None；替换整棵子树时只对真正变化的叶子回调。
+        2. 写时复制：snapshot()返回当前的根节点，之后的写入只复制被写路径上的节点，其余子树与快照共享。
+           因此一次写入的代价与路径深度（及路径上节点的宽度）成正比，与子树大小无关；不写时快照没有代价。
+        3. subscribe(path前缀, fn)：只在该前缀下的叶子变化时回调，匹配代价与路径深度成正比。
+    使用方法：
+        tree = CallbackTree(callback)
+        tree.update(('robots', 'r1'), {'battery': 80, 'state': 'idle'})     # 替代CallbackDict.setdict
+        tree.set(('robots', 'r1', 'battery'), 79)
+        old = tree.snapshot()   # 只读
+    """
+
+    def __init__(self, callback=None, default_dict=None, dispatcher: CallbackDispatcher = None):
+        self.callback = callback
+        self.dispatcher = dispatcher
+        self._lock = threading.RLock()
+        self._gen = 0
+        self._root = self._build(default_dict or {})
+        self._subscriptions = {}    # path前缀 -> {Subscription: None}
+
+    @staticmethod
+    def _path(path) -> tuple:
+        return path if isinstance(path, tuple) else (path,)
+
+    def _build(self, value):
+        """dict转为当前代的节点（复制，调用方之后修改原dict不影响树）；其他值原样作为叶子"""
+        if not isinstance(value, dict):
+            return value
+        node = _Node((key, self._build(child)) for key, child in value.items())
+        node.gen = self._gen
+        return node
+
+    def _own(self, node: _Node) -> _Node:
+        """写时复制：旧代（属于快照）的节点先浅复制为当前代"""
+        if node.gen == self._gen:
+            return node
+        node = _Node(node)
+        node.gen = self._gen
+        return node
+
+    def _writable(self, path: tuple) -> _Node:
+        """返回path对应节点的可写版本，路径上的旧代节点逐个复制"""
+        node = self._root = self._own(self._root)
+        for key in path:
+            child = self._own(node[key])
+            if child is not node[key]:
+                dict.__setitem__(node, key, child)
+            node = child
+        return node
+
+    def get(self, path, default=None):
+        node = self._root
+        for key in self._path(path):
+            if not isinstance(node, _Node) or key not in node:
+                return default
+            node = node[key]
+        return node
+
+    def __getitem__(self, path):
+        value = self.get(path, _MISSING)
+        if value is _MISSING:
+            raise KeyError(path)
+        return value
+
+    def __contains__(self, path):
+        return self.get(path, _MISSING) is not _MISSING
+
+    def _changes(self, path: tuple, old, new):
+        """比较新旧两棵子树，产出变化的叶子(path, value, old_value)；共享的子树直接跳过"""
+        if old is new:
+            return
+        old_is_node, new_is_node = isinstance(old, _Node), isinstance(new, _Node)
+        if not old_is_node and not new_is_node:
+            if old is _MISSING or new is _MISSING or old != new:
+                yield path, None if new is _MISSING else new, None if old is _MISSING else old
+            return
+        if not old_is_node and old is not _MISSING:
+            yield path, None, old   # 叶子被子树替换
+        old_children, new_children = old if old_is_node else {}, new if new_is_node else {}
+        for key, child in old_children.items():
+            yield from self._changes(path + (key,), child, new_children.get(key, _MISSING))
+        for key, child in new_children.items():
+            if key not in old_children:
+                yield from self._changes(path + (key,), _MISSING, child)
+        if not new_is_node and new is not _MISSING:
+            yield path, new, None   # 子树被叶子替换
+
+    def set(self, path, value):
+        """设置path的值；value为dict时替换整棵子树，路径中不存在的节点自动创建"""
+        path = self._path(path)
+        with self._lock:
+            node = self._root
+            for i, key in enumerate(path[:-1]):
+                child = node.get(key, _MISSING)
+                if not isinstance(child, _Node):    # 中间节点不存在或为叶子：改为在此处设置一棵子树
+                    for k in reversed(path[i + 1:]):
+                        value = {k: value}
+                    path = path[:i + 1]
+                    break
+                node = child
+            old, new = node.get(path[-1], _MISSING), self._build(value)
+            if not isinstance(new, _Node) and not isinstance(old, _Node) and old is not _MISSING and old == new:
+                return
+            dict.__setitem__(self._writable(path[:-1]), path[-1], new)
+            changes = list(self._changes(path, old, new))
+        self._emit(changes)
+
+    __setitem__ = set
+
+    def delete(self, path):
+        path = self._path(path)
+        with self._lock:
+            old = self[path]
+            dict.__delitem__(self._writable(path[:-1]), path[-1])
+            changes = list(self._changes(path, old, _MISSING))
+        self._emit(changes)
+
+    __delitem__ = delete
+
+    def update(self, path, value: dict):
+        """将value合并到path对应的子树（逐层合并嵌套的dict），只有变化的叶子会回调"""
+        path = self._path(path)
+        for key, child in value.items():
+            if isinstance(child, dict) and isinstance(self.get(path + (key,)), _Node):
+                self.update(path + (key,), child)
+            else:
+                self.set(path + (key,), child)
+
+    def snapshot(self) -> dict:
+        """当前状态的快照（只读，请勿修改）；之后的写入不会影响它"""
+        with self._lock:
+            self._gen += 1
+            return self._root
+
+    def to_dict(self, node=_MISSING) -> dict:
+        """转为普通的dict（深复制）"""
+        node = self._root if node is _MISSING else node
+        return {key: self.to_dict(child) if isinstance(child, _Node) else child for key, child in node.items()}
+
+    def subscribe(self, path_prefix, fn, weak=False) -> Subscription:
+        """订阅path_prefix下所有叶子的变化：fn(tree, path=, value=, old_value=)；空元组订阅全部"""
+        sub = Subscription(self, self._path(path_prefix), fn, weak=weak)
+        self._subscriptions.setdefault(sub.pattern, {})[sub] = None
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> bool:
+        subs = self._subscriptions.get(sub.pattern)
+        if subs is None or subs.pop(sub, _MISSING) is _MISSING:
+            return False
+        if not subs:
+            del self._subscriptions[sub.pattern]
+        return True
+
+    def _emit(self, changes: list):
+        for path, value, old_value in changes:
+            if self.callback is not None:
+                self._invoke(path, self.callback, value=value, old_value=old_value)
+            if self._subscriptions:
+                for i in range(len(path) + 1):
+                    for sub in list(self._subscriptions.get(path[:i], ())):
+                        self._invoke(path, sub, lane=sub, value=value, old_value=old_value)
+
+    def _invoke(self, path, func, lane=None, **kwargs):
+        """调用回调：同步，或交给dispatcher（同一path、同一订阅者的通道内按顺序、合并）"""
+        if self.dispatcher is None:
+            return func(self, path=path, **kwargs)
+        self.dispatcher.submit((id(self), path, lane), func, (self,), {'path': path, **kwargs},
+                               merge=CallbackDict._merge_change)
+
+    def drain(self, timeout: float = None) -> bool:
+        """等待dispatcher中的回调执行完成；超时返回False"""
+        return self.dispatcher is None or self.dispatcher.drain(timeout)
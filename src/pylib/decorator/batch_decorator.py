@@ -0,0 +1,210 @@
+from pylib.decorator.decorator import Decorator as _Decorator
+
+import asyncio
+import inspect
+import functools
+import threading
+
+from concurrent.futures import Future
+
+
+class _Batch:
+    """一批待合并的调用"""
+    __slots__ = ('scope', 'items', 'futures', 'full', 'closed', 'handle')
+
+    def __init__(self, scope):
+        self.scope = scope      # 实例方法、类方法的实例或类；否则为None
+        self.items = []
+        self.futures = []
+        self.full = threading.Event()
+        self.closed = False
+        self.handle = None      # 协程：定时flush的句柄
+
+
+class BatchDecorator(_Decorator):
+    """
+    批量合并装饰器：把多个线程或协程几乎同时发起的单个调用，合并成一次对批量函数的调用，各调用方拿回自己的结果
+        被装饰的是批量函数：接收items列表，返回与items一一对应的列表，或以item为key的dict
+        调用方按单个item调用：f(item)；多个位置参数时item为参数元组，f(project_id, job_id) -> item=(project_id, job_id)
+        第一个调用方最多等待max_wait_ms毫秒（凑满max_batch立即执行），期间到达的调用合并为一批
+        批量函数抛出异常时，该批所有调用方都抛出该异常；某个item的结果为异常实例时，只有该调用方抛出
+        使用方法：
+            @BatchDecorator(max_batch=50, max_wait_ms=5)
+            def get_jobs(self, items):     # items: [(project_id, job_id), ...]
+                return [...]
+            job = api.get_jobs(project_id, job_id)      # 多个线程并发调用
+        协程函数同理：async def批量函数，调用方 await f(item)；同一事件循环内的调用合并
+        实例方法按实例、类方法按类分批，批量函数的第一个参数为该实例或类
+    注意：
+        若同时使用@staticmethod注解
+        或用@classmethod注解，它们应当先于@BatchDecorator注解
+    """
+
+    def __init__(self, *args, max_batch: int = 100, max_wait_ms: float = 5, **kwargs):
+        """
+        :params max_batch: 每批最多的item数
+        :params max_wait_ms: 第一个调用到达后最多等待的毫秒数
+        """
+        super(BatchDecorator, self).__init__(*args, **kwargs)
+        self.max_batch = max_batch
+        self.max_wait_ms = max_wait_ms
+        self._lock = threading.Lock()
+        self._open = {}     # (id(scope), 事件循环) -> 正在收集的_Batch
+        self._scoped = False
+        self._tasks = set()     # 协程：执行中的批次任务（保持引用，避免被回收）
+        self._stats = {'calls': 0, 'batches': 0, 'errors': 0}
+
+    def __call__(self, *args, **kwargs):
+        """有参注解时，第一次调用传入的是被注解的函数：记录后返回自身"""
+        if self.callable_obj is None and len(args) == 1 and not kwargs and self._is_function(args[0]):
+            self.callable_obj = args[0]
+            return self
+        return super(BatchDecorator, self).__call__(*args, **kwargs)
+
+    def _split(self, args, kwargs):
+        """返回(scope, item)"""
+        if kwargs:
+            raise TypeError(f"{self.callable_obj.__name__}: 批量合并的调用不支持关键字参数")
+        scope = None
+        if self._scoped and args:
+            scope, args = args[0], args[1:]
+        return scope, args[0] if len(args) == 1 else args
+
+    def _enqueue(self, scope, item, loop=None):
+        """加入正在收集的批次，返回(批次, future, 是否为新批次, 是否已凑满)"""
+        key = (id(scope), loop)
+        with self._lock:
+            batch = self._open.get(key)
+            created = batch is None
+            if created:
+                batch = self._open[key] = _Batch(scope)
+            future = loop.create_future() if loop is not None else Future()
+            batch.items.append(item)
+            batch.futures.append(future)
+            self._stats['calls'] += 1
+            full = len(batch.items) >= self.max_batch
+            if full:
+                self._close(key, batch)
+        return batch, future, created, full
+
+    def _close(self, key, batch) -> bool:
+        """在锁内调用：停止收集；已停止时返回False"""
+        if batch.closed:
+            return False
+        batch.closed = True
+        if self._open.get(key) is batch:
+            del self._open[key]
+        self._stats['batches'] += 1
+        return True
+
+    def _batch_args(self, batch):
+        return (batch.scope, batch.items) if self._scoped else (batch.items,)
+
+    def _resolve(self, batch, results, error=None):
+        """把批量函数的结果分发给各调用方"""
+        if error is None and isinstance(results, dict):
+            try:
+                results = [results.get(item) for item in batch.items]
+            except TypeError as e:  # item不可哈希，无法按key取结果
+                error = e
+        elif error is None and (results is None or len(results) != len(batch.items)):
+            error = ValueError(f"{self.callable_obj.__name__}: 批量函数应返回{len(batch.items)}个结果，"
+                               f"实际为{None if results is None else len(results)}")
+        if error is not None:
+            with self._lock:
+                self._stats['errors'] += 1
+        for i, future in enumerate(batch.futures):
+            if future.done():   # 调用方已取消
+                continue
+            result = error or results[i]
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    @staticmethod
+    def _cancel(batch):
+        """批量函数被中断（BaseException，如CancelledError）或分发结果出错时，取消仍未完成的调用，避免调用方永远等待"""
+        for future in batch.futures:
+            if not future.done():
+                future.cancel()
+
+    def _call(self, args, kwargs):
+        scope, item = self._split(args, kwargs)
+        batch, future, created, full = self._enqueue(scope, item)
+        if created:     # 第一个调用方负责执行
+            if not full:
+                batch.full.wait(self.max_wait_ms / 1000)
+                with self._lock:
+                    self._close((id(scope), None), batch)
+            try:
+                try:
+                    results, error = self.callable_obj(*self._batch_args(batch)), None
+                except Exception as e:
+                    results, error = None, e
+                self._resolve(batch, results, error)
+            finally:
+                self._cancel(batch)
+        elif full:
+            batch.full.set()
+        return future.result()
+
+    async def _run(self, batch):
+        try:
+            try:
+                results, error = await self.callable_obj(*self._batch_args(batch)), None
+            except Exception as e:
+                results, error = None, e
+            self._resolve(batch, results, error)
+        finally:
+            self._cancel(batch)
+
+    def _spawn(self, loop, batch):
+        """在事件循环中执行该批，并保持任务引用直到完成"""
+        task = loop.create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _flush(self, key, batch):
+        """协程：等待时间到，执行该批"""
+        with self._lock:
+            if not self._close(key, batch):
+                return
+        self._spawn(key[1], batch)
+
+    async def _acall(self, args, kwargs):
+        scope, item = self._split(args, kwargs)
+        loop = asyncio.get_running_loop()
+        batch, future, created, full = self._enqueue(scope, item, loop)
+        if full:
+            if batch.handle is not None:
+                batch.handle.cancel()
+            self._spawn(loop, batch)
+        elif created:
+            batch.handle = loop.call_later(self.max_wait_ms / 1000, self._flush, (id(scope), loop), batch)
+        return await future
+
+    def _get_wrapper(self, instance=None, owner=None):
+        """获取装饰器函数"""
+        self._scoped = self._scoped or owner is not None or instance is not None
+
+        if inspect.iscoroutinefunction(self.callable_obj):
+            @functools.wraps(self.callable_obj)
+            async def wrapper(*args, **kwargs):
+                args = (instance,) + args if instance is not None else args     # 实例方法时，要将实例插入元组args首位
+                return await self._acall(args, kwargs)
+        else:
+            @functools.wraps(self.callable_obj)
+            def wrapper(*args, **kwargs):
+                args = (instance,) + args if instance is not None else args     # 实例方法时，要将实例插入元组args首位
+                return self._call(args, kwargs)
+
+        wrapper.batch_info = self.batch_info
+        return wrapper
+
+    def batch_info(self) -> dict:
+        """调用数、批次数、平均每批的调用数"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['avg_batch_size'] = stats['calls'] / stats['batches'] if stats['batches'] else 0
+        return stats
@@ -0,0 +1,216 @@
+from pylib.decorator.decorator import Decorator as _Decorator
+
+import time
+import asyncio
+import inspect
+import weakref
+import itertools
+import functools
+import threading
+
+from collections import OrderedDict
+
+_KWARGS_MARK = object()
+
+
+class _Flight:
+    """进行中的计算（线程）：同一key的并发调用等待同一个结果"""
+    __slots__ = ('event', 'value', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = self.error = None
+
+
+class CacheDecorator(_Decorator):
+    """
+    缓存装饰器：LRU + TTL，线程安全，并发未命中时只计算一次（single-flight），支持协程函数
+        使用方法：
+            无参注解：@CacheDecorator                           # maxsize=128，不过期
+            有参注解：@CacheDecorator(maxsize=1024, ttl=60, key=lambda project_id, **kwargs: project_id)
+        缓存范围（与_get_key一致）：实例方法按实例、类方法按类、静态方法和函数全局共享；实例被回收后其缓存不会被别的实例命中
+        key：默认由参数（不含self/cls）组成，参数需可哈希；也可传入key(*args, **kwargs)自定义
+        异常不缓存；缓存的是返回值本身，调用方不要修改返回的可变对象
+        统计与失效（func为被装饰后的函数或方法，如GitlabApi.get_project）：
+            func.cache_info()       # {'hits', 'misses', 'coalesced', 'evictions', 'expirations', 'currsize', ...}
+            func.cache_clear()
+            func.invalidate(*args, **kwargs)    # 参数与调用时相同；实例方法、类方法需把实例、类作为第一个参数传入
+    注意：
+        若同时使用@staticmethod注解
+        或用@classmethod注解，它们应当先于@CacheDecorator注解
+    """
+
+    def __init__(self, *args, maxsize: int = 128, ttl: float = None, key=None, **kwargs):
+        """
+        :params maxsize: 最多缓存的条数，None表示不限
+        :params ttl: 过期时间（秒），None表示不过期
+        :params key: 自定义缓存key的函数，参数与被装饰的函数相同（不含self/cls）
+        """
+        super(CacheDecorator, self).__init__(*args, **kwargs)
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.key = key
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()     # (scope, key) -> (过期时间, 值)
+        self._inflight = {}     # (scope, key) -> _Flight 或 asyncio.Future
+        self._generation = 0    # 失效时递增，进行中的计算结果不再写入缓存
+        self._scoped = False    # 是否为实例方法、类方法（第一个参数为实例或类）
+        self._scopes = weakref.WeakKeyDictionary()  # 实例或类 -> 缓存范围令牌（不复用）
+        self._tokens = itertools.count()
+        self._stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'evictions': 0, 'expirations': 0}
+
+    def __call__(self, *args, **kwargs):
+        """有参注解时，第一次调用传入的是被注解的函数：记录后返回自身"""
+        if self.callable_obj is None and len(args) == 1 and not kwargs and self._is_function(args[0]):
+            self.callable_obj = args[0]
+            return self
+        return super(CacheDecorator, self).__call__(*args, **kwargs)
+
+    def _scope(self, obj):
+        """实例或类的缓存范围：弱引用映射到不复用的令牌；不可弱引用时退回_get_key（按id）"""
+        try:
+            token = self._scopes.get(obj)
+            if token is None:
+                token = self._scopes.setdefault(obj, next(self._tokens))
+            return token
+        except TypeError:
+            return self._get_key(obj, obj if self._is_class(obj) else type(obj))
+
+    def _make_key(self, args, kwargs):
+        """返回(缓存key, 去掉实例后的args)"""
+        scope = None
+        if self._scoped and args:
+            scope, args = self._scope(args[0]), args[1:]
+        if self.key is not None:
+            return (scope, self.key(*args, **kwargs))
+        if kwargs:
+            return (scope, args + (_KWARGS_MARK,) + tuple(sorted(kwargs.items())))
+        return (scope, args)
+
+    def _lookup(self, key):
+        """在锁内调用：命中返回(True, 值)"""
+        entry = self._cache.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at is None or expires_at > time.monotonic():
+                self._cache.move_to_end(key)
+                self._stats['hits'] += 1
+                return True, value
+            del self._cache[key]
+            self._stats['expirations'] += 1
+        return False, None
+
+    def _store(self, key, value, generation):
+        """在锁内调用：写入缓存，超出maxsize时淘汰最久未用的"""
+        if generation != self._generation:
+            return
+        self._cache[key] = (None if self.ttl is None else time.monotonic() + self.ttl, value)
+        self._cache.move_to_end(key)
+        while self.maxsize is not None and len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+            self._stats['evictions'] += 1
+
+    def _call(self, key, args, kwargs):
+        with self._lock:
+            hit, value = self._lookup(key)
+            if hit:
+                return value
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+                self._stats['misses'] += 1
+            else:
+                self._stats['coalesced'] += 1
+            generation = self._generation
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+        try:
+            flight.value = self.callable_obj(*args, **kwargs)
+        except BaseException as e:
+            flight.error = e
+            raise
+        else:
+            with self._lock:
+                self._store(key, flight.value, generation)
+            return flight.value
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.event.set()
+
+    async def _acall(self, key, args, kwargs):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            hit, value = self._lookup(key)
+            if hit:
+                return value
+            future = self._inflight.get(key)
+            leader = future is None or future.get_loop() is not loop    # 其他事件循环中的计算不能等待
+            if leader:
+                future = self._inflight[key] = loop.create_future()
+                self._stats['misses'] += 1
+            else:
+                self._stats['coalesced'] += 1
+            generation = self._generation
+        if not leader:
+            return await asyncio.shield(future)
+        try:
+            value = await self.callable_obj(*args, **kwargs)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # 标记已读取，没有等待者时不告警
+            raise
+        else:
+            with self._lock:
+                self._store(key, value, generation)
+            future.set_result(value)
+            return value
+        finally:
+            with self._lock:
+                if self._inflight.get(key) is future:
+                    del self._inflight[key]
+
+    def _get_wrapper(self, instance=None, owner=None):
+        """获取装饰器函数"""
+        self._scoped = self._scoped or owner is not None or instance is not None
+
+        if inspect.iscoroutinefunction(self.callable_obj):
+            @functools.wraps(self.callable_obj)
+            async def wrapper(*args, **kwargs):
+                args = (instance,) + args if instance is not None else args     # 实例方法时，要将实例插入元组args首位
+                return await self._acall(self._make_key(args, kwargs), args, kwargs)
+        else:
+            @functools.wraps(self.callable_obj)
+            def wrapper(*args, **kwargs):
+                args = (instance,) + args if instance is not None else args     # 实例方法时，要将实例插入元组args首位
+                return self._call(self._make_key(args, kwargs), args, kwargs)
+
+        wrapper.cache_info = self.cache_info
+        wrapper.cache_clear = self.cache_clear
+        wrapper.invalidate = self.invalidate
+        return wrapper
+
+    def cache_info(self) -> dict:
+        with self._lock:
+            return {**self._stats, 'currsize': len(self._cache), 'inflight': len(self._inflight),
+                    'maxsize': self.maxsize, 'ttl': self.ttl}
+
+    def cache_clear(self):
+        """清空缓存（统计保留）"""
+        with self._lock:
+            self._cache.clear()
+            self._generation += 1
+
+    def invalidate(self, *args, **kwargs) -> bool:
+        """使单个key失效，参数与调用时相同；返回是否存在"""
+        key = self._make_key(args, kwargs)
+        with self._lock:
+            self._generation += 1
+            return self._cache.pop(key, None) is not None
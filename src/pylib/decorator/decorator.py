@@ -1,6 +1,10 @@
 import types
+import weakref
 import functools
 
+_class_types = (type, getattr(types, 'ClassType', type))     # py2的旧式类为types.ClassType
+_function_types = (types.FunctionType, types.BuiltinFunctionType, types.MethodType, types.BuiltinMethodType)
+
 
 class Decorator(object):
     """
@@ -20,12 +24,18 @@ class Decorator(object):
 
     若同时使用@staticmethod注解
     或用@classmethod注解时，它们应当先于@Decorator注解
+
+    绑定缓存：每个owner只生成一次装饰器函数（owner被弱引用），再用types.MethodType绑定到instance，
+        与Python绑定普通方法的方式相同；装饰器函数不持有instance，instance在调用时作为第一个参数传入，
+        因此_get_wrapper中的instance参数在该路径下为None。
     """
 
     def __init__(self, *args, **kwargs):
         """注解时触发，args和kwargs为可接收有参注解
         仅当对类使用@Decorator()注解时args长度才为0"""
         self.callable_obj = args[0] if len(args) > 0 else None  # 读取被注解的对象
+        self._wrappers = {}     # id(owner) -> (owner的弱引用, 装饰器函数)
+        self._call_wrapper = None   # 以call为入口时的装饰器函数
 
     def __getattr__(self, item):
         """读取被注解对象属性时触发
@@ -37,7 +47,17 @@ class Decorator(object):
         """以get为入口：
         实例化方法、类方法（被@classmethod装饰）
         被调用时"""
-        return self._get_wrapper(instance, owner)
+        cached = self._wrappers.get(id(owner))
+        if cached is not None and cached[0]() is owner:
+            wrapper = cached[1]
+        else:
+            wrapper = self._get_wrapper(None, owner)
+            try:
+                owner_id = id(owner)
+                self._wrappers[owner_id] = (weakref.ref(owner, lambda _: self._wrappers.pop(owner_id, None)), wrapper)
+            except TypeError:   # owner不可弱引用时不缓存
+                return self._get_wrapper(instance, owner)
+        return wrapper if instance is None else types.MethodType(wrapper, instance)
 
     def __call__(self, *args, **kwargs):
         """以call为入口：
@@ -48,7 +68,9 @@ class Decorator(object):
         if not self.callable_obj and len(args) > 0 and (self._is_class(args[0]) or self._is_function(args[0])):
             self.callable_obj = self.callable_obj or args[0]
             args = args[1:]
-        return self._get_wrapper()(*args, **kwargs)
+        if self._call_wrapper is None:
+            self._call_wrapper = self._get_wrapper()
+        return self._call_wrapper(*args, **kwargs)
 
     def _get_key(self, instance=None, owner=None, *args, **kwargs):
         """获取被注解方法的唯一key标志符"""
@@ -69,20 +91,20 @@ class Decorator(object):
     @staticmethod
     def _is_class(obj):
         """判断是否是类"""
-        return isinstance(obj, (type, getattr(types, 'ClassType', type)))
+        return isinstance(obj, _class_types)
 
     @staticmethod
     def _is_function(obj):
         """判断是否是函数"""
-        return isinstance(obj,
-                          (types.FunctionType, types.BuiltinFunctionType, types.MethodType, types.BuiltinMethodType))
+        return isinstance(obj, _function_types)
 
     def _get_wrapper(self, instance=None, owner=None):
         """获取装饰器函数"""
         @functools.wraps(self.callable_obj)
         def wrapper(*args, **kwargs):
-            # 有参类装饰时，在这里赋值callable_obj
-            if len(args) > 0 and self._is_class(args[0]):
+            # 有参类装饰时，在这里赋值callable_obj；装饰的是函数时第一个参数可能是类（类方法绑定的cls），不能替换
+            if (self.callable_obj is None or self._is_class(self.callable_obj)) and len(args) > 0 \
+                    and self._is_class(args[0]):
                 self.callable_obj = args[0]
                 args = args[1:]
 
@@ -3,10 +3,8 @@ from pylib.decorator.decorator import Decorator as _Decorator
 import time
 import functools
 
-from collections import deque
-from collections import defaultdict
-
 from pylib.log import log
+from pylib.histogram import HistogramRegistry
 
 
 class TimeitDecorator(_Decorator):
@@ -15,34 +13,65 @@ class TimeitDecorator(_Decorator):
         使用方法：
             无参注解：@TimeitDecorator
             有参注解：@TimeitDecorator()
+        耗时按key（如 Request/get）记录到对数-线性直方图（微秒），只有超过慢调用阈值的调用才打日志：
+            TimeitDecorator.set_slow_threshold('Request/get', 2000)    # 单个key的阈值（毫秒）
+            TimeitDecorator.snapshot()      # {key: {'count', 'min', 'max', 'mean', 'p50', 'p90', 'p99', 'p999', ...}}（毫秒）
+            TimeitDecorator.render_prometheus() / TimeitDecorator.to_json() / TimeitDecorator.reset()
     注意：
         若同时使用@staticmethod注解
         或用@classmethod注解，它们应当先于@TimeitDecorator注解
     """
-    _elapsed_time = defaultdict(lambda: deque(maxlen=1))
+    registry = HistogramRegistry(unit='microseconds')     # key -> 耗时直方图（微秒）
+    slow_threshold = 500    # 默认慢调用阈值（毫秒）
+    slow_thresholds = {}    # key -> 慢调用阈值（毫秒）
 
     def __init__(self, *args, **kwargs):
         super(TimeitDecorator, self).__init__(*args, **kwargs)
 
+    @classmethod
+    def set_slow_threshold(cls, key, milliseconds: float = None):
+        """设置key的慢调用阈值（毫秒），None表示恢复默认"""
+        if milliseconds is None:
+            cls.slow_thresholds.pop(key, None)
+        else:
+            cls.slow_thresholds[key] = milliseconds
+
+    @classmethod
+    def snapshot(cls) -> dict:
+        """各key的耗时统计（毫秒）"""
+        return cls.registry.snapshot(scale=0.001)
+
+    @classmethod
+    def reset(cls, key=None):
+        cls.registry.reset(key)
+
+    @classmethod
+    def to_json(cls) -> str:
+        return cls.registry.to_json(scale=0.001)
+
+    @classmethod
+    def render_prometheus(cls, prefix: str = 'pylib_timeit') -> str:
+        """导出Prometheus文本格式（秒）：直方图中为微秒，按1e-6换算"""
+        return cls.registry.render_prometheus(prefix, scale=1e-6, unit='seconds')
+
     def _get_wrapper(self, instance=None, owner=None):
-        """获取装饰器函数"""
+        """获取装饰器函数；key与直方图在绑定时确定"""
+        key = self._get_key(instance, owner)    # 获取注解key
+        # 进行Key的转化；因为注解Key过长，如：Callback.temp.0xffffa3744790(func_id)，格式也不符合topic
+        # 取方法名作为key值
+        key = key.split('.')
+        key = '/'.join(key[-3:-1] or key)
+        histogram = TimeitDecorator.registry.get(key)
+
         @functools.wraps(self.callable_obj)
         def wrapper(*args, **kwargs):
-            start_time = time.time()    # 计时开始
-            key = self._get_key(instance, owner, *args, **kwargs)   # 获取注解key
-            # 进行Key的转化；因为注解Key过长，如：Callback.temp.0xffffa3744790(func_id)，格式也不符合topic
-            # 取方法名作为key值
-            key = key.split('.')
-            key = '/'.join(key[-3:-1] or key)
-
+            start_time = time.perf_counter()    # 计时开始
             try:    # 运行被注解的方法
                 args = (instance,) + args if instance is not None else args     # 实例方法时，要将实例插入元组args首位
                 return self.callable_obj(*args, **kwargs)
             finally:    # 计时结束
-                TimeitDecorator._elapsed_time[key].append(time.time() - start_time)
-                # log.debug('TimeitDecorator._elapsed_time',
-                #           {k: round(v[0] * 1000, 3) for k, v in dict(TimeitDecorator._elapsed_time).items()})
-                value = 1000 * sum(TimeitDecorator._elapsed_time[key]) / (
-                        float(len(TimeitDecorator._elapsed_time[key])) or 1)
-                log.debug('_elapsed_time', key, f"{round(value, 3)}ms", silence=value < 500, index=1)
+                elapsed = time.perf_counter() - start_time
+                histogram.record(elapsed * 1e6)
+                if elapsed * 1000 >= TimeitDecorator.slow_thresholds.get(key, TimeitDecorator.slow_threshold):
+                    log.debug('_elapsed_time', key, f"{round(elapsed * 1000, 3)}ms", index=1)
         return wrapper
@@ -0,0 +1,137 @@
+import json
+import threading
+
+
+class LogLinearHistogram:
+    """HDR风格的对数-线性直方图：内存固定，线程安全，相对误差约 1 / 2**sub_bucket_bits
+        值（整数，如微秒）按2的幂分段，每段再线性分为2**(sub_bucket_bits-1)个桶：
+            [0, 2**k)                   每个整数一个桶（精确）
+            [2**(k+s-1), 2**(k+s))      桶宽2**s
+        超出上限的值计入最后一个桶（min/max/sum仍然精确）。
+    """
+
+    def __init__(self, sub_bucket_bits: int = 7, max_shift: int = 30):
+        """
+        :params sub_bucket_bits: 每段的精度位数，7表示相对误差<1%
+        :params max_shift: 段数，可表示的上限为 2**(sub_bucket_bits + max_shift)
+        """
+        self._sub_buckets = 1 << sub_bucket_bits
+        self._half = self._sub_buckets >> 1
+        self._bits = sub_bucket_bits
+        self._counts = [0] * (self._sub_buckets + max_shift * self._half)
+        self._lock = threading.Lock()
+        self.count = self.total = 0
+        self.min = self.max = None
+
+    def _index(self, value: int) -> int:
+        if value < self._sub_buckets:
+            return value
+        shift = value.bit_length() - self._bits
+        index = self._sub_buckets + (shift - 1) * self._half + (value >> shift) - self._half
+        return min(index, len(self._counts) - 1)
+
+    def _value(self, index: int) -> float:
+        """桶的代表值（中点）"""
+        if index < self._sub_buckets:
+            return index
+        shift, offset = divmod(index - self._sub_buckets, self._half)
+        shift += 1
+        return ((offset + self._half) << shift) + (1 << shift) / 2
+
+    def record(self, value: int):
+        value = max(int(value), 0)
+        index = self._index(value)
+        with self._lock:
+            self._counts[index] += 1
+            self.count += 1
+            self.total += value
+            if self.min is None or value < self.min:
+                self.min = value
+            if self.max is None or value > self.max:
+                self.max = value
+
+    def percentiles(self, *quantiles) -> list:
+        """一次遍历计算多个分位数（quantiles为0~1，需升序）"""
+        with self._lock:
+            counts, count, low, high = list(self._counts), self.count, self.min, self.max
+        if not count:
+            return [None] * len(quantiles)
+        output, cumulative, targets = [], 0, iter(quantiles)
+        target = next(targets)
+        for index, cnt in enumerate(counts):
+            cumulative += cnt
+            while target is not None and cumulative >= max(target * count, 1):
+                output.append(min(max(self._value(index), low), high))
+                target = next(targets, None)
+            if target is None:
+                break
+        return output
+
+    def snapshot(self) -> dict:
+        p50, p90, p99, p999 = self.percentiles(0.5, 0.9, 0.99, 0.999)
+        with self._lock:
+            count, total, low, high = self.count, self.total, self.min, self.max
+        return {'count': count, 'sum': total, 'min': low, 'max': high, 'mean': total / count if count else None,
+                'p50': p50, 'p90': p90, 'p99': p99, 'p999': p999}
+
+    def reset(self):
+        with self._lock:
+            self._counts = [0] * len(self._counts)
+            self.count = self.total = 0
+            self.min = self.max = None
+
+
+class HistogramRegistry:
+    """按key管理直方图；值的单位由使用方决定（TimeitDecorator为微秒），导出时可按scale换算"""
+
+    def __init__(self, unit: str = 'us', **histogram_kwargs):
+        self.unit = unit
+        self._histogram_kwargs = histogram_kwargs
+        self._lock = threading.Lock()
+        self._histograms = {}
+
+    def get(self, key) -> LogLinearHistogram:
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, LogLinearHistogram(**self._histogram_kwargs))
+        return histogram
+
+    def record(self, key, value: int):
+        self.get(key).record(value)
+
+    def snapshot(self, scale: float = 1) -> dict:
+        """{key: {'count', 'sum', 'min', 'max', 'mean', 'p50', 'p90', 'p99', 'p999'}}，除count外的值乘以scale"""
+        output = {}
+        for key, histogram in list(self._histograms.items()):
+            stats = histogram.snapshot()
+            output[key] = {k: v if k == 'count' or v is None else v * scale for k, v in stats.items()}
+        return output
+
+    def reset(self, key=None):
+        """清空指定key或全部的统计"""
+        for name, histogram in list(self._histograms.items()):
+            if key is None or name == key:
+                histogram.reset()
+
+    def to_json(self, scale: float = 1) -> str:
+        return json.dumps(self.snapshot(scale), ensure_ascii=False)
+
+    @staticmethod
+    def _label(value) -> str:
+        return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+    def render_prometheus(self, prefix: str, scale: float = 1, unit: str = None) -> str:
+        """导出Prometheus文本格式（summary：分位数、_sum、_count）"""
+        unit = unit or self.unit
+        name = f"{prefix}_{unit}"
+        lines = [f"# HELP {name} Latency summary by key.", f"# TYPE {name} summary"]
+        for key, stats in sorted(self.snapshot(scale).items()):
+            if not stats['count']:
+                continue
+            label = self._label(key)
+            for quantile, field in (('0.5', 'p50'), ('0.9', 'p90'), ('0.99', 'p99'), ('0.999', 'p999')):
+                lines.append(f'{name}{{key="{label}",quantile="{quantile}"}} {stats[field]:g}')
+            lines.append(f'{name}_sum{{key="{label}"}} {stats["sum"]:g}')
+            lines.append(f'{name}_count{{key="{label}"}} {stats["count"]}')
+        return '\n'.join(lines) + '\n'
@@ -19,6 +19,8 @@ from xml.dom import minidom
 from xml.etree import ElementTree
 from datetime import datetime, timedelta, timezone
 
+from pylib.decorator.cache_decorator import CacheDecorator
+
 
 class Methods:
     @staticmethod
@@ -320,8 +322,9 @@ class Methods:
             return {}
 
     @staticmethod
+    @CacheDecorator
     def get_system_info():
-        """判断当前系统
+        """判断当前系统（进程内缓存）
         1. Parallels
         2. native Ubuntu machine
         3. Docker container
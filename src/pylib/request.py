@@ -1,14 +1,237 @@
 import re
+import json
+import time
+import codecs
+import functools
+import threading
 import requests
+import urllib.parse
+
+from collections import namedtuple
 
 from pylib.log import log
 from pylib.methods import Methods
 from pylib.decorator.time_decorator import TimeitDecorator
 
 
+class _RequestMetrics:
+    """按接口模板统计HTTP请求指标
+    /projects/123/pipelines/456 归一化为 /projects/:id/pipelines/:id 后，
+    统计次数、按状态码分类的次数、响应字节数、耗时直方图；支持快照与Prometheus文本格式导出"""
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)   # 耗时直方图桶上界（秒）
+    _name_parents = {'branches', 'protected_branches', 'tags', 'protected_tags', 'files'}   # 其后一段为名称的路径
+    _ref_parents = {'commits', 'blobs', 'statuses'}     # 其后一段为ref（完整/短sha、分支名）的路径
+    _sha_re = re.compile(r'^(?:[0-9a-f]{40}|[0-9a-f]{64})$')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}    # (method, endpoint) -> 指标
+
+    @classmethod
+    def normalize(cls, url: str) -> str:
+        """将URL归一化为接口模板：数字 -> :id，完整sha -> :sha，commits等之后的ref -> :ref，分支/标签/文件名 -> :name"""
+        segments = urllib.parse.urlsplit(url).path.rstrip('/').split('/')
+        for i, segment in enumerate(segments):
+            if i > 0 and segments[i - 1] in cls._ref_parents:   # 短sha、分支名等不能逐个成为标签
+                segments[i] = ':ref'
+            elif i > 0 and segments[i - 1] in cls._name_parents:
+                segments[i] = ':name'
+            elif segment.isdigit():
+                segments[i] = ':id'
+            elif cls._sha_re.match(segment):
+                segments[i] = ':sha'
+            elif '%2F' in segment.upper():     # URL编码的项目路径，如group%2Fproject
+                segments[i] = ':path'
+        return '/'.join(segments) or '/'
+
+    def observe(self, method: str, url: str, elapsed: float, response=None, stream=False):
+        """记录一次请求；response为None表示请求抛出了异常"""
+        endpoint = self.normalize(url)
+        if response is None:
+            status_class = 'exception'
+            size = 0
+        else:
+            status_class = f"{response.status_code // 100}xx"
+            size = response.headers.get('Content-Length')
+            size = int(size) if size and size.isdigit() else (0 if stream else len(response.content or b''))
+
+        with self._lock:
+            metric = self._endpoints.get((method, endpoint))
+            if metric is None:
+                metric = self._endpoints[(method, endpoint)] = {
+                    'count': 0, 'status': {}, 'bytes': 0, 'latency_sum': 0.0,
+                    'latency_buckets': [0] * (len(self.buckets) + 1),    # 最后一个为+Inf
+                }
+            metric['count'] += 1
+            metric['status'][status_class] = metric['status'].get(status_class, 0) + 1
+            metric['bytes'] += size
+            metric['latency_sum'] += elapsed
+            index = next((i for i, bound in enumerate(self.buckets) if elapsed <= bound), len(self.buckets))
+            metric['latency_buckets'][index] += 1
+
+    def snapshot(self) -> list:
+        """获取指标快照，按总耗时倒序（最耗时的接口在前）"""
+        with self._lock:
+            items = [(key, {**metric, 'status': dict(metric['status']),
+                            'latency_buckets': list(metric['latency_buckets'])})
+                     for key, metric in self._endpoints.items()]
+        output = []
+        for (method, endpoint), metric in items:
+            cumulative, buckets = 0, {}
+            for bound, cnt in zip(self.buckets + (float('inf'),), metric['latency_buckets']):
+                cumulative += cnt
+                buckets['+Inf' if bound == float('inf') else str(bound)] = cumulative
+            output.append({
+                'method': method,
+                'endpoint': endpoint,
+                'count': metric['count'],
+                'status': metric['status'],
+                'errors': sum(v for k, v in metric['status'].items() if k in ['4xx', '5xx', 'exception']),
+                'bytes': metric['bytes'],
+                'latency_sum': metric['latency_sum'],
+                'latency_avg': metric['latency_sum'] / metric['count'],
+                'latency_buckets': buckets,
+            })
+        return sorted(output, key=lambda m: m['latency_sum'], reverse=True)
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+
+    @staticmethod
+    def _labels(**labels) -> str:
+        """Prometheus标签转义：反斜杠、双引号、换行"""
+        escaped = [(k, str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')) for k, v in labels.items()]
+        return '{' + ','.join(f'{k}="{v}"' for k, v in escaped) + '}'
+
+    def render_prometheus(self, prefix: str = 'pylib_http') -> str:
+        """导出Prometheus文本格式（text/plain; version=0.0.4）"""
+        snapshot = self.snapshot()
+        lines = [f"# HELP {prefix}_requests_total HTTP requests by endpoint template and status class.",
+                 f"# TYPE {prefix}_requests_total counter"]
+        for m in snapshot:
+            for status_class, cnt in sorted(m['status'].items()):
+                lines.append(f"{prefix}_requests_total"
+                             f"{self._labels(method=m['method'], endpoint=m['endpoint'], status_class=status_class)} {cnt}")
+        lines += [f"# HELP {prefix}_response_bytes_total HTTP response body bytes by endpoint template.",
+                  f"# TYPE {prefix}_response_bytes_total counter"]
+        for m in snapshot:
+            lines.append(f"{prefix}_response_bytes_total"
+                         f"{self._labels(method=m['method'], endpoint=m['endpoint'])} {m['bytes']}")
+        lines += [f"# HELP {prefix}_request_duration_seconds HTTP request latency by endpoint template.",
+                  f"# TYPE {prefix}_request_duration_seconds histogram"]
+        for m in snapshot:
+            for le, cnt in m['latency_buckets'].items():
+                lines.append(f"{prefix}_request_duration_seconds_bucket"
+                             f"{self._labels(method=m['method'], endpoint=m['endpoint'], le=le)} {cnt}")
+            labels = self._labels(method=m['method'], endpoint=m['endpoint'])
+            lines.append(f"{prefix}_request_duration_seconds_sum{labels} {m['latency_sum']}")
+            lines.append(f"{prefix}_request_duration_seconds_count{labels} {m['count']}")
+        return '\n'.join(lines) + '\n'
+
+
+@functools.lru_cache(maxsize=None)
+def record_type(*fields):
+    """按字段列表生成紧凑记录类型（namedtuple，无__dict__），同一字段列表复用同一类型
+    缺失的字段为None"""
+    return namedtuple('Record', fields, defaults=(None,) * len(fields))
+
+
+class _JsonArrayStream:
+    """流式解析响应体中的JSON数组：边下载边逐个解码数组元素，峰值内存与单个元素成正比，而非整页响应体
+    使用方法：
+        stream = request.get_stream(url, fields=['id', 'name'])
+        for item in stream: ...
+        next_url = stream.links.get('next', {}).get('url')
+    """
+    _whitespace = ' \t\r\n'
+    _delimiter_re = re.compile(r'[ \t\r\n]*[,\]]')
+
+    def __init__(self, response, fields=None, chunk_size=64 * 1024):
+        self.response = response
+        self.fields = fields
+        self.chunk_size = chunk_size
+
+    @property
+    def links(self) -> dict:
+        return self.response.links
+
+    def _project(self, item):
+        """只保留需要的字段；fields为record_type生成的记录类型时，转为紧凑记录"""
+        if self.fields is None or not isinstance(item, dict):
+            return item
+        if isinstance(self.fields, type):
+            return self.fields._make(item.get(k) for k in self.fields._fields)
+        return {k: item[k] for k in self.fields if k in item}
+
+    def close(self):
+        """释放连接；未迭代（如状态码非200）时需调用"""
+        self.response.close()
+
+    def _parse_rest(self, text, chunks, decoder):
+        """普通方式解析整个响应体：数组逐个产出，其他JSON值作为单个元素产出"""
+        text += ''.join(decoder.decode(chunk) for chunk in chunks) + decoder.decode(b'', final=True)
+        value = json.loads(text)
+        if isinstance(value, list):
+            yield from (self._project(item) for item in value)
+        else:
+            yield self._project(value)
+
+    def __iter__(self):
+        chunks = self.response.iter_content(chunk_size=self.chunk_size)
+        decoder = codecs.getincrementaldecoder('utf-8')()     # 处理被切分在两个chunk之间的多字节字符
+        raw_decode = json.JSONDecoder().raw_decode
+        buffer, pos, started, eof = '', 0, False, False
+        try:
+            while True:
+                # 0. 跳过空白与分隔符
+                while pos < len(buffer) and (buffer[pos] in self._whitespace or (started and buffer[pos] == ',')):
+                    pos += 1
+                # 1. 数据不足时继续读取
+                if pos >= len(buffer):
+                    if eof:
+                        if started:
+                            raise ValueError('JSON数组不完整')
+                        return
+                    chunk = next(chunks, None)
+                    eof = chunk is None
+                    buffer = buffer[pos:] + decoder.decode(chunk or b'', final=eof)
+                    pos = 0
+                    continue
+                # 2. 数组开始/结束
+                if not started:
+                    if buffer[pos] != '[':     # 不是数组（如错误信息对象）：读取剩余部分整体解析
+                        yield from self._parse_rest(buffer[pos:], chunks, decoder)
+                        return
+                    started, pos = True, pos + 1
+                    continue
+                if buffer[pos] == ']':
+                    return
+                # 3. 解码一个元素；元素不完整（或数字等可能被截断的标量位于末尾）时读取更多数据后重试
+                try:
+                    item, end = raw_decode(buffer, pos)
+                    # 数字等标量只有在其后出现分隔符时才确认完整，如 1.5e3 可能被截断为 1.5e
+                    incomplete = not isinstance(item, (dict, list, str)) and not self._delimiter_re.match(buffer, end)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                    item, end, incomplete = None, pos, True
+                if incomplete and not eof:
+                    chunk = next(chunks, None)
+                    eof = chunk is None
+                    buffer = buffer[pos:] + decoder.decode(chunk or b'', final=eof)
+                    pos = 0
+                    continue
+                buffer, pos = buffer[end:], 0   # 丢弃已解码部分，保证缓冲区只保留未解码数据
+                yield self._project(item)
+        finally:
+            self.response.close()
+
+
 class _Request:
     silence_list = ['jobs', 'trace', 'tags', 'nacos/v3/auth/user/login']
     silence_re_list = [r'pipelines/\d+$']
+    metrics = _RequestMetrics()
 
     @classmethod
     def _get_silence(cls, url: str) -> bool:
@@ -17,6 +240,16 @@ class _Request:
             any([re.search(pattern, url) for pattern in cls.silence_re_list])
         ])
 
+    @classmethod
+    def _send(cls, method: str, send_func, url: str, **kwargs):
+        """发送请求并按接口模板记录指标"""
+        response, start_time = None, time.time()
+        try:
+            response = send_func(url, **kwargs)
+            return response
+        finally:
+            cls.metrics.observe(method, url, time.time() - start_time, response, stream=kwargs.get('stream', False))
+
     @classmethod
     @TimeitDecorator
     def get(cls, url: str, headers: dict = None, params: dict = None, data: dict = None, **kwargs):
@@ -31,7 +264,7 @@ class _Request:
             'kwargs:', kwargs,
             Methods.get_stack_funcs(8),
             silence=cls._get_silence(url), index=2)
-        return requests.get(url, headers=headers or {}, params=params or {}, **kwargs)
+        return cls._send('GET', requests.get, url, headers=headers or {}, params=params or {}, **kwargs)
 
     @classmethod
     @TimeitDecorator
@@ -45,7 +278,7 @@ class _Request:
             'data:', data or {},
             'kwargs:', kwargs,
             silence=cls._get_silence(url), index=1)
-        return requests.post(url, headers=headers, params=params or {}, data=data, **kwargs)
+        return cls._send('POST', requests.post, url, headers=headers, params=params or {}, data=data, **kwargs)
 
     @classmethod
     @TimeitDecorator
@@ -59,6 +292,30 @@ class _Request:
             'data:', data or {},
             'kwargs:', kwargs,
             silence=cls._get_silence(url), index=1)
-        return requests.delete(url, headers=headers, params=params or {}, data=data, **kwargs)
+        return cls._send('DELETE', requests.delete, url, headers=headers, params=params or {}, data=data, **kwargs)
+
+    @classmethod
+    @TimeitDecorator
+    def put(cls, url: str, headers: dict = None, params: dict = None, data: dict = None, **kwargs):
+        """重新接管HTTP请求，用于打印调试日志"""
+        log.debug(
+            url,
+            'PUT',
+            'headers:', headers or {},
+            'params:', params or {},
+            'data:', data or {},
+            'kwargs:', kwargs,
+            silence=cls._get_silence(url), index=1)
+        return cls._send('PUT', requests.put, url, headers=headers, params=params or {}, data=data, **kwargs)
+
+    @classmethod
+    def get_stream(cls, url: str, headers: dict = None, params: dict = None, fields: list = None,
+                   chunk_size: int = 64 * 1024, **kwargs) -> _JsonArrayStream:
+        """GET请求，并流式解析响应体中的JSON数组
+        :params fields: 只保留的字段列表，None表示保留全部字段；传入record_type(...)时每个元素转为紧凑记录
+        :params chunk_size: 每次从网络读取的字节数
+        调用方需先检查 stream.response.status_code，非200时调用stream.close()释放连接"""
+        response = cls.get(url, headers=headers, params=params, stream=True, **kwargs)
+        return _JsonArrayStream(response, fields=fields, chunk_size=chunk_size)
 
 request = _Request
@@ -0,0 +1,254 @@
+# -*- coding:utf-8 -*-
+import os
+import struct
+import pickle
+import hashlib
+import threading
+import multiprocessing
+
+from collections.abc import MutableMapping
+from multiprocessing import shared_memory
+
+from pylib.log import log
+
+_MISSING = object()
+
+
+class SharedCallbackDict(MutableMapping):
+    """多进程共享的可回调字典：数据放在multiprocessing.shared_memory中，各进程直接读写同一份状态
+        1. 固定容量的开放寻址哈希表，每个槽位存放序列化后的key和value；每个槽位带一个seqlock版本号，
+           读无锁（版本号为奇数或前后不一致时重读，重读spin_limit次仍失败则持锁读取），写由跨进程的multiprocessing.Lock串行化。
+        2. 写入后把key发到一个非阻塞管道；只有调用了listen()的一个进程读取管道并回调，
+           回调的old_value取自该进程上次看到的值，因此同一key的连续修改会合并，且整个进程组只回调一次。
+           管道满（没有监听者或监听者太慢）时丢弃通知并置溢出标记，监听者发现后全量比对一次。
+        key和value需可pickle；单个槽位放不下时抛出ValueError，表满时抛出ValueError。
+        删除留下墓碑，容量按“历史上同时存在的key数”的2倍左右设置。
+    使用方法（在创建子进程之前创建，作为参数传给子进程，或由fork继承）：
+        state = SharedCallbackDict(capacity=4096, slot_size=1024)
+        state.listen(callback)      # 只在一个进程中调用
+        multiprocessing.Process(target=worker, args=(state,)).start()
+        state.close()               # 创建者关闭时释放共享内存
+    """
+    EMPTY, USED, DELETED = 0, 1, 2
+    _magic = b'PYLIBSCD'
+    _header = struct.Struct('<8sQQQQ')  # magic, capacity, slot_size, count, overflow
+    _header_size = 64
+    _slot = struct.Struct('<QQBxHI')    # seq, hash, state, key_len, value_len
+    _seq = struct.Struct('<Q')
+    _count_offset, _overflow_offset = 24, 32
+    max_key_size = 4000     # 通知需原子写入管道（PIPE_BUF）
+    spin_limit = 1000       # 无锁读的最多重读次数，超过后持锁读取（写入方被调度出去或停顿时不再空转）
+
+    def __init__(self, capacity: int = 1024, slot_size: int = 512, name: str = None, callback=None):
+        """
+        :params capacity: 槽位数
+        :params slot_size: 每个槽位的字节数（含24字节槽位头）
+        :params name: 共享内存名称，默认随机
+        :params callback: 回调，listen()后生效：callback(self, key=, value=, old_value=)，删除时value为None
+        """
+        self.capacity, self.slot_size = capacity, slot_size
+        self._shm = shared_memory.SharedMemory(name=name, create=True, size=self._header_size + capacity * slot_size)
+        self._header.pack_into(self._shm.buf, 0, self._magic, capacity, slot_size, 0, 0)
+        self._lock = multiprocessing.Lock()
+        self._reader, self._writer = multiprocessing.Pipe(duplex=False)
+        os.set_blocking(self._writer.fileno(), False)
+        self._owner_pid = os.getpid()
+        self._init_local(callback)
+
+    def _init_local(self, callback=None):
+        """进程内的状态（不跨进程共享）"""
+        self.callback = callback
+        self._known = {}    # 监听进程上次看到的值
+        self._stop = threading.Event()
+        self._listener = None
+
+    def __getstate__(self):
+        return {'name': self._shm.name, 'lock': self._lock, 'reader': self._reader, 'writer': self._writer,
+                'owner_pid': self._owner_pid}
+
+    def __setstate__(self, state):
+        self._shm = shared_memory.SharedMemory(name=state['name'])
+        magic, self.capacity, self.slot_size, _, _ = self._header.unpack_from(self._shm.buf, 0)
+        if magic != self._magic:
+            raise ValueError(f"不是SharedCallbackDict的共享内存: {state['name']}")
+        self._lock, self._reader, self._writer = state['lock'], state['reader'], state['writer']
+        self._owner_pid = state['owner_pid']
+        os.set_blocking(self._writer.fileno(), False)
+        self._init_local()
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    @staticmethod
+    def _hash(key_bytes: bytes) -> int:
+        """跨进程稳定的哈希（内置hash对str按进程随机化）"""
+        return int.from_bytes(hashlib.blake2b(key_bytes, digest_size=8).digest(), 'little')
+
+    def _offset(self, index: int) -> int:
+        return self._header_size + index * self.slot_size
+
+    def _read_slot(self, index: int):
+        """无锁读取槽位：返回(state, hash, key_bytes, value_bytes)
+        持有self._lock时没有并发的写入，版本号必为偶数且不变，第一次即可读到，不会进入持锁读取"""
+        buf, offset = self._shm.buf, self._offset(index)
+        data_start, data_end = offset + self._slot.size, offset + self.slot_size
+        for _ in range(self.spin_limit):
+            seq, key_hash, state, key_len, value_len = self._slot.unpack_from(buf, offset)
+            if seq & 1:     # 正在写
+                continue
+            data = bytes(buf[data_start:min(data_start + key_len + value_len, data_end)]) if state == self.USED else b''
+            if self._seq.unpack_from(buf, offset)[0] == seq:
+                return state, key_hash, data[:key_len], data[key_len:]
+        with self._lock:
+            _, key_hash, state, key_len, value_len = self._slot.unpack_from(buf, offset)
+            data = bytes(buf[data_start:min(data_start + key_len + value_len, data_end)]) if state == self.USED else b''
+            return state, key_hash, data[:key_len], data[key_len:]
+
+    def _write_slot(self, index: int, state: int, key_hash: int = 0, key_bytes: bytes = b'', value_bytes: bytes = b''):
+        """写槽位（需持有self._lock）：版本号先变奇数，写完再变偶数"""
+        buf, offset = self._shm.buf, self._offset(index)
+        seq = self._seq.unpack_from(buf, offset)[0]
+        self._seq.pack_into(buf, offset, seq + 1)
+        data_start = offset + self._slot.size
+        buf[data_start:data_start + len(key_bytes) + len(value_bytes)] = key_bytes + value_bytes
+        self._slot.pack_into(buf, offset, seq + 1, key_hash, state, len(key_bytes), len(value_bytes))
+        self._seq.pack_into(buf, offset, seq + 2)
+
+    def _probe(self, key_bytes: bytes, key_hash: int):
+        """线性探测：返回(key所在的槽位或None, value_bytes或None, 第一个可写入的空闲槽位或None)"""
+        free = None
+        start = key_hash % self.capacity
+        for i in range(self.capacity):
+            index = (start + i) % self.capacity
+            state, slot_hash, slot_key, slot_value = self._read_slot(index)
+            if state == self.EMPTY:
+                return None, None, index if free is None else free
+            if state == self.DELETED:
+                free = index if free is None else free
+            elif slot_hash == key_hash and slot_key == key_bytes:
+                return index, slot_value, free
+        return None, None, free
+
+    def _add_count(self, delta: int):
+        count = self._seq.unpack_from(self._shm.buf, self._count_offset)[0]
+        self._seq.pack_into(self._shm.buf, self._count_offset, count + delta)
+
+    def _publish(self, key_bytes: bytes):
+        """通知监听者；管道满时置溢出标记"""
+        try:
+            self._writer.send_bytes(key_bytes)
+        except BlockingIOError:
+            self._seq.pack_into(self._shm.buf, self._overflow_offset, 1)
+
+    def __getitem__(self, key):
+        key_bytes = pickle.dumps(key)
+        index, value_bytes, _ = self._probe(key_bytes, self._hash(key_bytes))
+        if index is None:
+            raise KeyError(key)
+        return pickle.loads(value_bytes)
+
+    def __setitem__(self, key, value):
+        key_bytes, value_bytes = pickle.dumps(key), pickle.dumps(value)
+        if len(key_bytes) > self.max_key_size or self._slot.size + len(key_bytes) + len(value_bytes) > self.slot_size:
+            raise ValueError(f"SharedCallbackDict槽位放不下: key {len(key_bytes)} bytes, value {len(value_bytes)} bytes, "
+                             f"slot_size {self.slot_size}")
+        key_hash = self._hash(key_bytes)
+        with self._lock:
+            index, old_bytes, free = self._probe(key_bytes, key_hash)
+            if old_bytes == value_bytes:
+                return
+            if index is None:
+                if free is None:
+                    raise ValueError(f"SharedCallbackDict已满: capacity {self.capacity}")
+                index = free
+                self._add_count(1)
+            self._write_slot(index, self.USED, key_hash, key_bytes, value_bytes)
+        self._publish(key_bytes)
+
+    def __delitem__(self, key):
+        key_bytes = pickle.dumps(key)
+        with self._lock:
+            index, _, _ = self._probe(key_bytes, self._hash(key_bytes))
+            if index is None:
+                raise KeyError(key)
+            self._write_slot(index, self.DELETED)
+            self._add_count(-1)
+        self._publish(key_bytes)
+
+    def __iter__(self):
+        for index in range(self.capacity):
+            state, _, key_bytes, _ = self._read_slot(index)
+            if state == self.USED:
+                yield pickle.loads(key_bytes)
+
+    def __len__(self):
+        return self._seq.unpack_from(self._shm.buf, self._count_offset)[0]
+
+    def items(self):
+        """一次遍历读出所有键值（比逐个key查找快）"""
+        for index in range(self.capacity):
+            state, _, key_bytes, value_bytes = self._read_slot(index)
+            if state == self.USED:
+                yield pickle.loads(key_bytes), pickle.loads(value_bytes)
+
+    def to_dict(self) -> dict:
+        return dict(self.items())
+
+    def listen(self, callback=None):
+        """在本进程的后台线程中接收修改通知并回调；整个进程组只应有一个进程监听"""
+        self.callback = callback or self.callback
+        self._known = self.to_dict()    # 已有的状态不回调
+        self._stop.clear()
+        self._listener = threading.Thread(target=self._listen_loop, name='shared_callback_dict', daemon=True)
+        self._listener.start()
+        return self
+
+    def _listen_loop(self):
+        while not self._stop.is_set():
+            try:
+                if not self._reader.poll(0.2):
+                    continue
+                key = pickle.loads(self._reader.recv_bytes())
+            except (EOFError, OSError):
+                return
+            if self._seq.unpack_from(self._shm.buf, self._overflow_offset)[0]:
+                self._seq.pack_into(self._shm.buf, self._overflow_offset, 0)
+                self._rescan()
+            self._check(key)
+
+    def _check(self, key, value=_MISSING):
+        """与上次看到的值比较，变化时回调"""
+        value = self.get(key, _MISSING) if value is _MISSING else value
+        old_value = self._known.get(key, _MISSING)
+        if value is _MISSING and old_value is _MISSING or value == old_value:
+            return
+        if value is _MISSING:
+            self._known.pop(key)
+        else:
+            self._known[key] = value
+        if self.callback is None:
+            return
+        try:
+            self.callback(self, key=key, value=None if value is _MISSING else value,
+                          old_value=None if old_value is _MISSING else old_value)
+        except Exception as e:
+            log.exception('SharedCallbackDict回调异常', key, e=e)
+
+    def _rescan(self):
+        """通知有丢失：全量比对"""
+        current = self.to_dict()
+        for key in list(self._known):
+            if key not in current:
+                self._check(key, _MISSING)
+        for key, value in current.items():
+            self._check(key, value)
+
+    def close(self):
+        """停止监听并关闭共享内存；创建者进程同时释放共享内存"""
+        self._stop.set()
+        if self._listener is not None and self._listener is not threading.current_thread():
+            self._listener.join()
+        self._shm.close()
+        if os.getpid() == self._owner_pid:
+            self._shm.unlink()
@@ -0,0 +1,374 @@
+import io
+import re
+import sys
+import copy
+import json
+import time
+import timeit
+import pickle
+import tarfile
+import threading
+import tracemalloc
+import urllib.parse
+import multiprocessing
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from pylib.request import request, record_type, _JsonArrayStream
+from pylib.api.gitlab_api import GitlabApi
+from pylib.api.gitlab_graphql import GitlabGraphql
+from pylib.callback_dict import CallbackDict
+from pylib.callback_tree import CallbackTree
+from pylib.shared_callback_dict import SharedCallbackDict
+from pylib.decorator.decorator import Decorator
+from pylib.decorator.time_decorator import TimeitDecorator
+
+
+class _BytesResponse:
+    """以内存中的bytes模拟流式响应"""
+    def __init__(self, content: bytes, chunk_size=64 * 1024):
+        self.content = content
+        self.chunk_size = chunk_size
+
+    def iter_content(self, chunk_size=None):
+        chunk_size = chunk_size or self.chunk_size
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def close(self):
+        pass
+
+
+class _FakeGitlab(ThreadingHTTPServer):
+    """本地模拟的GitLab：提供repository/archive.tar.gz、repository/files/<path>/raw与/api/graphql，每个请求固定延迟，统计请求数"""
+    daemon_threads = True
+
+    def __init__(self, files: dict, latency: float):
+        self.files = files
+        self.latency = latency
+        self.requests = 0
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode='w:gz') as tar:
+            for path, content in files.items():
+                info = tarfile.TarInfo(f"project-main-0123abcd/{path}")
+                info.size = len(content)
+                tar.addfile(info, io.BytesIO(content))
+        self.archive = buffer.getvalue()
+        super().__init__(('127.0.0.1', 0), _FakeGitlabHandler)
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}/api/v4"
+
+    @staticmethod
+    def graphql(document: str, variables: dict) -> dict:
+        """模拟GraphQL：与GitLab一样拒绝声明但未使用的变量；每个别名p<i>返回一个项目，分支存在、无合并请求、最新流水线成功"""
+        header, _, selection = document.partition(')')
+        unused = [name for name in re.findall(r'\$(\w+):', header) if not re.search(rf'\${name}\b', selection)]
+        if unused:
+            return {'errors': [{'message': f"Variable ${name} is declared by anonymous query but not used"}
+                               for name in unused]}
+        data = {}
+        for index in re.findall(r'\bp(\d+): project\(', selection):
+            source = variables.get(f"s{index}")
+            project = {'id': f"gid://gitlab/Project/{index}"}
+            if 'branch: repository' in selection:
+                project['branch'] = {'branchNames': [source], 'tree': {'lastCommit': {'sha': '0123abcd', 'title': 'init'}}}
+            if 'mergeRequests(' in selection:
+                project['mergeRequests'] = {'nodes': []}
+            if 'pipelines(' in selection:
+                project['pipelines'] = {'nodes': [{
+                    'id': f"gid://gitlab/Ci::Pipeline/{index}", 'iid': '1', 'status': 'SUCCESS', 'sha': '0123abcd',
+                    'ref': source, 'createdAt': '2024-01-01T00:00:00Z', 'updatedAt': '2024-01-01T00:01:00Z',
+                    'path': f"/group/project-{index}/-/pipelines/{index}"}]}
+            data[f"p{index}"] = project
+        return {'data': data}
+
+
+class _FakeGitlabHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.requests += 1
+        time.sleep(server.latency)
+        path = urllib.parse.urlsplit(self.path).path
+        if path.endswith('/repository/archive.tar.gz'):
+            body = server.archive
+        else:
+            body = server.files.get(urllib.parse.unquote(path.split('/repository/files/', 1)[-1][:-len('/raw')]))
+        self.send_response(200 if body is not None else 404)
+        self.send_header('Content-Length', str(len(body or b'')))
+        self.end_headers()
+        self.wfile.write(body or b'')
+
+    def do_POST(self):
+        server = self.server
+        server.requests += 1
+        time.sleep(server.latency)
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        found = urllib.parse.urlsplit(self.path).path == '/api/graphql'
+        body = json.dumps(server.graphql(payload['query'], payload.get('variables') or {})).encode() if found else b''
+        self.send_response(200 if found else 404)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _shared_dict_worker(state, worker_id, writes):
+    """SharedCallbackDict的写入进程：循环改写50个key，最后删除一个key并写完成标记"""
+    for i in range(writes):
+        state[f"w{worker_id}.k{i % 50}"] = {'v': i, 'w': worker_id}
+    del state[f"w{worker_id}.k0"]
+    state[f"done{worker_id}"] = True
+
+
+class Benchmark:
+    @staticmethod
+    def _measure(func):
+        """返回(结果, 耗时秒, 常驻内存字节, 峰值内存字节)"""
+        tracemalloc.start()
+        start_time = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start_time
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return result, elapsed, current, peak
+
+    @staticmethod
+    def _fake_project(i):
+        """模拟GitLab /projects返回的完整项目对象"""
+        return {
+            "id": i, "description": f"project {i} description", "name": f"project-{i}",
+            "name_with_namespace": f"Group {i % 50} / project-{i}", "path": f"project-{i}",
+            "path_with_namespace": f"group-{i % 50}/project-{i}", "created_at": "2024-01-01T00:00:00.000Z",
+            "default_branch": "main", "tag_list": [], "topics": [],
+            "ssh_url_to_repo": f"git@gitlab.example.com:group-{i % 50}/project-{i}.git",
+            "http_url_to_repo": f"https://gitlab.example.com/group-{i % 50}/project-{i}.git",
+            "web_url": f"https://gitlab.example.com/group-{i % 50}/project-{i}",
+            "readme_url": None, "forks_count": 0, "avatar_url": None, "star_count": 0,
+            "last_activity_at": "2024-01-01T00:00:00.000Z",
+            "namespace": {"id": i % 50, "name": f"Group {i % 50}", "path": f"group-{i % 50}", "kind": "group",
+                          "full_path": f"group-{i % 50}", "parent_id": None, "avatar_url": None,
+                          "web_url": f"https://gitlab.example.com/groups/group-{i % 50}"},
+            "container_registry_image_prefix": f"registry.example.com/group-{i % 50}/project-{i}",
+            "_links": {k: f"https://gitlab.example.com/api/v4/projects/{i}/{k}"
+                       for k in ["self", "issues", "merge_requests", "repo_branches", "labels", "events", "members"]},
+            "packages_enabled": True, "empty_repo": False, "archived": False, "visibility": "private",
+            "resolve_outdated_diff_discussions": False, "container_registry_enabled": True,
+            "issues_enabled": True, "merge_requests_enabled": True, "wiki_enabled": True, "jobs_enabled": True,
+            "snippets_enabled": True, "shared_runners_enabled": True, "creator_id": 1, "open_issues_count": 0,
+            "ci_default_git_depth": 20, "public_jobs": True, "build_timeout": 3600, "auto_cancel_pending_pipelines": "enabled",
+            "shared_with_groups": [], "only_allow_merge_if_pipeline_succeeds": False, "request_access_enabled": True,
+            "permissions": {"project_access": None, "group_access": {"access_level": 30, "notification_level": 3}},
+        }
+
+    @classmethod
+    def slim_projects(cls, n=10000):
+        """slim模式：每1万个项目的内存占用（完整dict vs 紧凑记录）"""
+        content = json.dumps([cls._fake_project(i) for i in range(n)]).encode()
+        fields = record_type('id', 'path_with_namespace', 'default_branch')
+
+        full, full_elapsed, full_current, full_peak = cls._measure(lambda: json.loads(content))
+        del full
+        slim, slim_elapsed, slim_current, slim_peak = cls._measure(
+            lambda: list(_JsonArrayStream(_BytesResponse(content), fields=fields)))
+        print(f"slim_projects: {n} projects, response body {len(content) / 1024 / 1024:.1f} MiB")
+        print(f"  full dicts   : retained {full_current / 1024 / 1024:8.2f} MiB, "
+              f"peak {full_peak / 1024 / 1024:8.2f} MiB, {full_elapsed:.3f}s")
+        print(f"  slim records : retained {slim_current / 1024 / 1024:8.2f} MiB, "
+              f"peak {slim_peak / 1024 / 1024:8.2f} MiB, {slim_elapsed:.3f}s")
+
+    @staticmethod
+    def _per_write(func, writes):
+        """返回每次写入的平均耗时（微秒）"""
+        start_time = time.perf_counter()
+        for i in range(writes):
+            func(i)
+        return (time.perf_counter() - start_time) / writes * 1e6
+
+    @classmethod
+    def nested_tree(cls, robots=1000, fields=10, writes=2000):
+        """嵌套状态树：robots x fields 个叶子，逐个修改叶子并回调"""
+        state = {f"r{r}": {f"f{f}": 0 for f in range(fields)} for r in range(robots)}
+        noop = lambda *args, **kwargs: None     # noqa: E731
+
+        def deepcopy_setdict(i):    # 旧的setdict：每次深拷贝整个子树以得到old_value
+            old_value = copy.deepcopy(legacy['robots'])
+            old_value.update({f"r{i % robots}": {**old_value[f"r{i % robots}"], 'f0': i}})
+            legacy['robots'] = old_value
+
+        legacy = CallbackDict(noop, {'robots': copy.deepcopy(state)})
+        shallow = CallbackDict(noop, {'robots': copy.deepcopy(state)})
+        tree = CallbackTree(noop, {'robots': state})
+        tree_snap = CallbackTree(noop, {'robots': state})
+        results = {
+            'CallbackDict deepcopy setdict': cls._per_write(deepcopy_setdict, max(writes // 20, 1)),
+            'CallbackDict setdict': cls._per_write(
+                lambda i: shallow.setdict('robots', {f"r{i % robots}": {**shallow['robots'][f"r{i % robots}"], 'f0': i}}),
+                writes),
+            'CallbackTree set': cls._per_write(lambda i: tree.set(('robots', f"r{i % robots}", 'f0'), i), writes),
+            'CallbackTree set + snapshot': cls._per_write(
+                lambda i: (tree_snap.snapshot(), tree_snap.set(('robots', f"r{i % robots}", 'f0'), i)), writes),
+        }
+        print(f"nested_tree: {robots * fields} leaves, one leaf per write")
+        for name, per_write in results.items():
+            print(f"  {name:30s}: {per_write:10.1f} us/write")
+
+    @staticmethod
+    def decorator_overhead(number=200000):
+        """装饰器调用开销：每次“取方法+调用”的纳秒数，与未装饰的方法对比"""
+        class Target:
+            def plain(self, x):
+                return x
+
+            @Decorator
+            def decorated(self, x):
+                return x
+
+            @classmethod
+            @Decorator
+            def decorated_classmethod(cls, x):
+                return x
+
+            @TimeitDecorator
+            def timed(self, x):
+                return x
+
+            @classmethod
+            @TimeitDecorator
+            def timed_classmethod(cls, x):
+                return x
+
+        target = Target()
+        unbound = Target.__dict__['decorated']
+        cases = {
+            'undecorated': lambda: target.plain(1),
+            'Decorator': lambda: target.decorated(1),
+            'Decorator (new wrapper per access)': lambda: unbound._get_wrapper(target, Target)(1),
+            'Decorator classmethod': lambda: Target.decorated_classmethod(1),
+            'TimeitDecorator': lambda: target.timed(1),
+            'TimeitDecorator classmethod': lambda: Target.timed_classmethod(1),
+        }
+        baseline = None
+        print(f"decorator_overhead: best of 5 x {number} calls")
+        for name, func in cases.items():
+            per_call = min(timeit.repeat(func, number=number, repeat=5)) / number * 1e9
+            baseline = per_call if baseline is None else baseline
+            print(f"  {name:40s}: {per_call:8.0f} ns/call (+{per_call - baseline:6.0f} ns)")
+        TimeitDecorator.reset()
+
+    @staticmethod
+    def archive_files(n=200, size=2048, latency_ms=20):
+        """批量获取仓库文件：逐个请求raw文件 vs 下载归档，对比耗时与请求数（本地模拟服务，每个请求固定延迟）"""
+        files = {f"config/app-{i}/settings.yaml": (f"key-{i}: value\n" * (size // 16))[:size].encode() for i in range(n)}
+        server = _FakeGitlab(files, latency_ms / 1000)
+        url, threshold, silence_list = GitlabApi.url, GitlabApi.archive_threshold, request.silence_list
+        GitlabApi.url, request.silence_list = server.url, silence_list + ['raw', 'archive.tar.gz']
+        results = {}
+        try:
+            for name, archive_threshold in [('per-file loop', n), ('archive', threshold)]:
+                GitlabApi.archive_threshold = archive_threshold
+                server.requests = 0
+                start_time = time.perf_counter()
+                output = GitlabApi.get_project_files_bulk(1, 'main', files=list(files))
+                results[name] = (time.perf_counter() - start_time, server.requests, len(output) == n)
+        finally:
+            GitlabApi.url, GitlabApi.archive_threshold, request.silence_list = url, threshold, silence_list
+            server.shutdown()
+            server.server_close()
+        print(f"archive_files: {n} files x {size} bytes, {latency_ms}ms latency per request")
+        for name, (elapsed, requests, complete) in results.items():
+            print(f"  {name:15s}: {requests:5d} requests, {elapsed:8.3f}s{'' if complete else ' (incomplete)'}")
+
+    @staticmethod
+    def graphql_lookup(n=100, latency_ms=20):
+        """GraphQL批量查询：对比各字段组合下的请求数与REST的请求数（本地模拟服务，每个请求固定延迟）；
+        模拟服务拒绝声明但未使用的变量，结果不完整即说明生成的查询文档有误"""
+        server = _FakeGitlab({}, latency_ms / 1000)
+        silence_list = request.silence_list
+        request.silence_list = silence_list + ['graphql']
+        items = [(f"group/project-{i}", 'dev', 'main') for i in range(n)]
+        results = {}
+        try:
+            graphql = GitlabGraphql(url=server.url.replace('/api/v4', '/api/graphql'))
+            for flags in [(True, True, True), (True, False, False), (False, False, True), (False, False, False)]:
+                server.requests = 0
+                start_time = time.perf_counter()
+                output = graphql.lookup(items, *flags)
+                results[flags] = (time.perf_counter() - start_time, server.requests, n * sum(flags),
+                                  len(output) == n and all(item is not None for item in output))
+        finally:
+            request.silence_list = silence_list
+            server.shutdown()
+            server.server_close()
+        print(f"graphql_lookup: {n} projects, {latency_ms}ms latency per request")
+        for (branch, merge_requests, pipeline), (elapsed, requests, rest, complete) in results.items():
+            name = f"branch={branch:d} mr={merge_requests:d} pipeline={pipeline:d}"
+            print(f"  {name:30s}: {requests:5d} requests (REST {rest:5d}), {elapsed:8.3f}s"
+                  f"{'' if complete else ' (incomplete)'}")
+
+    @staticmethod
+    def shared_dict(processes=4, writes=2000):
+        """SharedCallbackDict跨进程读写：多个进程并发写入，本进程同时无锁读取；
+        校验监听回调的最终值与共享状态一致，并模拟写入方停顿（版本号停在奇数）时读取转为持锁等待而不是空转"""
+        state = SharedCallbackDict(capacity=1024, slot_size=256)
+        last = {}
+        state.listen(lambda d, key, value, old_value: last.__setitem__(key, value))
+        try:
+            workers = [multiprocessing.Process(target=_shared_dict_worker, args=(state, i, writes))
+                       for i in range(processes)]
+            start_time = time.perf_counter()
+            for worker in workers:
+                worker.start()
+            reads = 0
+            while any(worker.is_alive() for worker in workers):
+                state.get('w0.k1')
+                reads += 1
+            elapsed = time.perf_counter() - start_time
+            for worker in workers:
+                worker.join()
+            expected = state.to_dict()
+
+            def seen():
+                return {key: value for key, value in last.items() if value is not None}
+            deadline = time.time() + 5
+            while seen() != expected and time.time() < deadline:   # 等待监听线程处理完通知
+                time.sleep(0.05)
+            consistent = seen() == expected
+
+            # 写入方停顿：持锁并让版本号停在奇数，读取自旋spin_limit次后等待锁
+            key_bytes = pickle.dumps('w0.k1')
+            index, _, _ = state._probe(key_bytes, state._hash(key_bytes))
+            offset = state._offset(index)
+            with state._lock:
+                seq = state._seq.unpack_from(state._shm.buf, offset)[0]
+                state._seq.pack_into(state._shm.buf, offset, seq + 1)
+                reader = threading.Thread(target=state.get, args=('w0.k1',))
+                stall_start = time.perf_counter()
+                reader.start()
+                time.sleep(0.2)
+                state._seq.pack_into(state._shm.buf, offset, seq)
+            reader.join(5)
+            stalled = time.perf_counter() - stall_start
+        finally:
+            state.close()
+        print(f"shared_dict: {processes} processes x {writes} writes, {multiprocessing.get_start_method()}")
+        print(f"  writes: {processes * writes / elapsed:10.0f} /s, concurrent reads: {reads / elapsed:10.0f} /s, "
+              f"callbacks consistent: {consistent}")
+        print(f"  stalled writer (0.2s): read returned after {stalled:.3f}s{'' if not reader.is_alive() else ' (hung)'}")
+
+    @classmethod
+    def run(cls, names=None):
+        for name in names or ['slim_projects', 'nested_tree', 'decorator_overhead', 'archive_files', 'graphql_lookup',
+                              'shared_dict']:
+            getattr(cls, name)()
+
+
+if __name__ == "__main__":
+    Benchmark.run(sys.argv[1:])